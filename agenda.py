@@ -0,0 +1,376 @@
+import logging
+import math
+from datetime import datetime, timedelta, time
+from flask import current_app
+from sqlalchemy import (and_, any_, bindparam, column, exists, func, insert, literal_column, or_, select,
+                        update, values, DateTime)
+from sqlalchemy.dialects.postgresql import ARRAY
+from aplicacao import db
+from modelos import Agendamento, Empresa, Funcionario, SerieAgendamento, funcionario_servicos
+from periodos import agora_local, agora_na_empresa, periodo_dia
+from disponibilidade import fora_da_jornada, na_jornada
+
+# Quantos dias à frente as séries recorrentes são convertidas em agendamentos
+HORIZONTE_SERIES_DIAS = 90
+
+# Tamanho dos lotes da finalização automática (linhas por transação)
+LOTE_FINALIZACAO = 500
+
+# Campos da série que mudam as datas/horários das ocorrências
+CAMPOS_REGRA_SERIE = ('funcionario_id', 'servico_id', 'data_inicio', 'intervalo_semanas', 'data_termino')
+
+
+def horizonte_series(agora=None):
+    """Até quando as séries são materializadas, a partir de `agora` (padrão: agora na empresa atual)."""
+    agora = agora or agora_local()
+    return agora + timedelta(days=current_app.config.get('HORIZONTE_SERIES_DIAS', HORIZONTE_SERIES_DIAS))
+
+
+def horarios_em_conflito(funcionario_id, inicios, duracao_minutos):
+    """
+    Verifica de uma só vez quais horários colidem com agendamentos ativos do funcionário.
+    Os horários candidatos viram uma lista VALUES unida à tabela de agendamentos, então
+    uma série inteira custa uma única consulta. Retorna o conjunto de inícios em conflito.
+    """
+    if not inicios:
+        return set()
+
+    duracao = timedelta(minutes=duracao_minutos)
+    horarios = values(column('inicio', DateTime), column('fim', DateTime), name='horarios')\
+        .data([(inicio, inicio + duracao) for inicio in inicios])
+
+    consulta = select(horarios.c.inicio).distinct().select_from(horarios).join(
+        Agendamento,
+        and_(
+            Agendamento.funcionario_id == funcionario_id,
+            Agendamento.status == 'agendado',
+            Agendamento.data_agendamento < horarios.c.fim,
+            Agendamento.data_fim > horarios.c.inicio
+        )
+    )
+    return set(db.session.execute(consulta).scalars())
+
+
+def travar_funcionario(funcionario_id, esperar=True):
+    """
+    Trava a linha do funcionário (SELECT ... FOR UPDATE) até o fim da transação.
+    Quem vai marcar um horário trava o funcionário antes de verificar conflitos, então
+    duas reservas simultâneas para ele são feitas uma depois da outra e a segunda enxerga
+    a primeira. Com esperar=False retorna None se outra transação já o travou.
+    """
+    return db.session.execute(
+        select(Funcionario).where(Funcionario.id == funcionario_id)
+        .with_for_update(skip_locked=not esperar)
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+
+
+def escolher_funcionario(servico_id, inicio, duracao_minutos):
+    """
+    Modo "qualquer funcionário": escolhe, entre os funcionários ativos que atendem o
+    serviço, trabalham e estão livres em [inicio, inicio + duração), o que tem menos
+    minutos agendados no dia (empate: menos atendimentos, depois o menor id).
+
+    Uma única consulta soma, por funcionário, os minutos do dia e os agendamentos que
+    colidem com o horário. Os candidatos são travados em ordem com SKIP LOCKED (quem está
+    sendo reservado por outra requisição agora fica de fora, sem espera nem deadlock) e o
+    conflito é conferido de novo depois do lock, já que a contagem pode ter mudado.
+    Retorna o funcionário travado ou None se ninguém estiver livre. Não faz commit.
+    """
+    fim = inicio + timedelta(minutes=duracao_minutos)
+    # inicio já é a hora local da empresa (periodos.py): o dia é a própria data
+    dia = periodo_dia(inicio.date())
+
+    no_dia = and_(Agendamento.data_agendamento >= dia.inicio, Agendamento.data_agendamento < dia.fim)
+    minutos = func.coalesce(func.sum(Agendamento.duracao_minutos).filter(no_dia), 0)
+    atendimentos = func.count(Agendamento.id).filter(no_dia)
+    conflitos = func.count(Agendamento.id).filter(
+        and_(Agendamento.data_agendamento < fim, Agendamento.data_fim > inicio)
+    )
+    associado = funcionario_servicos.c.funcionario_id == Funcionario.id
+    atende = or_(
+        exists().where(associado, funcionario_servicos.c.servico_id == servico_id),
+        ~exists().where(associado),
+    )
+    ranking = (
+        select(Funcionario.id, Funcionario.jornada_versao)
+        .outerjoin(Agendamento, and_(
+            Agendamento.funcionario_id == Funcionario.id,
+            Agendamento.status == 'agendado',
+            Agendamento.data_agendamento < max(fim, dia.fim),
+            Agendamento.data_fim > min(inicio, dia.inicio),
+        ))
+        .where(Funcionario.ativo.is_(True), atende)
+        .group_by(Funcionario.id)
+        .having(conflitos == 0)
+        .order_by(minutos, atendimentos, Funcionario.id)
+    )
+
+    candidatos = db.session.execute(ranking).all()
+    # Jornada conferida nos mapas de bits em cache (disponibilidade.py)
+    trabalhando = na_jornada(candidatos, inicio, duracao_minutos)
+    for funcionario_id, _ in candidatos:
+        if funcionario_id not in trabalhando:
+            continue
+        funcionario = travar_funcionario(funcionario_id, esperar=False)
+        if funcionario is not None and not horarios_em_conflito(funcionario_id, [inicio], duracao_minutos):
+            return funcionario
+    return None
+
+
+def ocorrencias_serie(serie, desde, ate):
+    """Gera os inícios das ocorrências da série no intervalo [desde, ate)."""
+    passo = timedelta(weeks=serie.intervalo_semanas)
+    if serie.data_termino:
+        ate = min(ate, datetime.combine(serie.data_termino + timedelta(days=1), time.min))
+
+    indice = 0 if desde <= serie.data_inicio else math.ceil((desde - serie.data_inicio) / passo)
+    ocorrencia = serie.data_inicio + indice * passo
+    while ocorrencia < ate:
+        yield ocorrencia
+        ocorrencia += passo
+
+
+def materializar_serie(serie, desde, ate):
+    """
+    Converte as ocorrências da série em [desde, ate) em linhas de agendamentos: uma consulta
+    de conflitos para todas as ocorrências e um único INSERT em lote para as livres.
+    Ocorrências fora da jornada do funcionário também contam como conflito.
+    Retorna (quantidade criada, lista de horários em conflito). Não faz commit.
+    """
+    servico = serie.servico
+    inicios = list(ocorrencias_serie(serie, desde, ate))
+    conflitos = horarios_em_conflito(serie.funcionario_id, inicios, servico.duracao_minutos)
+    conflitos |= fora_da_jornada(serie.funcionario, inicios, servico.duracao_minutos)
+
+    linhas = [
+        {
+            'cliente_id': serie.cliente_id,
+            'funcionario_id': serie.funcionario_id,
+            'data_agendamento': inicio,
+            'data_fim': inicio + timedelta(minutes=servico.duracao_minutos),
+            'servico': servico.nome,
+            'servico_id': servico.id,
+            'duracao_minutos': servico.duracao_minutos,
+            'preco_total': servico.preco,
+            'observacoes': serie.observacoes,
+            'serie_id': serie.id,
+            'empresa_id': serie.empresa_id,
+        }
+        for inicio in inicios if inicio not in conflitos
+    ]
+    if linhas:
+        db.session.execute(insert(Agendamento), linhas)
+
+    serie.materializado_ate = max(ate, serie.materializado_ate or ate)
+    return len(linhas), sorted(conflitos)
+
+
+def criar_serie(**campos):
+    """
+    Cria uma série recorrente e materializa as ocorrências até o horizonte.
+    Se alguma ocorrência conflitar, nada é gravado e os horários em conflito são retornados.
+    Retorna (serie, criadas, conflitos).
+    """
+    serie = SerieAgendamento(**campos)
+    db.session.add(serie)
+    db.session.flush()
+
+    criadas, conflitos = materializar_serie(serie, serie.data_inicio, horizonte_series())
+    if conflitos:
+        db.session.rollback()
+        return None, 0, conflitos
+
+    db.session.commit()
+    return serie, criadas, []
+
+
+def atualizar_serie(serie, **campos):
+    """
+    Aplica alterações à série e propaga para as ocorrências futuras ainda agendadas.
+
+    Mudanças na regra (horário, intervalo, funcionário, serviço, término) cancelam as
+    ocorrências futuras com um UPDATE e as recriam com um INSERT em lote; as demais
+    alterações viram um único UPDATE. As ocorrências são canceladas, e não apagadas, para
+    que a sincronização incremental do calendário (`since`) também as veja sumir; os
+    horários que a nova regra não ocupa vão para a lista de espera. Em caso de conflito
+    nada é gravado. Retorna (quantidade de ocorrências afetadas, conflitos).
+    """
+    from lista_espera import ofertar_vagas_canceladas
+    mudou_regra = any(getattr(serie, campo) != valor for campo, valor in campos.items()
+                      if campo in CAMPOS_REGRA_SERIE)
+    for campo, valor in campos.items():
+        setattr(serie, campo, valor)
+
+    agora = agora_local()
+    futuras = and_(
+        Agendamento.serie_id == serie.id,
+        Agendamento.status == 'agendado',
+        Agendamento.data_agendamento >= agora
+    )
+
+    if not mudou_regra:
+        resultado = db.session.execute(
+            update(Agendamento).where(futuras).values(observacoes=serie.observacoes)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return resultado.rowcount, []
+
+    canceladas = db.session.execute(
+        update(Agendamento).where(futuras).values(status='cancelado')
+        .returning(Agendamento.id, Agendamento.funcionario_id, Agendamento.data_agendamento,
+                   Agendamento.duracao_minutos)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.flush()
+    serie.materializado_ate = None
+    criadas, conflitos = materializar_serie(serie, agora, horizonte_series())
+    if conflitos:
+        db.session.rollback()
+        return 0, conflitos
+
+    # Horários que as novas ocorrências voltaram a ocupar não são ofertados
+    ocupados = set()
+    for funcionario_id, duracao in {(linha.funcionario_id, linha.duracao_minutos) for linha in canceladas}:
+        inicios = [linha.data_agendamento for linha in canceladas
+                   if (linha.funcionario_id, linha.duracao_minutos) == (funcionario_id, duracao)]
+        ocupados |= {(funcionario_id, inicio) for inicio in horarios_em_conflito(funcionario_id, inicios, duracao)}
+    ofertar_vagas_canceladas([linha.id for linha in canceladas
+                              if (linha.funcionario_id, linha.data_agendamento) not in ocupados])
+    db.session.commit()
+    return criadas, []
+
+
+def encerrar_serie(serie):
+    """
+    Desativa a série e cancela, em um único UPDATE, as ocorrências futuras ainda agendadas;
+    os horários liberados vão para a lista de espera.
+    """
+    from lista_espera import ofertar_vagas_canceladas
+    serie.ativa = False
+    canceladas = db.session.execute(
+        update(Agendamento).where(
+            and_(
+                Agendamento.serie_id == serie.id,
+                Agendamento.status == 'agendado',
+                Agendamento.data_agendamento >= agora_local()
+            )
+        ).values(status='cancelado').returning(Agendamento.id).execution_options(synchronize_session=False)
+    ).scalars().all()
+    ofertar_vagas_canceladas(canceladas)
+    db.session.commit()
+    return len(canceladas)
+
+
+def expandir_series():
+    """
+    Avança o horizonte de todas as séries ativas (tarefa agendada). Ocorrências que
+    conflitam com agendamentos existentes ou saem da jornada são puladas e registradas no log.
+    Retorna a quantidade de agendamentos criados.
+    """
+    # O horizonte de cada série conta a partir do "agora" no fuso da sua empresa; a busca
+    # usa um limite folgado (UTC mais um dia cobre qualquer fuso) e o exato é conferido abaixo
+    horizontes = {}
+    series = SerieAgendamento.query.filter(
+        SerieAgendamento.ativa.is_(True),
+        db.or_(SerieAgendamento.materializado_ate.is_(None),
+               SerieAgendamento.materializado_ate < horizonte_series(datetime.utcnow() + timedelta(days=1)))
+    ).all()
+
+    total = 0
+    for serie in series:
+        if serie.empresa_id not in horizontes:
+            horizontes[serie.empresa_id] = horizonte_series(agora_na_empresa(serie.empresa_id))
+        ate = horizontes[serie.empresa_id]
+        if serie.materializado_ate is not None and serie.materializado_ate >= ate:
+            continue
+        desde = max(serie.materializado_ate or serie.data_inicio, serie.data_inicio)
+        criadas, conflitos = materializar_serie(serie, desde, ate)
+        db.session.commit()
+        total += criadas
+        if conflitos:
+            logging.warning(f"Série {serie.id}: {len(conflitos)} ocorrência(s) ignorada(s) por conflito de horário")
+    return total
+
+
+def filtro_autorizacao_agendamentos(usuario):
+    """
+    Condição SQL com os agendamentos que o usuário pode alterar: master altera todos,
+    funcionário os seus atendimentos e cliente os próprios agendamentos.
+    """
+    if usuario.is_master():
+        return literal_column('TRUE')
+    if usuario.is_funcionario():
+        return Agendamento.funcionario_id == usuario.perfil_funcionario.id
+    return Agendamento.cliente_id == usuario.id
+
+
+def filtro_autorizacao_series(usuario):
+    """Condição SQL com as séries que o usuário pode ver e alterar (mesma regra dos agendamentos)."""
+    if usuario.is_master():
+        return literal_column('TRUE')
+    if usuario.is_funcionario():
+        return SerieAgendamento.funcionario_id == usuario.perfil_funcionario.id
+    return SerieAgendamento.cliente_id == usuario.id
+
+
+def atualizar_status_em_lote(ids, status, usuario):
+    """
+    Altera o status de vários agendamentos com um único UPDATE ... WHERE id = ANY(...).
+    A autorização de cada linha faz parte do WHERE; ids sem permissão simplesmente não
+    são alterados. Retorna a lista de ids atualizados. Não faz commit.
+    """
+    if not ids:
+        return []
+
+    resultado = db.session.execute(
+        update(Agendamento)
+        .where(
+            and_(
+                Agendamento.id == any_(bindparam('ids', value=list(ids), type_=ARRAY(db.Integer))),
+                filtro_autorizacao_agendamentos(usuario)
+            )
+        )
+        .values(status=status)
+        .returning(Agendamento.id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(resultado.scalars())
+
+
+def finalizar_agendamentos_vencidos(status_final='concluido', tolerancia=timedelta(hours=1), lote=LOTE_FINALIZACAO):
+    """
+    Tarefa agendada: muda para status_final ('concluido' ou 'nao_compareceu') os agendamentos
+    que ainda estão 'agendado' mas terminaram há mais de `tolerancia`.
+
+    Trabalha em lotes pequenos pelo índice parcial de pendentes, com commit a cada lote e
+    FOR UPDATE SKIP LOCKED, para não segurar locks longos nem disputar linhas em edição.
+    Os horários são locais, então cada empresa usa o "agora" do seu fuso.
+    Retorna a quantidade de agendamentos alterados.
+    """
+    total = 0
+    for empresa_id in db.session.execute(select(Empresa.id).order_by(Empresa.id)).scalars().all():
+        limite = agora_na_empresa(empresa_id) - tolerancia
+        while True:
+            alvo = select(Agendamento.id).where(
+                and_(
+                    Agendamento.empresa_id == empresa_id,
+                    Agendamento.status == 'agendado',
+                    Agendamento.data_agendamento < limite,
+                    Agendamento.data_fim <= limite
+                )
+            ).order_by(Agendamento.data_agendamento).limit(lote).with_for_update(skip_locked=True)
+
+            resultado = db.session.execute(
+                update(Agendamento)
+                .where(Agendamento.id.in_(alvo.scalar_subquery()))
+                .values(status=status_final)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.commit()
+            # Lote curto pode ser só linhas travadas por outra transação: para no lote vazio
+            if not resultado.rowcount:
+                break
+            total += resultado.rowcount
+    return total
@@ -0,0 +1,302 @@
+from datetime import datetime, timedelta
+from flask import current_app, g
+from sqlalchemy import (Column, Date, DateTime, Float, Integer, MetaData, String, Table, and_, cast, column,
+                        func, select, text, true, values)
+from aplicacao import db
+from cache import CacheTTL
+from modelos import Agendamento, Funcionario, Servico, Usuario
+from periodos import periodo as periodo_dias
+from disponibilidade import jornada_padrao, minutos_na_jornada
+
+# Relatórios analíticos calculados inteiramente no banco: cada relatório é uma
+# única consulta (generate_series para a grade de dias/horas, FILTER e funções de
+# janela para os indicadores) que devolve linhas prontas para o template.
+
+# Status que ocupam a agenda do funcionário (o horário ficou reservado)
+STATUS_OCUPAM_AGENDA = ('agendado', 'concluido', 'nao_compareceu')
+
+# Resultados por (empresa, relatório, parâmetros); pedidos simultâneos calculam uma vez só
+cache_relatorios = CacheTTL(capacidade=256, ttl=300)
+
+
+def relatorio_em_cache(nome, calcular, *parametros):
+    """Executa `calcular()` pelo cache de relatórios, separado por empresa."""
+    chave = (g.get('empresa_id'), nome) + parametros
+    ttl = current_app.config.get('RELATORIOS_CACHE_SEGUNDOS')
+    return cache_relatorios.obter_ou_calcular(chave, calcular, ttl)
+
+
+def _no_periodo(periodo):
+    return and_(Agendamento.data_agendamento >= periodo.inicio, Agendamento.data_agendamento < periodo.fim)
+
+
+def utilizacao_funcionarios(periodo):
+    """
+    Utilização de cada funcionário ativo no período (periodos.Periodo): minutos reservados
+    contra minutos disponíveis na jornada, taxa de cancelamento e posição no ranking.
+    """
+    # Minutos de jornada de cada funcionário, somados dos mapas de bits (disponibilidade.py)
+    # e levados à consulta como uma lista VALUES
+    ativos = db.session.execute(
+        select(Funcionario.id, Funcionario.jornada_versao).where(Funcionario.ativo.is_(True))
+    ).all()
+    if not ativos:
+        return []
+    minutos_jornada = minutos_na_jornada(ativos, periodo)
+    jornada = values(column('funcionario_id', Integer), column('minutos', Integer), name='jornada')\
+        .data([(funcionario_id, minutos_jornada[funcionario_id]) for funcionario_id, _ in ativos])
+    minutos_disponiveis = jornada.c.minutos
+
+    agregados = select(
+        Agendamento.funcionario_id,
+        func.sum(Agendamento.duracao_minutos).filter(Agendamento.status.in_(STATUS_OCUPAM_AGENDA))
+            .label('minutos_reservados'),
+        func.count().label('total'),
+        func.count().filter(Agendamento.status == 'cancelado').label('cancelados'),
+        func.count().filter(Agendamento.status == 'nao_compareceu').label('faltas'),
+    ).where(_no_periodo(periodo)).group_by(Agendamento.funcionario_id).subquery()
+
+    reservados = func.coalesce(agregados.c.minutos_reservados, 0)
+    ocupacao = cast(reservados, Float) / func.nullif(minutos_disponiveis, 0)
+    consulta = select(
+        Funcionario.id.label('funcionario_id'),
+        Usuario.nome,
+        reservados.label('minutos_reservados'),
+        minutos_disponiveis.label('minutos_disponiveis'),
+        ocupacao.label('ocupacao'),
+        func.coalesce(agregados.c.total, 0).label('total'),
+        func.coalesce(agregados.c.cancelados, 0).label('cancelados'),
+        func.coalesce(agregados.c.faltas, 0).label('faltas'),
+        (cast(agregados.c.cancelados, Float) / func.nullif(agregados.c.total, 0)).label('taxa_cancelamento'),
+        # Participação no total de minutos reservados da equipe e posição no ranking de ocupação
+        (cast(reservados, Float) / func.nullif(func.sum(reservados).over(), 0)).label('participacao'),
+        func.rank().over(order_by=reservados.desc()).label('posicao'),
+    ).join(Usuario, Usuario.id == Funcionario.usuario_id)\
+     .join(jornada, jornada.c.funcionario_id == Funcionario.id)\
+     .outerjoin(agregados, agregados.c.funcionario_id == Funcionario.id)\
+     .where(Funcionario.ativo.is_(True))\
+     .order_by(reservados.desc(), Usuario.nome)
+
+    return [linha._asdict() for linha in db.session.execute(consulta)]
+
+
+def mapa_ocupacao(periodo, funcionario_id=None):
+    """
+    Agendamentos por dia da semana e hora (locais) no período, numa grade completa
+    (células vazias com zero) cobrindo a jornada e qualquer horário com movimento.
+    `intensidade` vai de 0 a 1 em relação à célula mais cheia.
+    """
+    _, hora_inicio, hora_fim = jornada_padrao()
+    dia_semana = cast(func.extract('isodow', Agendamento.data_agendamento), Integer)
+    hora = cast(func.extract('hour', Agendamento.data_agendamento), Integer)
+
+    filtros = [_no_periodo(periodo), Agendamento.status.in_(STATUS_OCUPAM_AGENDA)]
+    if funcionario_id:
+        filtros.append(Agendamento.funcionario_id == funcionario_id)
+    contagem = select(dia_semana.label('dia_semana'), hora.label('hora'), func.count().label('quantidade'))\
+        .where(*filtros).group_by(dia_semana, hora).cte('contagem')
+
+    dias = func.generate_series(1, 7).table_valued('dia_semana').render_derived()
+    horas = func.generate_series(
+        func.least(hora_inicio, select(func.min(contagem.c.hora)).scalar_subquery()),
+        func.greatest(hora_fim - 1, select(func.max(contagem.c.hora)).scalar_subquery()),
+    ).table_valued('hora').render_derived()
+
+    quantidade = func.coalesce(contagem.c.quantidade, 0)
+    consulta = select(
+        dias.c.dia_semana,
+        horas.c.hora,
+        quantidade.label('quantidade'),
+        func.coalesce(cast(quantidade, Float) / func.nullif(func.max(contagem.c.quantidade).over(), 0), 0)
+            .label('intensidade'),
+    ).select_from(
+        dias.join(horas, true()).outerjoin(
+            contagem, and_(contagem.c.dia_semana == dias.c.dia_semana, contagem.c.hora == horas.c.hora)
+        )
+    ).order_by(horas.c.hora, dias.c.dia_semana)
+
+    return [linha._asdict() for linha in db.session.execute(consulta)]
+
+
+# --- Receita -----------------------------------------------------------------
+#
+# Os relatórios de receita leem visões materializadas (migração 0009) em vez de
+# agregar agendamentos a cada pedido: receita_diaria (empresa, dia, serviço,
+# funcionário) e receita_mensal_clientes (empresa, mês, cliente), com dias e meses
+# locais tirados direto de data_agendamento. As visões são atualizadas por REFRESH ...
+# CONCURRENTLY, que não bloqueia as leituras, pelo comando `flask atualizar-receita`
+# (cron) e depois das tarefas que gravam agendamentos em lote. Elas cobrem só a
+# tabela principal de agendamentos; o que já foi arquivado (particoes.py) fica fora.
+#
+# As visões não são modelos do ORM, então o filtro automático por empresa
+# (tenancia.py) não se aplica: toda consulta filtra empresa_id explicitamente.
+
+_metadata_visoes = MetaData()
+
+receita_diaria = Table(
+    'receita_diaria', _metadata_visoes,
+    Column('empresa_id', Integer),
+    Column('dia', Date),
+    Column('servico_id', Integer),  # 0 = agendamento sem serviço cadastrado
+    Column('funcionario_id', Integer),
+    Column('receita', Float),
+    Column('receita_prevista', Float),
+    Column('atendimentos', Integer),
+    Column('cancelados', Integer),
+)
+
+receita_mensal_clientes = Table(
+    'receita_mensal_clientes', _metadata_visoes,
+    Column('empresa_id', Integer),
+    Column('mes', Date),
+    Column('cliente_id', Integer),
+    Column('receita', Float),
+    Column('receita_prevista', Float),
+    Column('atendimentos', Integer),
+    Column('cancelados', Integer),
+)
+
+visoes_atualizadas = Table(
+    'visoes_atualizadas', _metadata_visoes,
+    Column('nome', String(100), primary_key=True),
+    Column('atualizada_em', DateTime),
+)
+
+VISOES_RECEITA = ('receita_diaria', 'receita_mensal_clientes')
+
+# Dimensões do relatório de receita; 'cliente' usa a visão mensal, as demais a diária
+DIMENSOES_RECEITA = ('servico', 'funcionario', 'cliente', 'dia', 'mes')
+
+
+def atualizar_visoes_receita(conn):
+    """
+    Recalcula as visões de receita sem bloquear quem está lendo e registra o
+    horário em visoes_atualizadas. Não faz commit.
+    """
+    for nome in VISOES_RECEITA:
+        conn.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {nome}'))
+        conn.execute(text(
+            "INSERT INTO visoes_atualizadas (nome, atualizada_em) VALUES (:nome, :agora) "
+            "ON CONFLICT (nome) DO UPDATE SET atualizada_em = excluded.atualizada_em"
+        ), {'nome': nome, 'agora': datetime.utcnow()})
+
+
+def receita_atualizada_em():
+    """Horário da atualização mais antiga entre as visões de receita (None se nunca atualizadas)."""
+    return db.session.execute(
+        select(func.min(visoes_atualizadas.c.atualizada_em))
+        .where(visoes_atualizadas.c.nome.in_(VISOES_RECEITA))
+    ).scalar()
+
+
+def _da_empresa(tabela):
+    # Fora de requisição (comandos de terminal) não há empresa atual: considera todas
+    empresa_id = g.get('empresa_id')
+    return true() if empresa_id is None else tabela.c.empresa_id == empresa_id
+
+
+def receita_periodo_efetivo(dimensao, periodo):
+    """Período consultado; a visão de clientes é mensal, então usa meses inteiros."""
+    if dimensao != 'cliente':
+        return periodo
+    ultimo_mes = periodo.ultimo_dia.replace(day=1)
+    return periodo_dias(periodo.de.replace(day=1), (ultimo_mes + timedelta(days=32)).replace(day=1))
+
+
+def _agregados_visoes(dimensao, periodo, servico_id=None, funcionario_id=None):
+    de, ate, _, _ = receita_periodo_efetivo(dimensao, periodo)
+    if dimensao == 'cliente':
+        visao = receita_mensal_clientes
+        chave = visao.c.cliente_id
+        filtros = [visao.c.mes >= de, visao.c.mes < ate]
+    else:
+        visao = receita_diaria
+        chave = {
+            'servico': visao.c.servico_id,
+            'funcionario': visao.c.funcionario_id,
+            'dia': visao.c.dia,
+            'mes': cast(func.date_trunc('month', visao.c.dia), Date),
+        }[dimensao]
+        filtros = [visao.c.dia >= de, visao.c.dia < ate]
+        if servico_id is not None:
+            filtros.append(visao.c.servico_id == servico_id)
+        if funcionario_id is not None:
+            filtros.append(visao.c.funcionario_id == funcionario_id)
+
+    return select(
+        chave.label('chave'),
+        func.sum(visao.c.receita).label('receita'),
+        func.sum(visao.c.receita_prevista).label('receita_prevista'),
+        cast(func.sum(visao.c.atendimentos), Integer).label('atendimentos'),
+        cast(func.sum(visao.c.cancelados), Integer).label('cancelados'),
+    ).where(_da_empresa(visao), *filtros).group_by(chave).subquery()
+
+
+def _agregados_diretos(dimensao, periodo, servico_id=None, funcionario_id=None):
+    """Mesmo resultado de _agregados_visoes, agregando direto em agendamentos (referência do benchmark)."""
+    chave = {
+        'servico': func.coalesce(Agendamento.servico_id, 0),
+        'funcionario': Agendamento.funcionario_id,
+        'cliente': Agendamento.cliente_id,
+        'dia': cast(Agendamento.data_agendamento, Date),
+        'mes': cast(func.date_trunc('month', Agendamento.data_agendamento), Date),
+    }[dimensao]
+    filtros = [_no_periodo(receita_periodo_efetivo(dimensao, periodo))]
+    if dimensao != 'cliente':
+        if servico_id is not None:
+            filtros.append(func.coalesce(Agendamento.servico_id, 0) == servico_id)
+        if funcionario_id is not None:
+            filtros.append(Agendamento.funcionario_id == funcionario_id)
+
+    return select(
+        chave.label('chave'),
+        func.coalesce(func.sum(Agendamento.preco_total).filter(Agendamento.status == 'concluido'), 0)
+            .label('receita'),
+        func.coalesce(func.sum(Agendamento.preco_total).filter(Agendamento.status == 'agendado'), 0)
+            .label('receita_prevista'),
+        cast(func.count().filter(Agendamento.status == 'concluido'), Integer).label('atendimentos'),
+        cast(func.count().filter(Agendamento.status == 'cancelado'), Integer).label('cancelados'),
+    ).where(*filtros).group_by(chave).subquery()
+
+
+def _relatorio_receita(agregados, dimensao):
+    """Acrescenta aos agregados o rótulo de cada linha, ticket médio e participação na receita."""
+    consulta = select(
+        agregados.c.chave,
+        agregados.c.receita,
+        agregados.c.receita_prevista,
+        agregados.c.atendimentos,
+        agregados.c.cancelados,
+        (agregados.c.receita / func.nullif(agregados.c.atendimentos, 0)).label('ticket_medio'),
+        (agregados.c.receita / func.nullif(func.sum(agregados.c.receita).over(), 0)).label('participacao'),
+    ).select_from(agregados)
+
+    if dimensao == 'servico':
+        consulta = consulta.outerjoin(Servico, Servico.id == agregados.c.chave)\
+            .add_columns(func.coalesce(Servico.nome, 'Sem serviço cadastrado').label('rotulo'))
+    elif dimensao == 'funcionario':
+        consulta = consulta.outerjoin(Funcionario, Funcionario.id == agregados.c.chave)\
+            .outerjoin(Usuario, Usuario.id == Funcionario.usuario_id).add_columns(Usuario.nome.label('rotulo'))
+    elif dimensao == 'cliente':
+        consulta = consulta.outerjoin(Usuario, Usuario.id == agregados.c.chave)\
+            .add_columns(Usuario.nome.label('rotulo'))
+    else:
+        return consulta.add_columns(agregados.c.chave.label('rotulo')).order_by(agregados.c.chave)
+    return consulta.order_by(agregados.c.receita.desc(), agregados.c.chave)
+
+
+def receita_por(dimensao, periodo, servico_id=None, funcionario_id=None, direto=False):
+    """
+    Receita no período (periodos.Periodo) agrupada por `dimensao` (ver DIMENSOES_RECEITA), lida das
+    visões materializadas. `servico_id` e `funcionario_id` restringem o detalhamento.
+
+    A visão de clientes é mensal: com dimensao='cliente' o período é ampliado para os
+    meses inteiros que o cobrem (receita_periodo_efetivo) e os filtros de serviço e
+    funcionário não se aplicam.
+    `direto=True` agrega a tabela de agendamentos (para comparação).
+    """
+    if dimensao not in DIMENSOES_RECEITA:
+        raise ValueError(f'Dimensão inválida: {dimensao}')
+    agregar = _agregados_diretos if direto else _agregados_visoes
+    agregados = agregar(dimensao, periodo, servico_id, funcionario_id)
+    return [linha._asdict() for linha in db.session.execute(_relatorio_receita(agregados, dimensao))]
@@ -0,0 +1,239 @@
+from datetime import datetime
+from flask import Blueprint, Response, request, stream_with_context
+from flask_login import current_user
+from sqlalchemy import and_, select
+from sqlalchemy.orm import aliased
+from aplicacao import db
+from modelos import Usuario, Funcionario, Cargo, Servico, Agendamento
+from agenda import filtro_autorizacao_agendamentos
+from limitador import chave_requisicao, limitador, segundos_retry_after
+from replica import somente_leitura
+from serializacao import Recurso, para_json
+
+# API JSON versionada (/api/v1) para o aplicativo móvel e o bot.
+#
+#   GET /api/v1/<recurso>?fields=id,nome&limit=100&after=<id>
+#   GET /api/v1/<recurso>/<id>?fields=...
+#
+# As listas são paginadas por cursor (`after` = último id recebido, resposta traz `next`)
+# e enviadas em streaming, lidas do banco em lotes, sem montar a resposta inteira em memória.
+# A autenticação é a mesma sessão de login do sistema.
+
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 10000
+
+# Linhas lidas do banco (cursor no servidor) e enviadas por vez
+LOTE_STREAMING = 500
+
+Cliente = aliased(Usuario, name='cliente')
+
+RECURSOS = {
+    'clientes': Recurso(
+        'clientes', Usuario,
+        campos={
+            'id': Usuario.id,
+            'nome': Usuario.nome,
+            'username': Usuario.username,
+            'email': Usuario.email,
+            'telefone': Usuario.telefone,
+            'ativo': Usuario.ativo,
+            'criado_em': Usuario.criado_em,
+        },
+        filtro=lambda usuario: and_(Usuario.tipo_usuario == 'restrito', Usuario.perfil_funcionario == None,
+                                    Usuario.excluido_em.is_(None)),
+    ),
+    'funcionarios': Recurso(
+        'funcionarios', Funcionario,
+        campos={
+            'id': Funcionario.id,
+            'usuario_id': Funcionario.usuario_id,
+            'nome': Usuario.nome,
+            'email': Usuario.email,
+            'telefone': Usuario.telefone,
+            'cargo_id': Funcionario.cargo_id,
+            'cargo': Cargo.nome,
+            'data_contratacao': Funcionario.data_contratacao,
+            'ativo': Funcionario.ativo,
+        },
+        padrao=['id', 'nome', 'cargo', 'ativo'],
+        juncoes={
+            'nome': [(Usuario, Usuario.id == Funcionario.usuario_id)],
+            'email': [(Usuario, Usuario.id == Funcionario.usuario_id)],
+            'telefone': [(Usuario, Usuario.id == Funcionario.usuario_id)],
+            'cargo': [(Cargo, Cargo.id == Funcionario.cargo_id)],
+        },
+        # Clientes listam os funcionários para agendar, mas não veem os contatos deles
+        privados=['email', 'telefone'],
+        ver_privados=lambda usuario: usuario.is_master() or usuario.is_funcionario(),
+    ),
+    'servicos': Recurso(
+        'servicos', Servico,
+        campos={
+            'id': Servico.id,
+            'nome': Servico.nome,
+            'descricao': Servico.descricao,
+            'preco': Servico.preco,
+            'duracao_minutos': Servico.duracao_minutos,
+            'ativo': Servico.ativo,
+        },
+    ),
+    'agendamentos': Recurso(
+        'agendamentos', Agendamento,
+        campos={
+            'id': Agendamento.id,
+            'cliente_id': Agendamento.cliente_id,
+            'cliente': Cliente.nome,
+            'funcionario_id': Agendamento.funcionario_id,
+            'data_agendamento': Agendamento.data_agendamento,
+            'data_fim': Agendamento.data_fim,
+            'duracao_minutos': Agendamento.duracao_minutos,
+            'status': Agendamento.status,
+            'servico': Agendamento.servico,
+            'servico_id': Agendamento.servico_id,
+            'preco_total': Agendamento.preco_total,
+            'observacoes': Agendamento.observacoes,
+            'serie_id': Agendamento.serie_id,
+            'atualizado_em': Agendamento.atualizado_em,
+        },
+        padrao=['id', 'cliente_id', 'funcionario_id', 'data_agendamento', 'data_fim', 'status', 'servico_id'],
+        juncoes={'cliente': [(Cliente, Cliente.id == Agendamento.cliente_id)]},
+        filtro=filtro_autorizacao_agendamentos,
+    ),
+}
+
+# Permissão exigida para ler cada recurso (master lê todos)
+PERMISSOES_API = {
+    'clientes': 'pode_cadastrar_cliente',
+    'funcionarios': 'pode_agendar',
+    'servicos': 'pode_agendar',
+    'agendamentos': 'pode_ver_agendamentos',
+}
+
+
+def erro_json(mensagem, status):
+    return Response(para_json({'erro': mensagem}), status=status, mimetype='application/json')
+
+
+def resposta_json(dados, status=200):
+    return Response(para_json(dados), status=status, mimetype='application/json')
+
+
+@api_v1.before_request
+def exigir_login():
+    if not current_user.is_authenticated:
+        return erro_json('Autenticação necessária.', 401)
+    espera = limitador.consumir('api', chave_requisicao('usuario'))
+    if espera is not None:
+        resposta = erro_json('Limite de requisições excedido.', 429)
+        resposta.headers['Retry-After'] = segundos_retry_after(espera)
+        return resposta
+
+
+def _obter_recurso(nome):
+    """Retorna (recurso, resposta de erro); o erro é None quando o acesso é permitido."""
+    recurso = RECURSOS.get(nome)
+    if recurso is None:
+        return None, erro_json('Recurso não encontrado.', 404)
+    if not current_user.is_master() and not getattr(current_user, PERMISSOES_API[nome], False):
+        return None, erro_json('Você não tem permissão para acessar este recurso.', 403)
+    return recurso, None
+
+
+def _consulta(recurso, nomes):
+    """SELECT apenas das colunas dos campos escolhidos, já com junções e filtro de acesso."""
+    consulta = select(*[recurso.campos[nome].label(nome) for nome in nomes]).select_from(recurso.modelo)
+    consulta = recurso.aplicar_juncoes(consulta, nomes)
+    if recurso.filtro is not None:
+        consulta = consulta.where(recurso.filtro(current_user))
+    return consulta
+
+
+def _filtros_agendamentos(consulta):
+    """Filtros opcionais da lista de agendamentos: status, funcionario_id, cliente_id, de, ate."""
+    if request.args.get('status'):
+        consulta = consulta.where(Agendamento.status == request.args['status'])
+    for parametro, coluna in (('funcionario_id', Agendamento.funcionario_id), ('cliente_id', Agendamento.cliente_id)):
+        valor = request.args.get(parametro, type=int)
+        if valor is not None:
+            consulta = consulta.where(coluna == valor)
+    periodo = (('de', Agendamento.data_agendamento.__ge__), ('ate', Agendamento.data_agendamento.__lt__))
+    for parametro, condicao in periodo:
+        if request.args.get(parametro):
+            try:
+                valor = datetime.fromisoformat(request.args[parametro])
+            except ValueError:
+                raise ValueError(f'Parâmetro {parametro} inválido; use o formato ISO 8601.')
+            consulta = consulta.where(condicao(valor))
+    return consulta
+
+
+def _gerar_lista(consulta, nomes, limite):
+    """Gera o corpo {"data": [...], "next": ...} em pedaços de até LOTE_STREAMING itens."""
+    resultado = db.session.execute(consulta.limit(limite + 1), execution_options={'yield_per': LOTE_STREAMING})
+    yield b'{"data":['
+    enviados, ultimo_id, proximo = 0, None, None
+    try:
+        for linhas in resultado.partitions():
+            pedaco = []
+            for linha in linhas:
+                if enviados == limite:
+                    proximo = ultimo_id
+                    break
+                pedaco.append(para_json(dict(zip(nomes, linha))))
+                ultimo_id = linha.id
+                enviados += 1
+            if pedaco:
+                yield (b',' if enviados > len(pedaco) else b'') + b','.join(pedaco)
+            if proximo is not None:
+                break
+    finally:
+        resultado.close()
+    yield b'],"next":' + para_json(proximo) + b'}'
+
+
+@api_v1.route('/<nome>')
+@somente_leitura
+def listar(nome):
+    recurso, erro = _obter_recurso(nome)
+    if erro:
+        return erro
+    try:
+        nomes = recurso.selecionar_campos(request.args.get('fields'), current_user)
+        limite = request.args.get('limit', LIMITE_PADRAO, type=int)
+        if limite < 1:
+            raise ValueError('Parâmetro limit inválido.')
+        limite = min(limite, LIMITE_MAXIMO)
+        apos = request.args.get('after', type=int)
+        chave = recurso.campos['id']
+        # O id é sempre enviado: é ele que forma o cursor da próxima página
+        nomes = nomes if 'id' in nomes else ['id'] + nomes
+
+        consulta = _consulta(recurso, nomes)
+        if recurso is RECURSOS['agendamentos']:
+            consulta = _filtros_agendamentos(consulta)
+    except ValueError as e:
+        return erro_json(str(e), 400)
+
+    if apos is not None:
+        consulta = consulta.where(chave > apos)
+    consulta = consulta.order_by(chave)
+    return Response(stream_with_context(_gerar_lista(consulta, nomes, limite)), mimetype='application/json')
+
+
+@api_v1.route('/<nome>/<int:registro_id>')
+@somente_leitura
+def obter(nome, registro_id):
+    recurso, erro = _obter_recurso(nome)
+    if erro:
+        return erro
+    try:
+        nomes = recurso.selecionar_campos(request.args.get('fields'), current_user)
+    except ValueError as e:
+        return erro_json(str(e), 400)
+
+    linha = db.session.execute(_consulta(recurso, nomes).where(recurso.campos['id'] == registro_id)).first()
+    if linha is None:
+        return erro_json('Registro não encontrado.', 404)
+    return resposta_json({'data': dict(zip(nomes, linha))})
@@ -5,7 +5,8 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
-from db_agendamento import get_database_url
+from db_agendamento import get_database_url, get_replica_database_url
+from replica import SessaoRoteada, BIND_REPLICA
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -13,12 +14,14 @@ logging.basicConfig(level=logging.DEBUG)
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+# Sessions route reads of @somente_leitura routes to the replica bind (see replica.py)
+db = SQLAlchemy(model_class=Base, session_options={'class_': SessaoRoteada})
 
 # Create the Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# x_for: the rate limiter keys on the client IP, not the proxy's
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 
 # Configure database
 app.config["SQLALCHEMY_DATABASE_URI"] = get_database_url()
@@ -28,6 +31,62 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Per-process connection pool; gunicorn.conf.py derives these from the worker and
+# thread counts so all workers together stay under the server's connection limit
+if os.environ.get("DB_POOL_TAMANHO"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+        "pool_size": int(os.environ["DB_POOL_TAMANHO"]),
+        "max_overflow": int(os.environ.get("DB_POOL_EXCEDENTE", 0)),
+        "pool_timeout": float(os.environ.get("DB_POOL_ESPERA", 30)),
+    })
+
+# Optional read replica for read-only routes; reads fall back to the primary
+# for REPLICA_JANELA_SEGUNDOS after the same user writes
+replica_url = get_replica_database_url()
+if replica_url:
+    app.config["SQLALCHEMY_BINDS"] = {BIND_REPLICA: replica_url}
+app.config["REPLICA_JANELA_SEGUNDOS"] = float(os.environ.get("REPLICA_JANELA_SEGUNDOS", 5))
+
+# Multi-company mode: DOMINIO_BASE enables <subdominio>.<DOMINIO_BASE> hosts;
+# EXIGIR_EMPRESA_POR_HOST rejects unknown hosts instead of using the first company
+app.config["DOMINIO_BASE"] = os.environ.get("DOMINIO_BASE")
+app.config["EXIGIR_EMPRESA_POR_HOST"] = os.environ.get("EXIGIR_EMPRESA_POR_HOST") == "1"
+
+# Live agenda (see eventos.py): pages open the SSE stream only when AGENDA_AO_VIVO=1.
+# gunicorn.conf.py sets it for the gevent profile; under gthread each open stream
+# would hold a worker thread for as long as the tab stays open
+app.config["AGENDA_AO_VIVO"] = os.environ.get("AGENDA_AO_VIVO") == "1"
+
+# Rate limiting (see limitador.py): LIMITADOR_BACKEND=postgres shares the buckets
+# across workers; LIMITES_REQUISICOES overrides limits as "nome=capacidade/segundos,..."
+app.config["LIMITADOR_ATIVO"] = os.environ.get("LIMITADOR_ATIVO", "1") == "1"
+app.config["LIMITADOR_BACKEND"] = os.environ.get("LIMITADOR_BACKEND", "memoria")
+app.config["LIMITES_REQUISICOES"] = {
+    nome.strip(): tuple(int(parte) for parte in valor.split("/"))
+    for nome, valor in (
+        item.split("=") for item in os.environ.get("LIMITES_REQUISICOES", "").split(",") if item.strip()
+    )
+}
+
+# Request profiler (see perfilador.py): PERFILADOR_AMOSTRAGEM profiles a random
+# fraction (0-1) of requests; masters can also profile one with ?perfilar=1
+app.config["PERFILADOR_AMOSTRAGEM"] = float(os.environ.get("PERFILADOR_AMOSTRAGEM", 0))
+app.config["PERFILADOR_SEGREDO"] = os.environ.get("PERFILADOR_SEGREDO")
+app.config["PERFILADOR_DIRETORIO"] = os.environ.get("PERFILADOR_DIRETORIO")
+app.config["PERFILADOR_MAXIMO"] = int(os.environ.get("PERFILADOR_MAXIMO", 200))
+
+# Nightly agenda digest (see resumo_diario.py): RESUMO_TRANSPORTE is "log" (default,
+# only logs the messages) or "smtp"; the SMTP connection is reused for up to
+# SMTP_MENSAGENS_POR_CONEXAO messages. `flask smtp-local` runs a local sink for tests
+app.config["RESUMO_TRANSPORTE"] = os.environ.get("RESUMO_TRANSPORTE", "log")
+app.config["RESUMO_REMETENTE"] = os.environ.get("RESUMO_REMETENTE", "agenda@localhost")
+app.config["SMTP_HOST"] = os.environ.get("SMTP_HOST", "localhost")
+app.config["SMTP_PORTA"] = int(os.environ.get("SMTP_PORTA", 25))
+app.config["SMTP_USUARIO"] = os.environ.get("SMTP_USUARIO")
+app.config["SMTP_SENHA"] = os.environ.get("SMTP_SENHA")
+app.config["SMTP_TLS"] = os.environ.get("SMTP_TLS") == "1"
+app.config["SMTP_MENSAGENS_POR_CONEXAO"] = int(os.environ.get("SMTP_MENSAGENS_POR_CONEXAO", 100))
+
 # Configure upload folder
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -35,6 +94,9 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Cache of rendered layout fragments ({% cache_fragmento %} tag)
+app.jinja_env.add_extension('cache_fragmentos.CacheFragmentoExtension')
+
 # Initialize extensions
 db.init_app(app)
 login_manager = LoginManager()
@@ -53,55 +115,36 @@ with app.app_context():
     
     # Create all tables
     db.create_all()
+
+    # Apply schema changes to tables that already exist
+    from migracoes import aplicar_migracoes
+    aplicar_migracoes(db.engine)
+
+    # Make sure monthly appointment and audit log partitions exist ahead of time
+    from particoes import garantir_particoes
+    garantir_particoes(db.engine, 'agendamentos', 'data_agendamento',
+                       app.config.get('PARTICOES_MESES_FUTUROS', 6))
+    garantir_particoes(db.engine, 'logs_auditoria', 'timestamp',
+                       app.config.get('PARTICOES_MESES_FUTUROS', 6))
     
-    # Create default master user and company settings
-    from modelos import Usuario, Cargo, ConfiguracaoEmpresa
-    from werkzeug.security import generate_password_hash
-    
-    # Create default master user if it doesn't exist
-    master_user = Usuario.query.filter_by(username='master').first()
-    if not master_user:
-        master_user = Usuario(
-            username='master',
-            email='master@jtsistemas.com',
-            password_hash=generate_password_hash('master123'),
-            tipo_usuario='master',
-            nome='Administrador Master',
-            ativo=True
-        )
-        db.session.add(master_user)
-        db.session.commit()
-        logging.info("Default master user created: master/master123")
-    
-    # Create default company configuration
-    config = ConfiguracaoEmpresa.query.first()
-    if not config:
-        config = ConfiguracaoEmpresa(
-            nome_empresa='JT Sistemas',
-            logo_path=None,
-            whatsapp_token='',
-            whatsapp_phone_id='',
-            whatsapp_webhook_verify_token=''
-        )
-        db.session.add(config)
-    
-    # Create default positions if they don't exist
-    default_positions = [
-        {'nome': 'Gerente', 'descricao': 'Gerente geral'},
-        {'nome': 'Atendente', 'descricao': 'Atendimento ao cliente'},
-        {'nome': 'Especialista', 'descricao': 'Especialista técnico'}
-    ]
-    
-    for pos_data in default_positions:
-        cargo = Cargo.query.filter_by(nome=pos_data['nome']).first()
-        if not cargo:
-            cargo = Cargo(
-                nome=pos_data['nome'],
-                descricao=pos_data['descricao']
-            )
-            db.session.add(cargo)
-    
+    # Create the first company with its default master user, settings and positions
+    from modelos import Empresa
+    from tenancia import provisionar_empresa
+
+    empresa = Empresa.query.order_by(Empresa.id).first()
+    if not empresa:
+        empresa = Empresa(nome='JT Sistemas', ativa=True)
+        db.session.add(empresa)
+        db.session.flush()
+    provisionar_empresa(empresa)
     db.session.commit()
 
 # Import routes after app creation
 import rotas
+
+# Versioned JSON API (/api/v1)
+from api import api_v1
+app.register_blueprint(api_v1)
+
+# Register scheduled jobs as CLI commands (flask --app main <comando>)
+import tarefas
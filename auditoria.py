@@ -0,0 +1,83 @@
+from datetime import date, datetime
+from decimal import Decimal
+from flask import has_request_context, request
+from flask_login import current_user
+from sqlalchemy import insert, select
+from aplicacao import db
+from modelos import LogAuditoria
+
+# Trilha de auditoria (logs_auditoria).
+#
+# Cada linha guarda só o que mudou: valores_antigos e valores_novos são objetos JSONB com
+# os mesmos campos, os alterados, em vez de cópias inteiras do registro. A tabela é
+# particionada por mês em timestamp e a retenção (`flask manter-particoes`,
+# RETENCAO_AUDITORIA_MESES) descarta partições inteiras; o histórico de um registro sai
+# do índice (tabela, registro_id, timestamp).
+
+
+def _json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+def diferencas(antigos, novos):
+    """Campos de `antigos`/`novos` (dicts) cujo valor mudou: ({campo: antigo}, {campo: novo})."""
+    antigos, novos = antigos or {}, novos or {}
+    campos = [campo for campo in {**antigos, **novos} if antigos.get(campo) != novos.get(campo)]
+    return (
+        {campo: _json(antigos[campo]) for campo in campos if campo in antigos},
+        {campo: _json(novos[campo]) for campo in campos if campo in novos},
+    )
+
+
+def _autor():
+    if not has_request_context():
+        return None, None
+    usuario_id = current_user.id if current_user.is_authenticated else None
+    return usuario_id, request.remote_addr
+
+
+def registrar_auditoria_lote(acao, tabela, empresa_id, alteracoes):
+    """
+    Registra, com um único INSERT, as alterações [(registro_id, antigos, novos)] de
+    registros de `tabela`. Alterações sem diferença não geram linha. Não faz commit.
+    """
+    usuario_id, ip_address = _autor()
+    agora = datetime.utcnow()
+    linhas = []
+    for registro_id, antigos, novos in alteracoes:
+        antigos, novos = diferencas(antigos, novos)
+        if not antigos and not novos:
+            continue
+        linhas.append({
+            'empresa_id': empresa_id,
+            'usuario_id': usuario_id,
+            'acao': acao,
+            'tabela': tabela,
+            'registro_id': registro_id,
+            'valores_antigos': antigos or None,
+            'valores_novos': novos or None,
+            'timestamp': agora,
+            'ip_address': ip_address,
+        })
+    if linhas:
+        db.session.execute(insert(LogAuditoria), linhas)
+    return len(linhas)
+
+
+def registrar_auditoria(acao, objeto, antigos=None, novos=None):
+    """Registra a alteração de `objeto` (um modelo com id e empresa_id). Não faz commit."""
+    return registrar_auditoria_lote(acao, objeto.__tablename__, objeto.empresa_id, [(objeto.id, antigos, novos)])
+
+
+def historico(tabela, registro_id, limite=100):
+    """Alterações de um registro, da mais recente para a mais antiga."""
+    return db.session.execute(
+        select(LogAuditoria)
+        .where(LogAuditoria.tabela == tabela, LogAuditoria.registro_id == registro_id)
+        .order_by(LogAuditoria.timestamp.desc())
+        .limit(limite)
+    ).scalars().all()
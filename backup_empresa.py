@@ -0,0 +1,270 @@
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import time
+from datetime import datetime
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from flask import current_app
+from sqlalchemy import text
+from werkzeug.utils import secure_filename
+from aplicacao import db
+
+# Backup e restauração dos dados de uma única empresa (tenant).
+#
+# O backup é um .tar.gz com:
+#   manifesto.json       versão, dados da empresa e, por tabela, as colunas copiadas
+#   tabelas/<tabela>     linhas da empresa no formato texto do COPY
+#   logos/<arquivo>      logo enviado nas configurações
+#
+# Todas as tabelas são lidas com COPY (SELECT ...) TO STDOUT numa única transação
+# REPEATABLE READ READ ONLY: o arquivo é uma fotografia consistente mesmo com a
+# aplicação em uso. Cada tabela passa por um SpooledTemporaryFile (memória até
+# LIMITE_MEMORIA, depois disco), porque o tar precisa do tamanho antes do conteúdo;
+# o .tar.gz em si é escrito em fluxo. A memória usada não depende do número de linhas.
+#
+# A restauração lê o arquivo também em fluxo e carrega cada tabela com COPY FROM STDIN,
+# na ordem das chaves estrangeiras (a mesma do arquivo), tudo numa transação: ou a
+# empresa volta inteira ou nada muda. Os ids originais são mantidos, então o destino é a
+# mesma instalação (após perda de dados) ou um banco sem essas linhas; com `substituir`
+# os dados atuais da empresa são apagados antes. Os logs de auditoria não entram no
+# backup (têm retenção própria, ver particoes.descartar_particoes).
+#
+# Durante a restauração, o gatilho dos avisos da agenda ao vivo (notificar_agendamento)
+# é calado pela configuração app.restaurando, ligada com SET LOCAL só nesta transação:
+# as demais empresas continuam gravando e sendo avisadas normalmente. Os logos ficam em
+# arquivos temporários e só vão para UPLOAD_FOLDER depois do commit, com o prefixo
+# "<empresa_id>_" dos uploads (ver configuracoes()), para não sobrescrever o de outra empresa.
+
+VERSAO_BACKUP = 1
+
+# Bytes de cada tabela mantidos em memória antes de ir para um arquivo temporário
+LIMITE_MEMORIA = 8 * 1024 * 1024
+
+MANIFESTO = 'manifesto.json'
+
+# Tabelas da empresa no backup; a ordem (pais antes de filhos) vem das chaves estrangeiras
+TABELAS_BACKUP = (
+    'cargos', 'configuracao_empresa', 'servicos', 'usuarios', 'funcionarios', 'funcionario_servicos',
+    'jornadas_trabalho', 'excecoes_jornada', 'series_agendamento', 'agendamentos', 'lista_espera',
+)
+
+# Tabelas sem empresa_id, filtradas pela tabela pai
+_FILTROS = {
+    'funcionario_servicos': 'funcionario_id IN (SELECT id FROM funcionarios WHERE empresa_id = {empresa_id})',
+}
+
+class ErroBackup(Exception):
+    pass
+
+
+def _tabelas():
+    """Tabelas do backup, na ordem das chaves estrangeiras."""
+    return [tabela for tabela in db.metadata.sorted_tables if tabela.name in TABELAS_BACKUP]
+
+
+def _filtro(tabela, empresa_id):
+    return _FILTROS.get(tabela, 'empresa_id = {empresa_id}').format(empresa_id=int(empresa_id))
+
+
+def _consulta(tabela, colunas, empresa_id):
+    lista = ', '.join(colunas)
+    consulta = f"SELECT {lista} FROM {tabela} WHERE {_filtro(tabela, empresa_id)}"
+    if tabela == 'agendamentos':
+        # Inclui o histórico já arquivado (particoes.arquivar_particoes)
+        consulta += f" UNION ALL SELECT {lista} FROM agendamentos_arquivo WHERE {_filtro(tabela, empresa_id)}"
+    return consulta
+
+
+def _adicionar(tar, nome, arquivo, tamanho):
+    info = tarfile.TarInfo(nome)
+    info.size = tamanho
+    info.mtime = int(time.time())
+    tar.addfile(info, arquivo)
+
+
+def gerar_backup(empresa_id, saida):
+    """
+    Escreve em `saida` (arquivo binário) o backup .tar.gz da empresa.
+    Retorna {tabela: bytes copiados}.
+    """
+    with db.engine.connect().execution_options(isolation_level='REPEATABLE READ', postgresql_readonly=True) as conn:
+        empresa = conn.execute(
+            text("SELECT id, nome, subdominio, dominio, ativa, criado_em FROM empresas WHERE id = :id"),
+            {'id': empresa_id},
+        ).mappings().first()
+        if empresa is None:
+            raise ErroBackup(f'Empresa {empresa_id} não encontrada.')
+
+        tabelas = _tabelas()
+        manifesto = {
+            'versao': VERSAO_BACKUP,
+            'gerado_em': datetime.utcnow().isoformat(),
+            'empresa': {**empresa, 'criado_em': empresa['criado_em'].isoformat() if empresa['criado_em'] else None},
+            'tabelas': [{'nome': tabela.name, 'colunas': [coluna.name for coluna in tabela.columns]} for tabela in tabelas],
+        }
+        logos = conn.execute(
+            text("SELECT logo_path FROM configuracao_empresa WHERE empresa_id = :id AND logo_path IS NOT NULL"),
+            {'id': empresa_id},
+        ).scalars().all()
+
+        cursor = conn.connection.driver_connection.cursor()
+        tamanhos = {}
+        with tarfile.open(fileobj=saida, mode='w|gz') as tar:
+            conteudo = json.dumps(manifesto, ensure_ascii=False, indent=2).encode()
+            _adicionar(tar, MANIFESTO, io.BytesIO(conteudo), len(conteudo))
+
+            for item in manifesto['tabelas']:
+                with SpooledTemporaryFile(max_size=LIMITE_MEMORIA) as temporario:
+                    cursor.copy_expert(f"COPY ({_consulta(item['nome'], item['colunas'], empresa_id)}) TO STDOUT", temporario)
+                    tamanhos[item['nome']] = temporario.tell()
+                    temporario.seek(0)
+                    _adicionar(tar, f"tabelas/{item['nome']}", temporario, tamanhos[item['nome']])
+
+            pasta = current_app.config['UPLOAD_FOLDER']
+            for logo in logos:
+                caminho = os.path.join(pasta, logo)
+                if os.path.isfile(caminho):
+                    tar.add(caminho, arcname=f'logos/{logo}')
+        cursor.close()
+    logging.info(f"Backup da empresa {empresa_id}: {sum(tamanhos.values())} bytes em {len(tamanhos)} tabela(s)")
+    return tamanhos
+
+
+def _apagar_dados(conn, empresa_id):
+    """Remove os dados atuais da empresa, filhos antes dos pais."""
+    # A auditoria fica, sem a referência aos usuários que serão recriados
+    conn.execute(text(
+        "UPDATE logs_auditoria SET usuario_id = NULL "
+        "WHERE usuario_id IN (SELECT id FROM usuarios WHERE empresa_id = :id)"
+    ), {'id': empresa_id})
+    for tabela in reversed(_tabelas()):
+        conn.execute(text(f"DELETE FROM {tabela.name} WHERE {_filtro(tabela.name, empresa_id)}"))
+        if tabela.name == 'agendamentos':
+            conn.execute(text(f"DELETE FROM agendamentos_arquivo WHERE {_filtro(tabela.name, empresa_id)}"))
+
+
+def _possui_dados(conn, empresa_id):
+    return conn.execute(text("SELECT EXISTS (SELECT 1 FROM usuarios WHERE empresa_id = :id)"), {'id': empresa_id}).scalar()
+
+
+def _acertar_sequencia(conn, tabela):
+    """Avança a sequência do id para depois dos ids restaurados (nunca para trás)."""
+    sequencia = conn.execute(text("SELECT pg_get_serial_sequence(:tabela, 'id')"), {'tabela': tabela}).scalar()
+    if sequencia is None:
+        return
+    maximo = f"SELECT MAX(id) FROM {tabela}"
+    if tabela == 'agendamentos':
+        maximo = "SELECT MAX(id) FROM (SELECT id FROM agendamentos UNION ALL SELECT id FROM agendamentos_arquivo) t"
+    conn.execute(text(
+        f"SELECT setval('{sequencia}', GREATEST(COALESCE(({maximo}), 1), (SELECT last_value FROM {sequencia})))"
+    ))
+
+
+def _particionar_restaurados(conn):
+    """
+    Agendamentos de meses sem partição caíram na partição DEFAULT: os de meses já
+    arquivados voltam para agendamentos_arquivo e os demais ganham partição própria.
+    """
+    from modelos import Agendamento
+    from particoes import criar_particao, meses_particionados, somar_meses, tabela_particionada
+    if not tabela_particionada(conn, 'agendamentos'):
+        return
+    arquivados = set(meses_particionados(conn, 'agendamentos_arquivo', 'agendamentos'))
+    colunas = ', '.join(coluna.name for coluna in Agendamento.__table__.columns)
+    meses = conn.execute(text(
+        "SELECT DISTINCT date_trunc('month', data_agendamento)::date FROM agendamentos_padrao"
+    )).scalars().all()
+    for mes in meses:
+        if mes in arquivados:
+            conn.execute(text(
+                f"WITH movidas AS (DELETE FROM agendamentos_padrao WHERE data_agendamento >= :inicio "
+                f"AND data_agendamento < :fim RETURNING {colunas}) "
+                f"INSERT INTO agendamentos_arquivo ({colunas}) SELECT {colunas} FROM movidas"
+            ), {'inicio': mes, 'fim': somar_meses(mes, 1)})
+        else:
+            criar_particao(conn, 'agendamentos', 'data_agendamento', mes)
+
+
+def _nome_logo(empresa_id, nome):
+    """Nome do logo restaurado em UPLOAD_FOLDER, sempre com o prefixo da empresa."""
+    prefixo = f'{empresa_id}_'
+    return nome if nome.startswith(prefixo) else prefixo + nome
+
+
+def _gravar_logos(logos):
+    """Move os logos restaurados para UPLOAD_FOLDER (depois do commit)."""
+    pasta = current_app.config['UPLOAD_FOLDER']
+    for nome, conteudo in logos.items():
+        destino = os.path.join(pasta, nome)
+        with NamedTemporaryFile(dir=pasta, prefix='.restaurando_', delete=False) as arquivo:
+            conteudo.seek(0)
+            shutil.copyfileobj(conteudo, arquivo)
+        os.replace(arquivo.name, destino)
+
+
+def restaurar_backup(entrada, substituir=False):
+    """
+    Restaura o backup lido de `entrada` (arquivo binário .tar.gz). Sem `substituir`,
+    recusa empresas que já têm dados. Retorna (empresa_id, {tabela: linhas}).
+    """
+    linhas = {}
+    logos = {}
+    try:
+        with db.engine.begin() as conn:
+            cursor = conn.connection.driver_connection.cursor()
+            with tarfile.open(fileobj=entrada, mode='r|gz') as tar:
+                membros = iter(tar)
+                primeiro = next(membros, None)
+                if primeiro is None or primeiro.name != MANIFESTO:
+                    raise ErroBackup('Arquivo de backup inválido: manifesto ausente.')
+                manifesto = json.load(tar.extractfile(primeiro))
+                if manifesto.get('versao') != VERSAO_BACKUP:
+                    raise ErroBackup(f"Versão de backup não suportada: {manifesto.get('versao')}.")
+
+                empresa = manifesto['empresa']
+                empresa_id = empresa['id']
+                conn.execute(text(
+                    "INSERT INTO empresas (id, nome, subdominio, dominio, ativa, criado_em) "
+                    "VALUES (:id, :nome, :subdominio, :dominio, :ativa, :criado_em) ON CONFLICT (id) DO NOTHING"
+                ), empresa)
+                _acertar_sequencia(conn, 'empresas')
+                # Sem avisos da agenda ao vivo para as linhas restauradas (migração 0008)
+                conn.execute(text("SET LOCAL app.restaurando = 'on'"))
+                if _possui_dados(conn, empresa_id):
+                    if not substituir:
+                        raise ErroBackup(f'A empresa {empresa_id} já tem dados; use a opção de substituir.')
+                    _apagar_dados(conn, empresa_id)
+
+                # Só tabelas e colunas conhecidas: os nomes vão direto para o COPY
+                conhecidas = {tabela.name: {coluna.name for coluna in tabela.columns} for tabela in _tabelas()}
+                colunas = {item['nome']: item['colunas'] for item in manifesto['tabelas']}
+                for tabela, lista in colunas.items():
+                    if tabela not in conhecidas or not set(lista) <= conhecidas[tabela]:
+                        raise ErroBackup(f'Tabela ou colunas desconhecidas no backup: {tabela}.')
+                for membro in membros:
+                    pasta, _, nome = membro.name.partition('/')
+                    if pasta == 'tabelas' and nome in colunas:
+                        cursor.copy_expert(f"COPY {nome} ({', '.join(colunas[nome])}) FROM STDIN", tar.extractfile(membro))
+                        linhas[nome] = cursor.rowcount
+                        if 'id' in colunas[nome]:
+                            _acertar_sequencia(conn, nome)
+                    elif pasta == 'logos' and membro.isfile() and secure_filename(nome) == nome:
+                        novo = _nome_logo(empresa_id, nome)
+                        conteudo = SpooledTemporaryFile(max_size=LIMITE_MEMORIA)
+                        shutil.copyfileobj(tar.extractfile(membro), conteudo)
+                        logos[novo] = conteudo
+                        conn.execute(text(
+                            "UPDATE configuracao_empresa SET logo_path = :novo "
+                            "WHERE empresa_id = :id AND logo_path = :antigo"
+                        ), {'novo': novo, 'id': empresa_id, 'antigo': nome})
+                _particionar_restaurados(conn)
+            cursor.close()
+        _gravar_logos(logos)
+    finally:
+        for conteudo in logos.values():
+            conteudo.close()
+    logging.info(f"Backup restaurado na empresa {empresa_id}: {sum(linhas.values())} linha(s)")
+    return empresa_id, linhas
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Cache em memória limitado, com descarte do item usado há mais tempo (LRU).
+    Seguro para uso entre threads do mesmo worker.
+    """
+
+    def __init__(self, capacidade=256):
+        self.capacidade = capacidade
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave, padrao=None):
+        with self._lock:
+            try:
+                valor = self._itens[chave]
+            except KeyError:
+                self.falhas += 1
+                return padrao
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return valor
+
+    def definir(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+
+    def remover(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def __len__(self):
+        return len(self._itens)
+
+    def estatisticas(self):
+        return {
+            'itens': len(self._itens),
+            'capacidade': self.capacidade,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+        }
+
+
+class CacheTTL:
+    """
+    Cache de resultados com expiração por item e singleflight: quando vários
+    pedidos concorrentes procuram a mesma chave ausente (ou expirada), só o
+    primeiro executa o cálculo e os demais esperam e reaproveitam o resultado.
+    """
+
+    def __init__(self, capacidade=256, ttl=300):
+        self.ttl = ttl
+        self.calculos = 0
+        self._itens = CacheLRU(capacidade)
+        self._em_andamento = {}
+        self._lock = threading.Lock()
+
+    def obter_ou_calcular(self, chave, calcular, ttl=None):
+        while True:
+            item = self._itens.obter(chave)
+            if item is not None and item[0] > time.monotonic():
+                return item[1]
+
+            with self._lock:
+                evento = self._em_andamento.get(chave)
+                lider = evento is None
+                if lider:
+                    evento = self._em_andamento[chave] = threading.Event()
+
+            if not lider:
+                # Outro pedido já está calculando; se ele falhar, este tenta de novo
+                evento.wait()
+                continue
+
+            try:
+                valor = calcular()
+                self.calculos += 1
+                self._itens.definir(chave, (time.monotonic() + (ttl or self.ttl), valor))
+                return valor
+            finally:
+                with self._lock:
+                    del self._em_andamento[chave]
+                evento.set()
+
+    def remover(self, chave):
+        self._itens.remover(chave)
+
+    def limpar(self):
+        self._itens.limpar()
+
+    def estatisticas(self):
+        return dict(self._itens.estatisticas(), calculos=self.calculos, ttl=self.ttl)
+
+
+class CacheEtiquetado(CacheTTL):
+    """
+    CacheTTL com entradas etiquetadas (em geral pelos nomes das tabelas consultadas).
+    `invalidar(etiqueta)` torna obsoletas de uma vez todas as entradas da etiqueta:
+    cada etiqueta tem uma versão que faz parte da chave, então as entradas antigas
+    deixam de ser encontradas e saem pelo LRU ou pelo TTL. Um cálculo que começou
+    antes da invalidação grava sob a versão antiga e também nunca é servido.
+    """
+
+    def __init__(self, capacidade=256, ttl=300):
+        super().__init__(capacidade, ttl)
+        self.invalidacoes = 0
+        self._versoes = {}
+
+    def obter_ou_calcular(self, chave, calcular, ttl=None, etiquetas=()):
+        versoes = tuple((etiqueta, self._versoes.get(etiqueta, 0)) for etiqueta in etiquetas)
+        return super().obter_ou_calcular((chave, versoes), calcular, ttl)
+
+    def invalidar(self, *etiquetas):
+        with self._lock:
+            for etiqueta in etiquetas:
+                self._versoes[etiqueta] = self._versoes.get(etiqueta, 0) + 1
+            self.invalidacoes += len(etiquetas)
+
+    def estatisticas(self):
+        return dict(super().estatisticas(), invalidacoes=self.invalidacoes)
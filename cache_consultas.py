@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import socket
+from flask import current_app, g
+from sqlalchemy import event, text
+from aplicacao import db
+from cache import CacheEtiquetado
+from eventos import central_eventos
+from replica import SessaoRoteada
+
+# Cache de resultados de consultas de dados de referência (serviços, cargos,
+# funcionários) usados em formulários e pesquisas.
+#
+# Cada resultado é guardado por (empresa, nome, parâmetros normalizados) e etiquetado
+# com as tabelas de onde veio. Quando um commit altera uma dessas tabelas, por flush
+# do ORM ou por UPDATE/DELETE em lote, as etiquetas são invalidadas no processo que
+# fez o commit e avisadas aos demais workers por pg_notify no canal
+# 'cache_consultas', recebido pela conexão LISTEN de cada processo (eventos.py).
+# Enquanto essa conexão está caída os avisos se perdem, por isso o cache é esvaziado
+# a cada reconexão; o TTL (CACHE_CONSULTAS_SEGUNDOS) fica como última garantia.
+#
+# Só valores simples (tuplas, dicts) vão para o cache, nunca objetos do ORM.
+
+TTL_PADRAO = 60
+
+CANAL_INVALIDACAO = 'cache_consultas'
+
+# Tabelas usadas como etiqueta em consulta_em_cache(); só commits nelas são avisados
+TABELAS_EM_CACHE = frozenset({'servicos', 'cargos', 'funcionarios', 'usuarios'})
+
+cache_consultas = CacheEtiquetado(capacidade=512, ttl=TTL_PADRAO)
+
+
+def consulta_em_cache(nome, tabelas, calcular, *parametros):
+    """Executa `calcular()` pelo cache, separado por empresa e etiquetado com `tabelas`."""
+    if not TABELAS_EM_CACHE.issuperset(tabelas):
+        raise ValueError(f'Etiquetas fora de TABELAS_EM_CACHE: {set(tabelas) - TABELAS_EM_CACHE}')
+    central_eventos.iniciar(db.engine)
+    chave = (g.get('empresa_id'), nome) + parametros
+    ttl = current_app.config.get('CACHE_CONSULTAS_SEGUNDOS')
+    return cache_consultas.obter_ou_calcular(chave, calcular, ttl, etiquetas=tabelas)
+
+
+def _origem():
+    # Calculada no processo (depois do fork dos workers), não na importação
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _avisar_outros_processos(tabelas):
+    if not tabelas or db.engine.dialect.name != 'postgresql':
+        return
+    aviso = json.dumps({'origem': _origem(), 'tabelas': sorted(tabelas)})
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:canal, :aviso)"), {'canal': CANAL_INVALIDACAO, 'aviso': aviso})
+    except Exception as e:
+        # Os outros workers ficam com o TTL como limite
+        logging.warning(f"Cache de consultas: invalidação de {sorted(tabelas)} não avisada ({e})")
+
+
+def _receber_aviso(payload):
+    aviso = json.loads(payload)
+    if aviso['origem'] != _origem():
+        cache_consultas.invalidar(*aviso['tabelas'])
+
+
+central_eventos.ouvir(CANAL_INVALIDACAO, _receber_aviso, cache_consultas.limpar)
+
+
+def _tabelas_alteradas(sessao):
+    return sessao.info.setdefault('tabelas_alteradas', set())
+
+
+@event.listens_for(SessaoRoteada, 'after_flush')
+def _registrar_tabelas_do_flush(sessao, contexto):
+    alteradas = _tabelas_alteradas(sessao)
+    for objeto in (*sessao.new, *sessao.dirty, *sessao.deleted):
+        alteradas.add(objeto.__table__.name)
+
+
+@event.listens_for(SessaoRoteada, 'do_orm_execute')
+def _registrar_tabelas_em_lote(estado):
+    if (estado.is_insert or estado.is_update or estado.is_delete) and estado.bind_mapper is not None:
+        _tabelas_alteradas(estado.session).add(estado.bind_mapper.persist_selectable.name)
+
+
+@event.listens_for(SessaoRoteada, 'after_commit')
+def _invalidar_tabelas_alteradas(sessao):
+    alteradas = sessao.info.pop('tabelas_alteradas', None)
+    if alteradas:
+        cache_consultas.invalidar(*alteradas)
+        _avisar_outros_processos(alteradas & TABELAS_EM_CACHE)
+
+
+@event.listens_for(SessaoRoteada, 'after_rollback')
+def _descartar_tabelas_alteradas(sessao):
+    sessao.info.pop('tabelas_alteradas', None)
@@ -0,0 +1,58 @@
+from jinja2 import nodes
+from jinja2.ext import Extension
+from flask import g
+from flask_login import current_user
+from cache import CacheLRU
+
+# Quantidade máxima de fragmentos renderizados mantidos por worker
+CAPACIDADE_PADRAO = 512
+
+
+def chave_fragmento(template, nome, contexto):
+    """
+    Monta a chave de um fragmento: (empresa, template, nome, papel, máscara de permissões,
+    versão da configuração).
+    Retorna None quando o fragmento não deve ser cacheado (usuário anônimo).
+    """
+    if not current_user.is_authenticated:
+        return None
+    config = contexto.get('empresa_config')
+    versao_config = config.atualizado_em.timestamp() if config and config.atualizado_em else None
+    return (g.get('empresa_id'), template, nome, current_user.tipo_usuario, current_user.mascara_permissoes(),
+            versao_config)
+
+
+class CacheFragmentoExtension(Extension):
+    """
+    Tag Jinja que guarda o HTML renderizado de um trecho do template em um LRU limitado.
+
+    Uso:
+        {% cache_fragmento 'sidebar' %} ... {% endcache_fragmento %}
+
+    O trecho só pode depender do papel do usuário, das suas permissões e da
+    configuração da empresa; dados pessoais (nome do usuário etc.) devem ficar fora.
+    """
+    tags = {'cache_fragmento'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(cache_fragmentos=CacheLRU(CAPACIDADE_PADRAO))
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        nome = parser.parse_expression()
+        corpo = parser.parse_statements(('name:endcache_fragmento',), drop_needle=True)
+        args = [nodes.Const(parser.name), nome, nodes.ContextReference()]
+        return nodes.CallBlock(self.call_method('_renderizar', args), [], [], corpo).set_lineno(lineno)
+
+    def _renderizar(self, template, nome, contexto, caller):
+        chave = chave_fragmento(template, nome, contexto)
+        if chave is None:
+            return caller()
+
+        cache = self.environment.cache_fragmentos
+        html = cache.obter(chave)
+        if html is None:
+            html = caller()
+            cache.definir(chave, html)
+        return html
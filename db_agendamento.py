@@ -14,6 +14,10 @@ def get_database_url():
     """Return the database URL for SQLAlchemy"""
     return f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+def get_replica_database_url():
+    """Return the read-replica URL for SQLAlchemy, or None when no replica is configured"""
+    return os.getenv("DATABASE_REPLICA_URL") or None
+
 def get_connection():
     """Create and return a database connection"""
     try:
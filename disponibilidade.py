@@ -0,0 +1,172 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, select
+from aplicacao import db
+from cache import CacheLRU
+from modelos import ExcecaoJornada, Funcionario, JornadaTrabalho
+from replica import SessaoRoteada
+
+# Disponibilidade dos funcionários pela jornada de trabalho.
+#
+# A jornada semanal (jornadas_trabalho) e as exceções por data (excecoes_jornada) são
+# compiladas num mapa de bits por funcionário e dia local: um int de 1440 bits em que o
+# bit m indica que o minuto m do dia está dentro da jornada. Verificar se um horário
+# cabe na jornada vira `mapa & trecho == trecho` e os minutos disponíveis de um
+# período são a soma de bit_count() dos dias, sem consultar intervalos a cada pedido.
+#
+# Os mapas ficam num LRU por (funcionário, jornada_versao, dia). Qualquer alteração de
+# turno ou exceção incrementa Funcionario.jornada_versao no mesmo flush, então só os
+# dias daquele funcionário deixam de ser encontrados (em todos os workers) e são
+# recompilados quando voltarem a ser pedidos; os demais continuam em cache.
+#
+# Funcionário sem nenhum turno cadastrado segue a jornada padrão (JORNADA_*).
+
+MINUTOS_DIA = 24 * 60
+
+# Jornada de quem ainda não tem turnos cadastrados
+JORNADA_DIAS_SEMANA = (1, 2, 3, 4, 5, 6)  # ISO: 1 = segunda ... 7 = domingo
+JORNADA_HORA_INICIO = 8
+JORNADA_HORA_FIM = 18
+
+cache_jornadas = CacheLRU(capacidade=8192)
+
+
+def jornada_padrao():
+    config = current_app.config
+    return (
+        tuple(config.get('JORNADA_DIAS_SEMANA', JORNADA_DIAS_SEMANA)),
+        config.get('JORNADA_HORA_INICIO', JORNADA_HORA_INICIO),
+        config.get('JORNADA_HORA_FIM', JORNADA_HORA_FIM),
+    )
+
+
+def bits(inicio, fim):
+    """Mapa com os minutos [inicio, fim) do dia ligados."""
+    inicio, fim = max(inicio, 0), min(fim, MINUTOS_DIA)
+    return ((1 << (fim - inicio)) - 1) << inicio if fim > inicio else 0
+
+
+def _minuto(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def _trecho(hora_inicio, hora_fim):
+    # Sem horários = o dia todo
+    if hora_inicio is None or hora_fim is None:
+        return bits(0, MINUTOS_DIA)
+    return bits(_minuto(hora_inicio), _minuto(hora_fim))
+
+
+def _compilar(funcionario_ids, dias):
+    """Mapas de (funcionário, dia) para todos os pares pedidos, com duas consultas."""
+    semanas = defaultdict(lambda: defaultdict(int))
+    for turno in db.session.execute(
+        select(JornadaTrabalho).where(JornadaTrabalho.funcionario_id.in_(funcionario_ids))
+    ).scalars():
+        semanas[turno.funcionario_id][turno.dia_semana] |= _trecho(turno.hora_inicio, turno.hora_fim)
+
+    extras, folgas = defaultdict(int), defaultdict(int)
+    for excecao in db.session.execute(
+        select(ExcecaoJornada).where(ExcecaoJornada.funcionario_id.in_(funcionario_ids),
+                                     ExcecaoJornada.data.in_(dias))
+    ).scalars():
+        alvo = extras if excecao.tipo == 'extra' else folgas
+        alvo[(excecao.funcionario_id, excecao.data)] |= _trecho(excecao.hora_inicio, excecao.hora_fim)
+
+    dias_padrao, hora_inicio, hora_fim = jornada_padrao()
+    padrao = {dia: bits(hora_inicio * 60, hora_fim * 60) for dia in dias_padrao}
+
+    mapas = {}
+    for funcionario_id in funcionario_ids:
+        semana = semanas.get(funcionario_id, padrao)
+        for dia in dias:
+            chave = (funcionario_id, dia)
+            # A folga prevalece sobre a jornada e sobre o horário extra
+            mapas[chave] = (semana.get(dia.isoweekday(), 0) | extras[chave]) & ~folgas[chave]
+    return mapas
+
+
+def mapas_jornada(funcionarios, dias):
+    """
+    Mapas de bits da jornada para cada funcionário e dia local. `funcionarios` são pares
+    (id, jornada_versao) ou objetos Funcionario. Retorna {(funcionario_id, dia): mapa}.
+    """
+    funcionarios = [(f.id, f.jornada_versao) if isinstance(f, Funcionario) else tuple(f) for f in funcionarios]
+    dias = list(dict.fromkeys(dias))
+    mapas, faltando = {}, set()
+    for funcionario_id, versao in funcionarios:
+        for dia in dias:
+            mapa = cache_jornadas.obter((funcionario_id, versao, dia))
+            if mapa is None:
+                faltando.add(funcionario_id)
+            else:
+                mapas[(funcionario_id, dia)] = mapa
+
+    if faltando:
+        versoes = dict(funcionarios)
+        for (funcionario_id, dia), mapa in _compilar(sorted(faltando), dias).items():
+            cache_jornadas.definir((funcionario_id, versoes[funcionario_id], dia), mapa)
+            mapas[(funcionario_id, dia)] = mapa
+    return mapas
+
+
+def trechos_locais(inicio, duracao_minutos):
+    """
+    Divide o horário [inicio, inicio + duração), já na hora local da empresa como
+    data_agendamento (periodos.py), em trechos por dia: [(dia, mapa do trecho)].
+    """
+    local = inicio
+    fim = inicio + timedelta(minutes=duracao_minutos)
+    trechos = []
+    while True:
+        minuto_inicio = local.hour * 60 + local.minute
+        if fim.date() == local.date():
+            trechos.append((local.date(), bits(minuto_inicio, fim.hour * 60 + fim.minute)))
+            return [(dia, mapa) for dia, mapa in trechos if mapa]
+        trechos.append((local.date(), bits(minuto_inicio, MINUTOS_DIA)))
+        local = datetime.combine(local.date() + timedelta(days=1), datetime.min.time())
+
+
+def na_jornada(funcionarios, inicio, duracao_minutos):
+    """Ids dos `funcionarios` cuja jornada cobre o horário inteiro."""
+    trechos = trechos_locais(inicio, duracao_minutos)
+    mapas = mapas_jornada(funcionarios, [dia for dia, _ in trechos])
+    ids = {funcionario_id for funcionario_id, _ in mapas}
+    return {
+        funcionario_id for funcionario_id in ids
+        if all(mapas[(funcionario_id, dia)] & trecho == trecho for dia, trecho in trechos)
+    }
+
+
+def fora_da_jornada(funcionario, inicios, duracao_minutos):
+    """Dos horários `inicios` do Funcionario, os que saem da jornada (séries recorrentes)."""
+    trechos = {inicio: trechos_locais(inicio, duracao_minutos) for inicio in inicios}
+    mapas = mapas_jornada([funcionario], [dia for lista in trechos.values() for dia, _ in lista])
+    return {
+        inicio for inicio, lista in trechos.items()
+        if any(mapas[(funcionario.id, dia)] & trecho != trecho for dia, trecho in lista)
+    }
+
+
+def minutos_na_jornada(funcionarios, periodo):
+    """Minutos de jornada de cada funcionário nos dias do período (periodos.Periodo)."""
+    dias = [periodo.de + timedelta(days=i) for i in range((periodo.ate - periodo.de).days)]
+    minutos = defaultdict(int)
+    for (funcionario_id, _), mapa in mapas_jornada(funcionarios, dias).items():
+        minutos[funcionario_id] += mapa.bit_count()
+    return minutos
+
+
+@event.listens_for(SessaoRoteada, 'before_flush')
+def _versionar_jornadas(sessao, contexto, instancias):
+    alterados = {
+        objeto.funcionario_id
+        for objeto in (*sessao.new, *sessao.dirty, *sessao.deleted)
+        if isinstance(objeto, (JornadaTrabalho, ExcecaoJornada)) and objeto.funcionario_id is not None
+    }
+    for funcionario_id in alterados:
+        funcionario = sessao.get(Funcionario, funcionario_id)
+        if funcionario is not None:
+            # Incremento no próprio UPDATE, sem perder alterações concorrentes
+            funcionario.jornada_versao = Funcionario.jornada_versao + 1
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+import psycopg2
+
+# Eventos de agendamentos em tempo real (Server-Sent Events).
+#
+# Um trigger em agendamentos (migração 0008) publica cada INSERT/UPDATE/DELETE com
+# pg_notify no canal 'agendamentos'. Cada processo mantém uma única conexão LISTEN,
+# numa thread, e repassa as notificações às assinaturas (uma fila por navegador
+# conectado), já filtradas por empresa, funcionário ou cliente.
+#
+# As conexões SSE ficam abertas indefinidamente sem segurar conexão do banco; para
+# atender milhares delas o servidor roda com workers assíncronos (gevent, o perfil
+# padrão do gunicorn.conf.py). No perfil gthread cada navegador conectado ocuparia uma
+# thread, então as páginas só abrem o fluxo com AGENDA_AO_VIVO ligado.
+#
+# A mesma conexão escuta os canais registrados com ouvir(), como o de invalidação do
+# cache de consultas entre workers (cache_consultas.py).
+
+CANAL_AGENDAMENTOS = 'agendamentos'
+
+# Segundos entre comentários de keep-alive enviados a clientes sem eventos
+INTERVALO_HEARTBEAT = 15
+
+# Eventos pendentes por assinatura; um cliente que não consome é desconectado
+TAMANHO_FILA = 100
+
+# Espera (segundos) antes de reconectar o LISTEN após uma falha
+ESPERA_RECONEXAO = 5
+
+
+class Assinatura:
+    """Fila de eventos de um navegador conectado, com o filtro do que ele pode ver."""
+
+    def __init__(self, empresa_id, funcionario_id=None, cliente_id=None):
+        self.empresa_id = empresa_id
+        self.funcionario_id = funcionario_id
+        self.cliente_id = cliente_id
+        self.fila = queue.Queue(TAMANHO_FILA)
+        self.encerrada = False
+
+    def aceita(self, evento):
+        return (
+            evento.get('empresa_id') == self.empresa_id
+            and (self.funcionario_id is None or evento.get('funcionario_id') == self.funcionario_id)
+            and (self.cliente_id is None or evento.get('cliente_id') == self.cliente_id)
+        )
+
+
+class CentralEventos:
+    """Mantém a conexão LISTEN do processo e distribui as notificações às assinaturas."""
+
+    def __init__(self, canal=CANAL_AGENDAMENTOS):
+        self.canal = canal
+        self._dsn = None
+        self._assinaturas = set()
+        self._ouvintes = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def ouvir(self, canal, ao_notificar, ao_reconectar=None):
+        """
+        Escuta também `canal`, chamando ao_notificar(payload) a cada notificação. Como
+        notificações se perdem enquanto a conexão está caída, ao_reconectar() é chamada
+        a cada vez que o LISTEN (re)começa.
+        """
+        self._ouvintes[canal] = (ao_notificar, ao_reconectar)
+
+    def iniciar(self, engine):
+        """Garante a thread do LISTEN neste processo; fora do PostgreSQL não faz nada."""
+        if engine.dialect.name != 'postgresql':
+            return
+        with self._lock:
+            # Após um fork (workers do gunicorn) a thread do processo pai não existe mais
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._assinaturas = set()
+                self._dsn = engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._escutar, name='listen-agendamentos', daemon=True)
+                self._thread.start()
+
+    def assinar(self, assinatura):
+        with self._lock:
+            self._assinaturas.add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def quantidade_assinaturas(self):
+        return len(self._assinaturas)
+
+    def distribuir(self, evento):
+        with self._lock:
+            assinaturas = list(self._assinaturas)
+        for assinatura in assinaturas:
+            try:
+                if not assinatura.aceita(evento):
+                    continue
+            except Exception:
+                # Uma assinatura com problema não impede a entrega às demais
+                logging.exception(f"Erro ao filtrar evento {evento.get('id')} para uma assinatura")
+                continue
+            try:
+                assinatura.fila.put_nowait(evento)
+            except queue.Full:
+                assinatura.encerrada = True
+                self.cancelar(assinatura)
+
+    def _repassar(self, notificacao):
+        # Uma notificação com problema (payload inválido, por exemplo) é só descartada:
+        # não derruba o LISTEN nem as notificações seguintes
+        try:
+            if notificacao.channel == self.canal:
+                self.distribuir(json.loads(notificacao.payload))
+            else:
+                self._ouvintes[notificacao.channel][0](notificacao.payload)
+        except Exception:
+            logging.exception(f"Notificação descartada no canal {notificacao.channel}: {notificacao.payload[:200]!r}")
+
+    def _escutar(self):
+        while True:
+            conexao = None
+            try:
+                conexao = psycopg2.connect(self._dsn)
+                conexao.autocommit = True
+                canais = [self.canal, *self._ouvintes]
+                for canal in canais:
+                    conexao.cursor().execute(f'LISTEN {canal}')
+                for _, ao_reconectar in self._ouvintes.values():
+                    if ao_reconectar is not None:
+                        ao_reconectar()
+                logging.info(f"Escutando notificações dos canais {', '.join(canais)} (pid {os.getpid()})")
+                while True:
+                    if select.select([conexao], [], [], INTERVALO_HEARTBEAT) == ([], [], []):
+                        continue
+                    conexao.poll()
+                    while conexao.notifies:
+                        self._repassar(conexao.notifies.pop(0))
+            except Exception as e:
+                logging.warning(f"Conexão LISTEN perdida ({e}); reconectando em {ESPERA_RECONEXAO}s")
+            finally:
+                # A conexão do LISTEN fica fora do pool (reservada em gunicorn.conf.py):
+                # uma por processo, nunca acumulando a cada reconexão
+                if conexao is not None:
+                    try:
+                        conexao.close()
+                    except Exception:
+                        pass
+            time.sleep(ESPERA_RECONEXAO)
+
+
+central_eventos = CentralEventos()
+
+
+def formatar_evento(evento):
+    """Formata um evento no protocolo SSE."""
+    return f"event: agendamento\nid: {evento.get('id')}\ndata: {json.dumps(evento)}\n\n"
+
+
+def fluxo_sse(assinatura):
+    """
+    Gera a resposta SSE de uma assinatura até o cliente desconectar (ou ficar para trás).
+    Não usa o banco: pode rodar fora do contexto da requisição.
+    """
+    try:
+        yield f"retry: {ESPERA_RECONEXAO * 1000}\n\n"
+        while not assinatura.encerrada:
+            try:
+                evento = assinatura.fila.get(timeout=INTERVALO_HEARTBEAT)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield formatar_evento(evento)
+    finally:
+        central_eventos.cancelar(assinatura)
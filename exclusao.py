@@ -0,0 +1,159 @@
+import logging
+import secrets
+from datetime import datetime
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from aplicacao import db
+from modelos import Agendamento, Funcionario, ListaEspera, LogAuditoria, SerieAgendamento, Usuario
+from lista_espera import ofertar_vagas_canceladas
+from periodos import agora_na_empresa
+
+# Exclusão de clientes e usuários em duas etapas.
+#
+# 1. Na requisição (excluir_usuario): exclusão lógica. O usuário fica inativo e com
+#    excluido_em preenchido, o que o tira do login e das pesquisas na hora, sem tocar
+#    nos agendamentos.
+# 2. Em segundo plano (purgar_usuarios_excluidos, comando `flask purgar-excluidos`):
+#    os dados dependentes são tratados em lotes pequenos, com commit a cada lote, e o
+#    usuário é removido ou, se ainda houver histórico que o referencia, anonimizado.
+
+# Linhas alteradas por transação no expurgo
+LOTE_EXPURGO = 500
+
+NOME_ANONIMO = 'Usuário removido'
+
+
+def excluir_usuario(usuario):
+    """Exclusão lógica do usuário (e do seu perfil de funcionário). Não faz commit."""
+    usuario.ativo = False
+    usuario.excluido_em = datetime.utcnow()
+    if usuario.perfil_funcionario is not None:
+        usuario.perfil_funcionario.ativo = False
+
+
+def _em_lotes(tabela_id, condicao, valores, lote, apos_lote=None):
+    """
+    Aplica `valores` às linhas que atendem `condicao`, `lote` linhas por transação
+    (FOR UPDATE SKIP LOCKED, como na finalização de agendamentos). `apos_lote` recebe os
+    ids alterados de cada lote, antes do commit. Retorna o total.
+
+    Só para quando um lote não altera nada: com SKIP LOCKED, um lote menor que `lote`
+    pode ser apenas sinal de linhas travadas por outra transação naquele momento.
+    """
+    modelo = tabela_id.class_
+    total = 0
+    while True:
+        alvo = select(tabela_id).where(condicao).limit(lote).with_for_update(skip_locked=True)
+        alterados = db.session.execute(
+            update(modelo)
+            .where(tabela_id.in_(alvo.scalar_subquery()))
+            .values(**valores)
+            .returning(tabela_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        if apos_lote is not None and alterados:
+            apos_lote(alterados)
+        db.session.commit()
+        if not alterados:
+            return total
+        total += len(alterados)
+
+
+def _anonimizar(usuario):
+    usuario.nome = NOME_ANONIMO
+    usuario.username = f'removido-{usuario.id}'
+    usuario.email = f'removido-{usuario.id}@removido.invalid'
+    usuario.telefone = None
+    usuario.set_password(secrets.token_urlsafe(32))
+
+
+def purgar_usuario(usuario, lote=LOTE_EXPURGO):
+    """
+    Trata os dados de um usuário excluído, em lotes:
+      - agendamentos futuros ainda 'agendado' (como cliente ou funcionário) são cancelados,
+        e os horários dos do cliente são ofertados à lista de espera;
+      - observações dos agendamentos do cliente são apagadas;
+      - séries recorrentes são encerradas;
+      - o cliente sai da lista de espera; esperas pelo funcionário são canceladas e
+        ofertas de horários dele voltam a aguardar;
+      - os logs de auditoria deixam de apontar para o usuário.
+    Depois o usuário (e o perfil de funcionário) é apagado; se o histórico de agendamentos
+    ainda o referencia, é anonimizado. Retorna a quantidade de agendamentos cancelados.
+    """
+    funcionario_id = usuario.perfil_funcionario.id if usuario.perfil_funcionario else None
+
+    # Horários de agendamento são locais: "futuro" é a partir de agora no fuso da empresa
+    futuros = and_(Agendamento.status == 'agendado',
+                   Agendamento.data_agendamento >= agora_na_empresa(usuario.empresa_id))
+    cancelados = 0
+    if funcionario_id is not None:
+        # Os horários do funcionário removido não são ofertados: ele não atende mais
+        cancelados += _em_lotes(Agendamento.id, and_(Agendamento.funcionario_id == funcionario_id, futuros),
+                                {'status': 'cancelado'}, lote)
+    # Os do cliente voltam para a lista de espera, como qualquer cancelamento
+    cancelados += _em_lotes(Agendamento.id, and_(Agendamento.cliente_id == usuario.id, futuros),
+                            {'status': 'cancelado'}, lote, apos_lote=ofertar_vagas_canceladas)
+    _em_lotes(
+        Agendamento.id,
+        and_(Agendamento.cliente_id == usuario.id, Agendamento.observacoes.isnot(None)),
+        {'observacoes': None}, lote,
+    )
+    _em_lotes(
+        SerieAgendamento.id,
+        and_(
+            or_(SerieAgendamento.cliente_id == usuario.id, SerieAgendamento.funcionario_id == funcionario_id),
+            SerieAgendamento.ativa.is_(True),
+        ),
+        {'ativa': False}, lote,
+    )
+    _em_lotes(LogAuditoria.id, LogAuditoria.usuario_id == usuario.id, {'usuario_id': None}, lote)
+    if funcionario_id is not None:
+        _em_lotes(
+            ListaEspera.id,
+            and_(ListaEspera.funcionario_id == funcionario_id, ListaEspera.status.in_(('aguardando', 'ofertado'))),
+            {'status': 'cancelado'}, lote,
+        )
+        _em_lotes(
+            ListaEspera.id,
+            and_(ListaEspera.vaga_funcionario_id == funcionario_id, ListaEspera.status == 'ofertado'),
+            {'status': 'aguardando'}, lote,
+        )
+        _em_lotes(ListaEspera.id, ListaEspera.funcionario_id == funcionario_id, {'funcionario_id': None}, lote)
+        _em_lotes(ListaEspera.id, ListaEspera.vaga_funcionario_id == funcionario_id, {'vaga_funcionario_id': None}, lote)
+
+    # DELETE direto (sem db.session.delete) para o ORM não carregar os agendamentos relacionados
+    try:
+        with db.session.begin_nested():
+            db.session.execute(delete(ListaEspera).where(ListaEspera.cliente_id == usuario.id))
+            if funcionario_id is not None:
+                db.session.execute(delete(Funcionario).where(Funcionario.id == funcionario_id))
+            db.session.execute(delete(Usuario).where(Usuario.id == usuario.id))
+        db.session.expunge(usuario)
+        logging.info(f"Usuário {usuario.id} expurgado")
+    except IntegrityError:
+        # Agendamentos ou séries passados ainda apontam para o usuário: mantém o registro sem dados pessoais
+        db.session.refresh(usuario)
+        _anonimizar(usuario)
+        usuario.expurgado_em = datetime.utcnow()
+        logging.info(f"Usuário {usuario.id} anonimizado")
+    db.session.commit()
+    return cancelados
+
+
+def purgar_usuarios_excluidos(lote=LOTE_EXPURGO):
+    """
+    Tarefa agendada: expurga todos os usuários excluídos logicamente e ainda pendentes.
+    Retorna (usuários processados, agendamentos cancelados).
+    """
+    pendentes = db.session.execute(
+        select(Usuario.id)
+        .where(Usuario.excluido_em.isnot(None), Usuario.expurgado_em.is_(None))
+        .order_by(Usuario.excluido_em)
+    ).scalars().all()
+
+    cancelados = 0
+    for usuario_id in pendentes:
+        usuario = db.session.get(Usuario, usuario_id)
+        if usuario is not None:
+            cancelados += purgar_usuario(usuario, lote)
+    return len(pendentes), cancelados
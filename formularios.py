@@ -2,13 +2,15 @@ from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 # Importe os novos tipos de campo e validadores aqui
 from wtforms import (StringField, PasswordField, SelectField, TextAreaField, 
-                     DateTimeField, IntegerField, BooleanField, FloatField, SubmitField)
+                     DateTimeField, DateTimeLocalField, DateField, IntegerField, BooleanField,
+                     FloatField, SubmitField, SelectMultipleField, TimeField)
 from wtforms.validators import (DataRequired, Email, Length, EqualTo, Optional, 
-                                NumberRange, ValidationError)
+                                NumberRange, ValidationError, InputRequired)
 from wtforms.widgets import DateTimeInput
 
 # Importe o novo modelo 'Servico' para usar no AgendamentoForm
-from modelos import Cargo, Funcionario, Servico
+from modelos import Cargo, Funcionario, Servico, DIAS_SEMANA
+from cache_consultas import consulta_em_cache
 
 class LoginForm(FlaskForm):
     username = StringField('Usuário', validators=[DataRequired(), Length(min=3, max=80)])
@@ -59,6 +61,8 @@ class CadastroClienteForm(FlaskForm):
 class FuncionarioForm(FlaskForm):
     usuario_id = SelectField('Usuário', coerce=int, validators=[DataRequired()])
     cargo_id = SelectField('Cargo', coerce=int, validators=[DataRequired()])
+    # Vazio = atende todos os serviços
+    servicos = SelectMultipleField('Serviços que atende', coerce=int, validators=[Optional()])
     
     def __init__(self, *args, **kwargs):
         super(FuncionarioForm, self).__init__(*args, **kwargs)
@@ -69,19 +73,60 @@ class FuncionarioForm(FlaskForm):
                                      Usuario.ativo == True,
                                      Usuario.perfil_funcionario == None
                                  ).all()]
-        self.cargo_id.choices = [(c.id, c.nome) 
-                               for c in Cargo.query.all()]
+        self.cargo_id.choices = list(consulta_em_cache(
+            'opcoes_cargos', ('cargos',), lambda: [(c.id, c.nome) for c in Cargo.query.all()]
+        ))
+        self.servicos.choices = list(consulta_em_cache(
+            'opcoes_servicos', ('servicos',),
+            lambda: [(s.id, f"{s.nome} - R$ {s.preco:.2f}") for s in Servico.query.filter_by(ativo=True).all()]
+        ))
+
+class JornadaTrabalhoForm(FlaskForm):
+    dia_semana = SelectField('Dia', coerce=int, choices=DIAS_SEMANA, validators=[DataRequired()])
+    hora_inicio = TimeField('Início', validators=[DataRequired()])
+    hora_fim = TimeField('Fim', validators=[DataRequired()])
+    incluir = SubmitField('Incluir turno')
+
+    def validate_hora_fim(self, field):
+        if field.data and self.hora_inicio.data and field.data <= self.hora_inicio.data:
+            raise ValidationError('O fim do turno deve ser posterior ao início.')
+
+class ExcecaoJornadaForm(FlaskForm):
+    data = DateField('Data', validators=[DataRequired()])
+    tipo = SelectField('Tipo', choices=[('folga', 'Folga / indisponível'), ('extra', 'Horário extra')],
+                       validators=[DataRequired()])
+    # Sem horários, a exceção vale para o dia todo
+    hora_inicio = TimeField('Início', validators=[Optional()])
+    hora_fim = TimeField('Fim', validators=[Optional()])
+    motivo = StringField('Motivo', validators=[Optional(), Length(max=200)])
+    registrar = SubmitField('Registrar exceção')
+
+    def validate(self, extra_validators=None):
+        # Os horários são opcionais (Optional interrompe os validadores do campo vazio),
+        # então a combinação dos dois é conferida aqui
+        if not super().validate(extra_validators):
+            return False
+        if (self.hora_inicio.data is None) != (self.hora_fim.data is None):
+            self.hora_fim.errors.append('Informe início e fim, ou nenhum dos dois para o dia todo.')
+            return False
+        if self.hora_fim.data is not None and self.hora_fim.data <= self.hora_inicio.data:
+            self.hora_fim.errors.append('O fim deve ser posterior ao início.')
+            return False
+        return True
 
 class CargoForm(FlaskForm):
     nome = StringField('Nome do Cargo', validators=[DataRequired(), Length(min=2, max=100)])
     descricao = TextAreaField('Descrição', validators=[Optional(), Length(max=500)])
 
 class AgendamentoForm(FlaskForm):
+    # Oferece a opção 0 = qualquer funcionário disponível (escolhido por agenda.escolher_funcionario)
+    permite_qualquer_funcionario = True
+
     cliente_id = SelectField('Cliente', coerce=int, validators=[DataRequired()])
-    funcionario_id = SelectField('Funcionário', coerce=int, validators=[DataRequired()])
-    data_agendamento = DateTimeField('Data e Hora', 
-                                    validators=[DataRequired()],
-                                    widget=DateTimeInput())
+    funcionario_id = SelectField('Funcionário', coerce=int, validators=[InputRequired()])
+    data_agendamento = DateTimeLocalField('Data e Hora',
+                                          format='%Y-%m-%dT%H:%M',
+                                          validators=[DataRequired()])
     # O campo de servico agora deve ser um SelectField para o novo modelo de Servico
     servico_id = SelectField('Serviço', coerce=int, validators=[DataRequired()])
     observacoes = TextAreaField('Observações', validators=[Optional(), Length(max=500)])
@@ -97,19 +142,85 @@ class AgendamentoForm(FlaskForm):
         ).all()
         
         self.cliente_id.choices = [(u.id, f"{u.nome} ({u.email})") for u in clientes]
-        self.funcionario_id.choices = [(f.id, f"{f.usuario.nome} - {f.cargo.nome}") 
-                                      for f in Funcionario.query.filter_by(ativo=True).all()]
-        self.servico_id.choices = [(s.id, f"{s.nome} - R$ {s.preco:.2f}")
-                                  for s in Servico.query.filter_by(ativo=True).all()]
+        # Opções em cache (cache_consultas.py), invalidadas por commits nas tabelas de origem;
+        # list() para cada formulário ter a sua cópia
+        self.funcionario_id.choices = list(consulta_em_cache(
+            'opcoes_funcionarios', ('funcionarios', 'usuarios', 'cargos'),
+            lambda: [(f.id, f"{f.usuario.nome} - {f.cargo.nome}")
+                     for f in Funcionario.query.filter_by(ativo=True).all()]
+        ))
+        if self.permite_qualquer_funcionario:
+            self.funcionario_id.choices.insert(0, (0, 'Qualquer funcionário disponível'))
+        self.servico_id.choices = list(consulta_em_cache(
+            'opcoes_servicos', ('servicos',),
+            lambda: [(s.id, f"{s.nome} - R$ {s.preco:.2f}") for s in Servico.query.filter_by(ativo=True).all()]
+        ))
+
+class AgendamentoRecorrenteForm(AgendamentoForm):
+    # A série precisa de um funcionário fixo
+    permite_qualquer_funcionario = False
+
+    data_agendamento = DateTimeLocalField('Primeira Data e Hora',
+                                          format='%Y-%m-%dT%H:%M',
+                                          validators=[DataRequired()])
+    intervalo_semanas = SelectField('Repetir',
+                                    coerce=int,
+                                    choices=[(1, 'Toda semana'),
+                                             (2, 'A cada 2 semanas'),
+                                             (4, 'A cada 4 semanas')],
+                                    default=1)
+    data_termino = DateField('Repetir até', validators=[Optional()])
+
+    def validate_data_termino(self, field):
+        if field.data and self.data_agendamento.data and field.data < self.data_agendamento.data.date():
+            raise ValidationError('A data final deve ser posterior à primeira data.')
+
+class ListaEsperaForm(FlaskForm):
+    cliente_id = SelectField('Cliente', coerce=int, validators=[DataRequired()])
+    servico_id = SelectField('Serviço', coerce=int, validators=[DataRequired()])
+    # 0 = qualquer funcionário
+    funcionario_id = SelectField('Funcionário', coerce=int, default=0)
+    inicio_janela = DateTimeLocalField('Disponível a partir de', format='%Y-%m-%dT%H:%M',
+                                       validators=[DataRequired()])
+    fim_janela = DateTimeLocalField('Até', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
+
+    def __init__(self, *args, **kwargs):
+        super(ListaEsperaForm, self).__init__(*args, **kwargs)
+        from modelos import Usuario
+        clientes = Usuario.query.filter(
+            Usuario.ativo == True,
+            Usuario.tipo_usuario == 'restrito',
+            Usuario.perfil_funcionario == None
+        ).all()
+        self.cliente_id.choices = [(u.id, f"{u.nome} ({u.email})") for u in clientes]
+        self.funcionario_id.choices = [(0, 'Qualquer funcionário')] + list(consulta_em_cache(
+            'opcoes_funcionarios', ('funcionarios', 'usuarios', 'cargos'),
+            lambda: [(f.id, f"{f.usuario.nome} - {f.cargo.nome}")
+                     for f in Funcionario.query.filter_by(ativo=True).all()]
+        ))
+        self.servico_id.choices = list(consulta_em_cache(
+            'opcoes_servicos', ('servicos',),
+            lambda: [(s.id, f"{s.nome} - R$ {s.preco:.2f}") for s in Servico.query.filter_by(ativo=True).all()]
+        ))
+
+    def validate_fim_janela(self, field):
+        if field.data and self.inicio_janela.data and field.data <= self.inicio_janela.data:
+            raise ValidationError('O fim da janela deve ser posterior ao início.')
+
+STATUS_AGENDAMENTO = [('agendado', 'Agendado'),
+                      ('concluido', 'Concluído'),
+                      ('cancelado', 'Cancelado'),
+                      ('nao_compareceu', 'Não compareceu')]
 
 class AtualizarStatusAgendamentoForm(FlaskForm):
     status = SelectField('Status', 
-                         choices=[('agendado', 'Agendado'), 
-                                  ('concluido', 'Concluído'), 
-                                  ('cancelado', 'Cancelado')],
+                         choices=STATUS_AGENDAMENTO,
                          validators=[DataRequired()])
     observacoes = TextAreaField('Observações', validators=[Optional(), Length(max=500)])
 
+class AtualizarStatusLoteForm(FlaskForm):
+    status = SelectField('Status', choices=STATUS_AGENDAMENTO, validators=[DataRequired()])
+
 class ConfiguracaoBotWhatsAppForm(FlaskForm):
     whatsapp_token = StringField('Token de Acesso do WhatsApp', 
                                  validators=[Optional(), Length(max=500)])
@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import sys
+
+# Configuração do Gunicorn, carregada automaticamente de ./gunicorn.conf.py:
+#   gunicorn --bind 0.0.0.0:5000 main:app
+#
+# GUNICORN_PERFIL escolhe o modelo de concorrência:
+#   gevent (padrão): WEB_CONCURRENCY processos com até GUNICORN_CONEXOES greenlets cada,
+#           para muitos clientes lentos: os fluxos SSE da agenda ao vivo ficam abertos
+#           enquanto a aba estiver aberta. gevent e psycogreen são dependências do projeto.
+#   gthread: WEB_CONCURRENCY processos com GUNICORN_THREADS threads cada. Cada fluxo SSE
+#           ocuparia uma thread, então as páginas não abrem a agenda ao vivo
+#           (AGENDA_AO_VIVO=0, ver aplicacao.py).
+#
+# O pool do SQLAlchemy de cada worker é dimensionado a partir desses números para que
+# todos os workers juntos fiquem abaixo de DB_CONEXOES_MAXIMAS (o max_connections do
+# servidor menos uma folga para as tarefas agendadas e o psql). Os tamanhos chegam à
+# aplicação por DB_POOL_TAMANHO/DB_POOL_EXCEDENTE, lidos em aplicacao.py. No gevent há
+# mais greenlets que conexões, então a requisição espera até DB_POOL_ESPERA segundos
+# por uma conexão livre em vez de abrir outra.
+
+
+def dimensionar_pool(workers, concorrencia, conexoes_maximas, reservadas_por_worker=1):
+    """
+    Retorna (pool_size, max_overflow) de cada worker para que todos juntos nunca abram
+    mais que `conexoes_maximas` conexões. `concorrencia` é quantas requisições um worker
+    atende ao mesmo tempo; `reservadas_por_worker` conta as conexões fora do pool (a do
+    LISTEN da agenda ao vivo e da invalidação do cache de consultas, ver eventos.py).
+    """
+    por_worker = conexoes_maximas // workers - reservadas_por_worker
+    if por_worker < 1:
+        raise RuntimeError(
+            f"{workers} workers não cabem em {conexoes_maximas} conexões com o banco; "
+            "reduza WEB_CONCURRENCY ou aumente DB_CONEXOES_MAXIMAS"
+        )
+    pool_size = min(concorrencia, por_worker)
+    # Uma requisição pode usar por instantes uma segunda conexão (o limitador
+    # compartilhado faz o próprio commit)
+    max_overflow = min(concorrencia, por_worker - pool_size)
+    return pool_size, max_overflow
+
+
+perfil = os.environ.get('GUNICORN_PERFIL', 'gevent')
+if perfil not in ('gthread', 'gevent'):
+    raise RuntimeError(f"GUNICORN_PERFIL deve ser 'gthread' ou 'gevent', não {perfil!r}")
+
+worker_class = perfil
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+if perfil == 'gthread':
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+    concorrencia = threads
+else:
+    worker_connections = int(os.environ.get('GUNICORN_CONEXOES', 200))
+    concorrencia = worker_connections
+
+pool_size, max_overflow = dimensionar_pool(
+    workers, concorrencia, int(os.environ.get('DB_CONEXOES_MAXIMAS', 90))
+)
+os.environ.setdefault('DB_POOL_TAMANHO', str(pool_size))
+os.environ.setdefault('DB_POOL_EXCEDENTE', str(max_overflow))
+# Fluxos SSE abertos automaticamente pelas páginas só com workers assíncronos
+os.environ.setdefault('AGENDA_AO_VIVO', '1' if perfil == 'gevent' else '0')
+
+# O preload faz a preparação da aplicação (migrações, partições) uma vez no master e
+# compartilha o código carregado entre os workers. Não no gevent: a aplicação precisa ser
+# importada depois que o worker aplica o monkey-patch na biblioteca padrão. Nem com
+# --reload: workers criados a partir de um master pré-carregado continuariam com o
+# código antigo.
+preload_app = perfil == 'gthread' and '--reload' not in sys.argv
+
+keepalive = 5
+graceful_timeout = 20
+
+
+def post_fork(server, worker):
+    # Conexões abertas pelo master no preload não podem ser compartilhadas com os filhos:
+    # saem do pool de cada worker sem fechar os sockets do master
+    aplicacao = sys.modules.get('aplicacao')
+    if aplicacao is not None:
+        with aplicacao.app.app_context():
+            for engine in aplicacao.db.engines.values():
+                engine.dispose(close=False)
+
+    if perfil == 'gevent':
+        # Sem ceder ao hub do gevent enquanto espera, o psycopg2 trava o worker inteiro
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning("psycogreen não está instalado: as consultas ao banco vão travar o worker gevent")
+        else:
+            patch_psycopg()
+
+
+def when_ready(server):
+    server.log.info(
+        f"Perfil {perfil}: {workers} worker(s) x {concorrencia} requisição(ões) simultânea(s); "
+        f"pool_size={os.environ['DB_POOL_TAMANHO']} max_overflow={os.environ['DB_POOL_EXCEDENTE']} por worker"
+    )
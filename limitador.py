@@ -0,0 +1,224 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+from flask import current_app, g, request, Response
+from flask_login import current_user
+from sqlalchemy import text
+from aplicacao import db
+
+# Limite de requisições por token bucket.
+#
+# Cada limite tem uma capacidade (rajada máxima) e um período em que a capacidade
+# inteira é reposta; cada requisição consome um token do balde da sua chave (IP,
+# usuário ou empresa). Sem token, a resposta é 429 com Retry-After.
+#
+# Os baldes ficam em memória, num LRU limitado (uma tupla por chave), o que vale
+# por worker. Com LIMITADOR_BACKEND=postgres eles ficam numa tabela UNLOGGED
+# (migração 0012), compartilhada por todos os workers; se o banco falhar, o limite
+# volta a ser contado em memória.
+
+# nome: (capacidade, período em segundos)
+LIMITES_PADRAO = {
+    'login': (10, 60),            # tentativas de login por IP
+    'login_usuario': (5, 300),    # senhas erradas por IP e nome de usuário
+    'agendar': (30, 60),          # agendamentos por usuário
+    'api': (600, 60),             # requisições à API JSON por usuário
+    'backup': (3, 3600),          # downloads de backup por empresa
+}
+
+# Baldes mantidos em memória por worker; os menos usados são descartados
+CAPACIDADE_BALDES = 10000
+
+_SQL_CONSUMIR = text("""
+    INSERT INTO limites_requisicao AS b (chave, tokens, permitido, atualizado_em)
+    VALUES (:chave, :capacidade - 1, TRUE, now())
+    ON CONFLICT (chave) DO UPDATE SET
+        tokens = CASE WHEN {recarga} >= 1 THEN {recarga} - 1 ELSE {recarga} END,
+        permitido = {recarga} >= 1,
+        atualizado_em = now()
+    RETURNING permitido, tokens
+""".format(recarga="LEAST(:capacidade, b.tokens + EXTRACT(EPOCH FROM now() - b.atualizado_em)::float8 * :taxa)"))
+
+_SQL_CONSULTAR = text("""
+    SELECT LEAST(:capacidade, tokens + EXTRACT(EPOCH FROM now() - atualizado_em)::float8 * :taxa)
+    FROM limites_requisicao WHERE chave = :chave
+""")
+
+
+class BaldesMemoria:
+    """Token buckets em memória: chave -> (tokens, instante), com descarte LRU."""
+
+    def __init__(self, capacidade=CAPACIDADE_BALDES):
+        self.capacidade = capacidade
+        self._baldes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consumir(self, chave, capacidade, taxa):
+        """Tenta consumir um token. Retorna (permitido, tokens restantes)."""
+        agora = time.monotonic()
+        with self._lock:
+            tokens, instante = self._baldes.pop(chave, (capacidade, agora))
+            tokens = min(capacidade, tokens + (agora - instante) * taxa)
+            permitido = tokens >= 1
+            if permitido:
+                tokens -= 1
+            self._baldes[chave] = (tokens, agora)
+            if len(self._baldes) > self.capacidade:
+                self._baldes.popitem(last=False)
+        return permitido, tokens
+
+    def consultar(self, chave, capacidade, taxa):
+        """Tokens disponíveis agora, sem consumir."""
+        with self._lock:
+            tokens, instante = self._baldes.get(chave, (capacidade, time.monotonic()))
+        return min(capacidade, tokens + (time.monotonic() - instante) * taxa)
+
+    def __len__(self):
+        return len(self._baldes)
+
+
+class BaldesPostgres:
+    """Token buckets na tabela UNLOGGED limites_requisicao, atualizados por um único upsert."""
+
+    def consumir(self, chave, capacidade, taxa):
+        # Conexão própria e commit imediato, fora da transação da requisição
+        with db.engine.begin() as conn:
+            permitido, tokens = conn.execute(
+                _SQL_CONSUMIR, {'chave': chave, 'capacidade': float(capacidade), 'taxa': taxa}
+            ).one()
+        return permitido, tokens
+
+    def consultar(self, chave, capacidade, taxa):
+        with db.engine.connect() as conn:
+            tokens = conn.execute(
+                _SQL_CONSULTAR, {'chave': chave, 'capacidade': float(capacidade), 'taxa': taxa}
+            ).scalar()
+        return capacidade if tokens is None else tokens
+
+
+def limpar_baldes_expirados(conn):
+    """
+    Apaga da tabela compartilhada os baldes sem uso há mais tempo que o maior período
+    configurado (já estariam cheios de novo). Retorna a quantidade apagada.
+    """
+    limites = dict(LIMITES_PADRAO, **(current_app.config.get('LIMITES_REQUISICOES') or {}))
+    maior_periodo = max(periodo for _, periodo in limites.values())
+    resultado = conn.execute(
+        text("DELETE FROM limites_requisicao WHERE atualizado_em < now() - make_interval(secs => :segundos)"),
+        {'segundos': maior_periodo}
+    )
+    return resultado.rowcount
+
+
+class Limitador:
+    """Aplica os limites configurados e conta as requisições permitidas e negadas por limite."""
+
+    def __init__(self):
+        self.memoria = BaldesMemoria()
+        self.postgres = BaldesPostgres()
+        self.permitidas = Counter()
+        self.negadas = Counter()
+        self.falhas_backend = 0
+
+    def _limite(self, nome):
+        limites = current_app.config.get('LIMITES_REQUISICOES') or {}
+        capacidade, periodo = limites.get(nome, LIMITES_PADRAO[nome])
+        return capacidade, capacidade / periodo
+
+    def consumir(self, nome, chave):
+        """
+        Consome um token do limite `nome` para `chave`. Retorna None se a requisição
+        pode seguir ou os segundos até haver um token disponível.
+        """
+        if not current_app.config.get('LIMITADOR_ATIVO', True):
+            return None
+        capacidade, taxa = self._limite(nome)
+        permitido, tokens = self._nos_baldes('consumir', f'{nome}:{chave}', capacidade, taxa)
+
+        if permitido:
+            self.permitidas[nome] += 1
+            return None
+        self.negadas[nome] += 1
+        return (1 - tokens) / taxa
+
+    def consultar(self, nome, chave):
+        """
+        Como consumir(), mas só verifica se há token para `chave`, sem gastá-lo nem
+        contá-lo como permitido. Para limites que só devem custar quando a tentativa falha.
+        """
+        if not current_app.config.get('LIMITADOR_ATIVO', True):
+            return None
+        capacidade, taxa = self._limite(nome)
+        tokens = self._nos_baldes('consultar', f'{nome}:{chave}', capacidade, taxa)
+        if tokens >= 1:
+            return None
+        self.negadas[nome] += 1
+        return (1 - tokens) / taxa
+
+    def _nos_baldes(self, operacao, chave, capacidade, taxa):
+        baldes = self.memoria
+        if current_app.config.get('LIMITADOR_BACKEND') == 'postgres':
+            baldes = self.postgres
+        try:
+            return getattr(baldes, operacao)(chave, capacidade, taxa)
+        except Exception as e:
+            self.falhas_backend += 1
+            logging.warning(f"Limitador: backend compartilhado indisponível ({e}); usando memória")
+            return getattr(self.memoria, operacao)(chave, capacidade, taxa)
+
+    def metricas(self):
+        return {
+            'backend': current_app.config.get('LIMITADOR_BACKEND') or 'memoria',
+            'baldes_em_memoria': len(self.memoria),
+            'capacidade_baldes': self.memoria.capacidade,
+            'falhas_backend': self.falhas_backend,
+            'limites': {
+                nome: {
+                    'capacidade': self._limite(nome)[0],
+                    'por_minuto': round(self._limite(nome)[1] * 60, 2),
+                    'permitidas': self.permitidas[nome],
+                    'negadas': self.negadas[nome],
+                }
+                for nome in LIMITES_PADRAO
+            },
+        }
+
+
+limitador = Limitador()
+
+
+def chave_requisicao(por):
+    """Identifica quem faz a requisição: 'ip', 'usuario' (ou IP, se anônimo) ou 'empresa'."""
+    if por == 'usuario' and current_user.is_authenticated:
+        return f'u{current_user.id}'
+    if por == 'empresa':
+        return f"e{g.get('empresa_id')}"
+    return f'ip{request.remote_addr}'
+
+
+def segundos_retry_after(espera):
+    return str(max(1, math.ceil(espera)))
+
+
+def resposta_limite_excedido(espera):
+    return Response(
+        'Muitas requisições. Tente novamente em alguns instantes.', status=429,
+        headers={'Retry-After': segundos_retry_after(espera)}, mimetype='text/plain'
+    )
+
+
+def limitar(nome, por='ip', metodos=('POST',)):
+    """Aplica o limite `nome` à rota, por IP, usuário ou empresa, nos métodos indicados."""
+    def decorador(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if metodos is None or request.method in metodos:
+                espera = limitador.consumir(nome, chave_requisicao(por))
+                if espera is not None:
+                    return resposta_limite_excedido(espera)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorador
@@ -0,0 +1,259 @@
+import logging
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import and_, exists, func, literal_column, or_, select, update
+from aplicacao import db
+from agenda import horarios_em_conflito, travar_funcionario
+from modelos import Agendamento, ListaEspera, Servico, funcionario_servicos
+from periodos import agora_local_sql, agora_na_empresa
+
+# Lista de espera: clientes que querem um serviço numa janela de horário, com um
+# funcionário específico ou qualquer um.
+#
+# Quando um agendamento futuro é cancelado, o horário liberado é oferecido na mesma
+# transação ao melhor cliente elegível (ofertar_vaga): janela sobrepondo o horário com
+# espaço para a duração do serviço, mesmo funcionário (ou "qualquer um" que atenda o
+# serviço), pedidos com o funcionário exato antes dos genéricos e, entre eles, o mais
+# antigo. A busca usa o índice GiST de intervalos sobre as esperas em aberto
+# (ix_lista_espera_janela_aguardando), então o custo não cresce com o tamanho da lista,
+# e FOR UPDATE SKIP LOCKED para que dois cancelamentos simultâneos não ofereçam vagas ao
+# mesmo cliente.
+#
+# A tarefa `flask processar-lista-espera` avisa os clientes das ofertas novas, vence as
+# ofertas sem resposta no prazo (passando o horário ao próximo da fila) e encerra as
+# esperas cuja janela já passou.
+#
+# Todo cancelamento de agendamento futuro passa por ofertar_vagas_canceladas: a troca de
+# status (individual e em lote), o encerramento e a alteração de séries e o expurgo de
+# clientes excluídos.
+#
+# Como os agendamentos, as janelas, a vaga e o prazo da oferta ficam na hora local da
+# empresa (periodos.py), comparados com agora_na_empresa().
+
+# Minutos que o cliente tem para aceitar uma oferta
+PRAZO_OFERTA_MINUTOS = 30
+
+# Linhas por transação na tarefa de processamento
+LOTE_LISTA_ESPERA = 200
+
+_UM_MINUTO = literal_column("interval '1 minute'")
+
+
+def prazo_oferta():
+    return timedelta(minutes=current_app.config.get('LISTA_ESPERA_PRAZO_MINUTOS', PRAZO_OFERTA_MINUTOS))
+
+
+def entrar_na_lista(cliente_id, servico, inicio_janela, fim_janela, funcionario_id=None):
+    """Coloca o cliente na lista de espera. Não faz commit."""
+    entrada = ListaEspera(
+        cliente_id=cliente_id,
+        servico_id=servico.id,
+        funcionario_id=funcionario_id,
+        inicio_janela=inicio_janela,
+        fim_janela=fim_janela,
+        duracao_minutos=servico.duracao_minutos,
+    )
+    db.session.add(entrada)
+    return entrada
+
+
+def _atende(funcionario_id):
+    """O funcionário atende o serviço da espera (sem serviços associados, atende todos)."""
+    associado = funcionario_servicos.c.funcionario_id == funcionario_id
+    return or_(
+        exists().where(associado, funcionario_servicos.c.servico_id == ListaEspera.servico_id),
+        ~exists().where(associado),
+    )
+
+
+def ofertar_vaga(empresa_id, funcionario_id, inicio, fim, excluir_clientes=()):
+    """
+    Oferece o horário livre [inicio, fim) do funcionário ao melhor cliente em espera e
+    retorna a entrada ofertada (ou None). Não faz commit.
+    """
+    agora = agora_na_empresa(empresa_id)
+    inicio = max(inicio, agora)
+    if fim <= inicio:
+        return None
+
+    # Início possível do atendimento dentro da sobreposição entre a janela e a vaga
+    inicio_atendimento = func.greatest(ListaEspera.inicio_janela, inicio)
+    filtros = [
+        ListaEspera.status == 'aguardando',
+        # Mesmas expressões do índice GiST: empresa e sobreposição de intervalos
+        func.int4range(ListaEspera.empresa_id, ListaEspera.empresa_id, '[]').op('@>')(empresa_id),
+        func.tsrange(ListaEspera.inicio_janela, ListaEspera.fim_janela).op('&&')(func.tsrange(inicio, fim)),
+        func.least(ListaEspera.fim_janela, fim) - inicio_atendimento >= ListaEspera.duracao_minutos * _UM_MINUTO,
+        or_(ListaEspera.funcionario_id == funcionario_id, and_(ListaEspera.funcionario_id.is_(None), _atende(funcionario_id))),
+    ]
+    if excluir_clientes:
+        filtros.append(ListaEspera.cliente_id.notin_(excluir_clientes))
+    candidato = select(ListaEspera).where(*filtros).order_by(
+        ListaEspera.funcionario_id.is_(None), ListaEspera.criado_em, ListaEspera.id
+    ).limit(1).with_for_update(skip_locked=True)
+
+    entrada = db.session.execute(candidato).scalar_one_or_none()
+    if entrada is None:
+        return None
+
+    entrada.status = 'ofertado'
+    entrada.vaga_funcionario_id = funcionario_id
+    entrada.vaga_inicio = inicio
+    entrada.vaga_fim = fim
+    entrada.ofertado_em = agora
+    entrada.oferta_expira_em = agora + prazo_oferta()
+    entrada.notificado_em = None
+    return entrada
+
+
+def ofertar_vagas_canceladas(ids):
+    """
+    Oferece à lista de espera os horários futuros dos agendamentos cancelados `ids`
+    (o que já passou é descartado por ofertar_vaga). Retorna as entradas ofertadas.
+    Não faz commit.
+    """
+    if not ids:
+        return []
+    vagas = db.session.execute(
+        select(Agendamento.empresa_id, Agendamento.funcionario_id, Agendamento.cliente_id,
+               Agendamento.data_agendamento, Agendamento.data_fim)
+        .where(Agendamento.id.in_(ids), Agendamento.status == 'cancelado')
+    ).all()
+    ofertadas = []
+    for vaga in vagas:
+        entrada = ofertar_vaga(vaga.empresa_id, vaga.funcionario_id, vaga.data_agendamento, vaga.data_fim,
+                               excluir_clientes=(vaga.cliente_id,))
+        if entrada is not None:
+            ofertadas.append(entrada)
+    return ofertadas
+
+
+def _repassar_vaga(entrada):
+    """Passa o horário ofertado a `entrada` para o próximo da fila."""
+    return ofertar_vaga(entrada.empresa_id, entrada.vaga_funcionario_id, entrada.vaga_inicio, entrada.vaga_fim,
+                        excluir_clientes=(entrada.cliente_id,))
+
+
+def aceitar_oferta(entrada):
+    """
+    Cria o agendamento da oferta, se ainda está no prazo e o horário continua livre.
+    Retorna o agendamento ou None: oferta vencida (o horário passa ao próximo) ou
+    horário já ocupado (a entrada volta a aguardar). Não faz commit.
+    """
+    if entrada.oferta_expira_em < agora_na_empresa(entrada.empresa_id):
+        entrada.status = 'expirado'
+        _repassar_vaga(entrada)
+        return None
+    inicio = max(entrada.vaga_inicio, entrada.inicio_janela)
+    travar_funcionario(entrada.vaga_funcionario_id)
+    if horarios_em_conflito(entrada.vaga_funcionario_id, [inicio], entrada.duracao_minutos):
+        entrada.status = 'aguardando'
+        return None
+
+    servico = db.session.get(Servico, entrada.servico_id)
+    agendamento = Agendamento(
+        empresa_id=entrada.empresa_id,
+        cliente_id=entrada.cliente_id,
+        funcionario_id=entrada.vaga_funcionario_id,
+        data_agendamento=inicio,
+        servico=servico.nome,
+        servico_id=servico.id,
+        duracao_minutos=entrada.duracao_minutos,
+        preco_total=servico.preco,
+        observacoes='Agendado pela lista de espera',
+    )
+    db.session.add(agendamento)
+    db.session.flush()
+    entrada.status = 'aceito'
+    entrada.agendamento_id = agendamento.id
+    # O que sobrou do horário liberado, antes e depois do atendimento, continua com a fila
+    for sobra_inicio, sobra_fim in ((entrada.vaga_inicio, inicio), (agendamento.data_fim, entrada.vaga_fim)):
+        if sobra_fim > sobra_inicio:
+            ofertar_vaga(entrada.empresa_id, entrada.vaga_funcionario_id, sobra_inicio, sobra_fim,
+                         excluir_clientes=(entrada.cliente_id,))
+    return agendamento
+
+
+def recusar_oferta(entrada):
+    """O cliente recusa a oferta e volta a aguardar; o horário vai para o próximo. Não faz commit."""
+    entrada.status = 'aguardando'
+    return _repassar_vaga(entrada)
+
+
+def sair_da_lista(entrada):
+    """Cancela a espera (e devolve à fila uma oferta em aberto). Não faz commit."""
+    ofertado = entrada.status == 'ofertado'
+    entrada.status = 'cancelado'
+    if ofertado:
+        _repassar_vaga(entrada)
+
+
+def processar_lista_espera(lote=LOTE_LISTA_ESPERA):
+    """
+    Tarefa agendada:
+      - ofertas sem resposta no prazo vencem e o horário passa ao próximo da fila;
+      - esperas cuja janela já terminou são encerradas;
+      - os clientes com ofertas novas são avisados.
+    Cada etapa segue em lotes até um lote vazio (com SKIP LOCKED, um lote curto pode ser
+    só linhas travadas por outra transação).
+    Retorna (ofertas vencidas, esperas encerradas, avisos enviados).
+    """
+    # As linhas são de várias empresas: o "agora" de cada uma vem do seu fuso, no SQL
+    agora = agora_local_sql(ListaEspera.empresa_id)
+
+    vencidas = 0
+    while True:
+        ofertas = db.session.execute(
+            select(ListaEspera)
+            .where(ListaEspera.status == 'ofertado', ListaEspera.oferta_expira_em < agora)
+            .order_by(ListaEspera.oferta_expira_em).limit(lote).with_for_update(skip_locked=True)
+        ).scalars().all()
+        for entrada in ofertas:
+            entrada.status = 'expirado'
+            _repassar_vaga(entrada)
+        db.session.commit()
+        if not ofertas:
+            break
+        vencidas += len(ofertas)
+
+    encerradas = 0
+    while True:
+        alvo = select(ListaEspera.id).where(
+            ListaEspera.status == 'aguardando', ListaEspera.fim_janela <= agora
+        ).limit(lote).with_for_update(skip_locked=True)
+        resultado = db.session.execute(
+            update(ListaEspera).where(ListaEspera.id.in_(alvo.scalar_subquery()))
+            .values(status='expirado').execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if not resultado.rowcount:
+            break
+        encerradas += resultado.rowcount
+
+    avisos = 0
+    while True:
+        novas = db.session.execute(
+            select(ListaEspera)
+            .where(ListaEspera.status == 'ofertado', ListaEspera.notificado_em.is_(None))
+            .order_by(ListaEspera.ofertado_em).limit(lote).with_for_update(skip_locked=True)
+        ).scalars().all()
+        for entrada in novas:
+            avisar_oferta(entrada)
+            entrada.notificado_em = agora
+        db.session.commit()
+        if not novas:
+            break
+        avisos += len(novas)
+
+    return vencidas, encerradas, avisos
+
+
+def avisar_oferta(entrada):
+    """
+    Avisa o cliente da oferta. Ainda não há canal de mensagens: a oferta fica registrada
+    no log e aparece na página da lista de espera, onde pode ser aceita.
+    """
+    logging.info(
+        f"Lista de espera {entrada.id}: horário de {entrada.vaga_inicio:%d/%m/%Y %H:%M} ofertado ao cliente "
+        f"{entrada.cliente_id} até {entrada.oferta_expira_em:%d/%m/%Y %H:%M}"
+    )
@@ -0,0 +1,344 @@
+import logging
+from sqlalchemy import text
+
+# Migrações de esquema aplicadas em ordem, uma única vez por banco.
+# Cada item é (identificador, [comandos]) ou (identificador, [comandos], CONCORRENTE); um
+# comando é um SQL ou uma função que recebe a conexão, para passos que dependem do banco.
+# O db.create_all() continua criando as tabelas novas; aqui ficam as alterações em
+# tabelas que já existem em produção.
+#
+# Migrações marcadas como CONCORRENTE rodam fora de transação (autocommit), o que é
+# exigido por CREATE INDEX CONCURRENTLY: o índice é construído sem bloquear escritas.
+CONCORRENTE = True
+
+# Índices de agendamentos casados com as consultas mais frequentes (ver modelos.Agendamento)
+_INDICES_AGENDAMENTOS = [
+    "ix_agendamentos_data ON agendamentos (data_agendamento)",
+    "ix_agendamentos_criado_em ON agendamentos (criado_em)",
+    "ix_agendamentos_status ON agendamentos (status)",
+    "ix_agendamentos_funcionario_data ON agendamentos (funcionario_id, data_agendamento)",
+    "ix_agendamentos_funcionario_agendados ON agendamentos (funcionario_id, data_agendamento) "
+    "INCLUDE (data_fim) WHERE status = 'agendado'",
+    "ix_agendamentos_cliente_data ON agendamentos (cliente_id, data_agendamento)",
+    "ix_agendamentos_servico ON agendamentos (servico_id)",
+]
+
+
+
+def _criar_indices_agendamentos(conn):
+    """
+    Cria os índices de agendamentos sem bloquear escritas. Tabelas particionadas não
+    aceitam CONCURRENTLY; nelas os índices já vêm do db.create_all() (bancos novos) ou
+    da conversão feita por `flask particionar-agendamentos` (particoes.py).
+
+    Um CREATE INDEX CONCURRENTLY interrompido deixa o índice criado mas inválido
+    (pg_index.indisvalid = false), e o IF NOT EXISTS o pularia para sempre: índices
+    inválidos são apagados antes e construídos de novo.
+    """
+    tipo = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('agendamentos')")).scalar()
+    if tipo != 'r':
+        return
+    for indice in _INDICES_AGENDAMENTOS:
+        nome = indice.split()[0]
+        invalido = conn.execute(text(
+            "SELECT NOT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(:nome)"
+        ), {'nome': nome}).scalar()
+        if invalido:
+            logging.warning(f"Índice {nome} inválido (criação interrompida); reconstruindo")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}"))
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {indice}"))
+
+
+# Colunas de agendamentos depois das migrações 0001 a 0004, para a visão de histórico da
+# 0006. Congeladas aqui: o modelo atual tem colunas de migrações posteriores.
+_COLUNAS_AGENDAMENTOS_0006 = (
+    'id', 'cliente_id', 'funcionario_id', 'data_agendamento', 'status', 'observacoes', 'servico',
+    'duracao_minutos', 'criado_em', 'atualizado_em', 'serie_id', 'servico_id', 'preco_total', 'data_fim',
+)
+
+
+def _visao_historico(colunas):
+    """Visão com todo o histórico de agendamentos, ativo e arquivado, com as colunas listadas."""
+    lista = ', '.join(colunas)
+    return (f"CREATE OR REPLACE VIEW agendamentos_historico AS "
+            f"SELECT {lista} FROM agendamentos UNION ALL SELECT {lista} FROM agendamentos_arquivo")
+
+
+def _particionar_logs_auditoria(conn):
+    """
+    Converte logs_auditoria (comum, valores em texto) em tabela particionada por mês em
+    timestamp, com empresa_id e valores em JSONB. Textos que não são JSON válido viram
+    strings JSON. Em bancos novos o db.create_all() já cria a tabela particionada.
+    """
+    from modelos import LogAuditoria
+    from particoes import criar_particao
+
+    tipo = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('logs_auditoria')")).scalar()
+    if tipo != 'r':
+        return
+
+    conn.execute(text("ALTER TABLE logs_auditoria RENAME TO logs_auditoria_legado"))
+    conn.execute(text("ALTER TABLE logs_auditoria_legado RENAME CONSTRAINT logs_auditoria_pkey TO logs_auditoria_legado_pkey"))
+    conn.execute(text("ALTER SEQUENCE logs_auditoria_id_seq RENAME TO logs_auditoria_legado_id_seq"))
+    LogAuditoria.__table__.create(conn)
+
+    meses = conn.execute(text(
+        "SELECT DISTINCT date_trunc('month', COALESCE(timestamp, NOW()))::date FROM logs_auditoria_legado"
+    )).scalars().all()
+    for mes in meses:
+        criar_particao(conn, 'logs_auditoria', 'timestamp', mes)
+
+    conn.execute(text(
+        "CREATE FUNCTION pg_temp.texto_para_jsonb(valor TEXT) RETURNS JSONB AS $$ "
+        "BEGIN RETURN valor::jsonb; EXCEPTION WHEN others THEN RETURN to_jsonb(valor); END "
+        "$$ LANGUAGE plpgsql"
+    ))
+    conn.execute(text(
+        "INSERT INTO logs_auditoria (id, empresa_id, usuario_id, acao, tabela, registro_id, "
+        "valores_antigos, valores_novos, timestamp, ip_address) "
+        "SELECT l.id, COALESCE(u.empresa_id, (SELECT MIN(id) FROM empresas)), l.usuario_id, l.acao, l.tabela, "
+        "l.registro_id, pg_temp.texto_para_jsonb(l.valores_antigos), pg_temp.texto_para_jsonb(l.valores_novos), "
+        "COALESCE(l.timestamp, NOW()), l.ip_address "
+        "FROM logs_auditoria_legado l LEFT JOIN usuarios u ON u.id = l.usuario_id"
+    ))
+    conn.execute(text(
+        "SELECT setval(pg_get_serial_sequence('logs_auditoria', 'id'), "
+        "COALESCE((SELECT MAX(id) FROM logs_auditoria), 0) + 1, false)"
+    ))
+    conn.execute(text("DROP TABLE logs_auditoria_legado"))
+
+
+# Tabelas cujas linhas pertencem a uma empresa (modelos.PertenceEmpresa)
+_TABELAS_POR_EMPRESA = [
+    'usuarios', 'cargos', 'servicos', 'funcionarios', 'configuracao_empresa', 'series_agendamento', 'agendamentos',
+]
+
+
+def _coluna_empresa(tabela):
+    """Adiciona empresa_id à tabela, atribuindo as linhas existentes à empresa original."""
+    return [
+        f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS empresa_id INTEGER REFERENCES empresas (id)",
+        f"UPDATE {tabela} SET empresa_id = (SELECT MIN(id) FROM empresas) WHERE empresa_id IS NULL",
+        f"ALTER TABLE {tabela} ALTER COLUMN empresa_id SET NOT NULL",
+    ]
+
+
+MIGRACOES = [
+    ('0001_agendamentos_atualizado_em', [
+        "ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMP",
+        "UPDATE agendamentos SET atualizado_em = COALESCE(criado_em, NOW()) WHERE atualizado_em IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_atualizado_em ON agendamentos (atualizado_em, id)",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_funcionario_atualizado "
+        "ON agendamentos (funcionario_id, atualizado_em, id)",
+    ]),
+    ('0002_agendamentos_serie', [
+        "ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS serie_id INTEGER "
+        "REFERENCES series_agendamento (id)",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_serie ON agendamentos (serie_id, data_agendamento)",
+    ]),
+    ('0003_agendamentos_pendentes', [
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_pendentes ON agendamentos (data_agendamento) "
+        "WHERE status = 'agendado'",
+    ]),
+    ('0004_agendamentos_servico_preco_fim', [
+        "ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS servico_id INTEGER REFERENCES servicos (id)",
+        "ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS preco_total FLOAT",
+        "ALTER TABLE agendamentos ADD COLUMN IF NOT EXISTS data_fim TIMESTAMP",
+        "UPDATE agendamentos SET data_fim = data_agendamento + COALESCE(duracao_minutos, 60) * interval '1 minute' "
+        "WHERE data_fim IS NULL",
+        # Agendamentos antigos guardavam apenas o nome do serviço
+        "UPDATE agendamentos a SET servico_id = s.id, preco_total = COALESCE(a.preco_total, s.preco) "
+        "FROM servicos s WHERE a.servico_id IS NULL AND a.servico = s.nome",
+    ]),
+    ('0005_agendamentos_indices', [_criar_indices_agendamentos], CONCORRENTE),
+    ('0006_agendamentos_arquivo', [
+        # A conversão de agendamentos em particionada bloqueia a tabela durante a cópia e
+        # não roda aqui: ver `flask particionar-agendamentos`. Partições antigas são
+        # movidas para cá (particoes.arquivar_particoes)
+        "CREATE TABLE IF NOT EXISTS agendamentos_arquivo (LIKE agendamentos INCLUDING DEFAULTS) "
+        "PARTITION BY RANGE (data_agendamento)",
+        # Consulta sob demanda de todo o histórico, ativo e arquivado
+        _visao_historico(_COLUNAS_AGENDAMENTOS_0006),
+    ]),
+    ('0007_empresas', [
+        # A instalação existente vira a primeira empresa
+        "INSERT INTO empresas (nome, ativa, criado_em) "
+        "SELECT COALESCE((SELECT nome_empresa FROM configuracao_empresa ORDER BY id LIMIT 1), 'JT Sistemas'), "
+        "TRUE, NOW() WHERE NOT EXISTS (SELECT 1 FROM empresas)",
+        *[comando for tabela in _TABELAS_POR_EMPRESA for comando in _coluna_empresa(tabela)],
+        "ALTER TABLE agendamentos_arquivo ADD COLUMN IF NOT EXISTS empresa_id INTEGER",
+        "UPDATE agendamentos_arquivo SET empresa_id = (SELECT MIN(id) FROM empresas) WHERE empresa_id IS NULL",
+        _visao_historico(_COLUNAS_AGENDAMENTOS_0006 + ('empresa_id',)),
+        # Nomes únicos passam a valer por empresa
+        "ALTER TABLE usuarios DROP CONSTRAINT IF EXISTS usuarios_username_key",
+        "ALTER TABLE usuarios DROP CONSTRAINT IF EXISTS usuarios_email_key",
+        "ALTER TABLE cargos DROP CONSTRAINT IF EXISTS cargos_nome_key",
+        "ALTER TABLE servicos DROP CONSTRAINT IF EXISTS servicos_nome_key",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_usuarios_empresa_username ON usuarios (empresa_id, username)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_usuarios_empresa_email ON usuarios (empresa_id, email)",
+        "CREATE INDEX IF NOT EXISTS ix_usuarios_empresa_nome ON usuarios (empresa_id, nome)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_cargos_empresa_nome ON cargos (empresa_id, nome)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_servicos_empresa_nome ON servicos (empresa_id, nome)",
+        "CREATE INDEX IF NOT EXISTS ix_funcionarios_empresa_ativo ON funcionarios (empresa_id, ativo)",
+        # Índices globais de agendamentos substituídos pelas versões que começam por empresa_id
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_empresa_data ON agendamentos (empresa_id, data_agendamento)",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_empresa_criado_em ON agendamentos (empresa_id, criado_em)",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_empresa_status ON agendamentos (empresa_id, status)",
+        "CREATE INDEX IF NOT EXISTS ix_agendamentos_empresa_atualizado_em "
+        "ON agendamentos (empresa_id, atualizado_em, id)",
+        "DROP INDEX IF EXISTS ix_agendamentos_data",
+        "DROP INDEX IF EXISTS ix_agendamentos_criado_em",
+        "DROP INDEX IF EXISTS ix_agendamentos_status",
+        "DROP INDEX IF EXISTS ix_agendamentos_atualizado_em",
+    ]),
+    ('0008_agendamentos_notificar', [
+        # Publica as alterações de agendamentos para os clientes SSE (eventos.py). A
+        # restauração de backups (backup_empresa.py) liga app.restaurando só na sua
+        # transação (SET LOCAL) para não mandar um aviso por linha restaurada, sem o
+        # ALTER TABLE ... DISABLE TRIGGER que travaria a tabela inteira
+        """CREATE OR REPLACE FUNCTION notificar_agendamento() RETURNS trigger AS $$
+        DECLARE
+            linha RECORD;
+            evento TEXT;
+        BEGIN
+            IF current_setting('app.restaurando', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'DELETE' THEN
+                linha := OLD;
+                evento := 'removido';
+            ELSIF TG_OP = 'INSERT' THEN
+                linha := NEW;
+                evento := 'criado';
+            ELSE
+                linha := NEW;
+                evento := CASE WHEN NEW.status = 'cancelado' AND OLD.status IS DISTINCT FROM 'cancelado'
+                               THEN 'cancelado' ELSE 'atualizado' END;
+            END IF;
+            PERFORM pg_notify('agendamentos', json_build_object(
+                'evento', evento,
+                'id', linha.id,
+                'empresa_id', linha.empresa_id,
+                'funcionario_id', linha.funcionario_id,
+                'cliente_id', linha.cliente_id,
+                'status', linha.status,
+                'data_agendamento', linha.data_agendamento
+            )::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS tg_agendamentos_notificar ON agendamentos",
+        "CREATE TRIGGER tg_agendamentos_notificar AFTER INSERT OR UPDATE OR DELETE ON agendamentos "
+        "FOR EACH ROW EXECUTE FUNCTION notificar_agendamento()",
+    ]),
+    ('0009_visoes_receita', [
+        # Receita pré-agregada para os relatórios (analises.py); atualizada por
+        # REFRESH ... CONCURRENTLY, que exige um índice único sobre todas as linhas
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS receita_diaria AS "
+        "SELECT empresa_id, data_agendamento::date AS dia, "
+        "COALESCE(servico_id, 0) AS servico_id, funcionario_id, "
+        "COALESCE(SUM(preco_total) FILTER (WHERE status = 'concluido'), 0) AS receita, "
+        "COALESCE(SUM(preco_total) FILTER (WHERE status = 'agendado'), 0) AS receita_prevista, "
+        "COUNT(*) FILTER (WHERE status = 'concluido') AS atendimentos, "
+        "COUNT(*) FILTER (WHERE status = 'cancelado') AS cancelados "
+        "FROM agendamentos GROUP BY 1, 2, 3, 4",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_receita_diaria "
+        "ON receita_diaria (empresa_id, dia, servico_id, funcionario_id)",
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS receita_mensal_clientes AS "
+        "SELECT empresa_id, date_trunc('month', data_agendamento)::date AS mes, cliente_id, "
+        "COALESCE(SUM(preco_total) FILTER (WHERE status = 'concluido'), 0) AS receita, "
+        "COALESCE(SUM(preco_total) FILTER (WHERE status = 'agendado'), 0) AS receita_prevista, "
+        "COUNT(*) FILTER (WHERE status = 'concluido') AS atendimentos, "
+        "COUNT(*) FILTER (WHERE status = 'cancelado') AS cancelados "
+        "FROM agendamentos GROUP BY 1, 2, 3",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_receita_mensal_clientes "
+        "ON receita_mensal_clientes (empresa_id, mes, cliente_id)",
+        # Momento da última atualização de cada visão, exibido nos relatórios
+        "CREATE TABLE IF NOT EXISTS visoes_atualizadas ("
+        "nome VARCHAR(100) PRIMARY KEY, atualizada_em TIMESTAMP NOT NULL)",
+    ]),
+    ('0010_usuarios_exclusao_logica', [
+        "ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS excluido_em TIMESTAMP",
+        "ALTER TABLE usuarios ADD COLUMN IF NOT EXISTS expurgado_em TIMESTAMP",
+    ]),
+    ('0011_usuarios_indices_exclusao', [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_usuarios_empresa_nome_ativos "
+        "ON usuarios (empresa_id, nome) WHERE excluido_em IS NULL",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_usuarios_expurgo_pendente "
+        "ON usuarios (excluido_em) WHERE excluido_em IS NOT NULL AND expurgado_em IS NULL",
+        # Substituído pelo índice parcial acima
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_usuarios_empresa_nome",
+    ], CONCORRENTE),
+    ('0012_limites_requisicao', [
+        # Token buckets do limitador compartilhados entre workers (limitador.py); UNLOGGED
+        # porque o conteúdo é descartável e não precisa passar pelo WAL
+        "CREATE UNLOGGED TABLE IF NOT EXISTS limites_requisicao ("
+        "chave VARCHAR(255) PRIMARY KEY, "
+        "tokens DOUBLE PRECISION NOT NULL, "
+        "permitido BOOLEAN NOT NULL, "
+        "atualizado_em TIMESTAMPTZ NOT NULL)",
+    ]),
+    ('0013_fuso_horario', [
+        "ALTER TABLE configuracao_empresa ADD COLUMN IF NOT EXISTS fuso_horario VARCHAR(64) "
+        "NOT NULL DEFAULT 'America/Sao_Paulo'",
+    ]),
+    ('0014_funcionarios_jornada_versao', [
+        # Versão dos mapas de disponibilidade em cache (disponibilidade.py); as tabelas
+        # jornadas_trabalho e excecoes_jornada vêm do create_all
+        "ALTER TABLE funcionarios ADD COLUMN IF NOT EXISTS jornada_versao INTEGER NOT NULL DEFAULT 0",
+    ]),
+    ('0015_logs_auditoria_particionada', [_particionar_logs_auditoria]),
+]
+
+# Chave do advisory lock que serializa a aplicação das migrações entre workers
+_LOCK_MIGRACOES = 7301001
+
+
+def aplicar_migracoes(engine):
+    """
+    Aplica as migrações pendentes. Só roda em PostgreSQL; em outros bancos
+    (desenvolvimento/testes) o esquema vem inteiramente do db.create_all().
+    """
+    if engine.dialect.name != 'postgresql':
+        return
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:chave)"), {'chave': _LOCK_MIGRACOES})
+        try:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migracoes ("
+                "identificador VARCHAR(100) PRIMARY KEY, "
+                "aplicada_em TIMESTAMP NOT NULL DEFAULT NOW())"
+            ))
+            conn.commit()
+            aplicadas = {linha[0] for linha in conn.execute(text("SELECT identificador FROM schema_migracoes"))}
+            conn.commit()
+
+            for identificador, comandos, *opcoes in MIGRACOES:
+                if identificador in aplicadas:
+                    continue
+                concorrente = bool(opcoes and opcoes[0])
+                if concorrente:
+                    conn.execution_options(isolation_level='AUTOCOMMIT')
+                try:
+                    for comando in comandos:
+                        if callable(comando):
+                            comando(conn)
+                        else:
+                            conn.execute(text(comando))
+                finally:
+                    if concorrente:
+                        conn.commit()
+                        conn.execution_options(isolation_level=conn.default_isolation_level)
+                conn.execute(
+                    text("INSERT INTO schema_migracoes (identificador) VALUES (:identificador)"),
+                    {'identificador': identificador}
+                )
+                conn.commit()
+                logging.info(f"Migração aplicada: {identificador}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:chave)"), {'chave': _LOCK_MIGRACOES})
+            conn.commit()
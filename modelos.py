@@ -1,20 +1,61 @@
 from aplicacao import db
 from flask_login import UserMixin
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declared_attr
 from werkzeug.security import generate_password_hash, check_password_hash
 
-class Usuario(UserMixin, db.Model):
+# Ordem fixa das permissões usada para compor a máscara de bits do usuário
+PERMISSOES_USUARIO = (
+    'pode_cadastrar_cliente',
+    'pode_cadastrar_funcionario',
+    'pode_cadastrar_cargo',
+    'pode_agendar',
+    'pode_ver_agendamentos',
+    'pode_ver_relatorios',
+)
+
+class Empresa(db.Model):
+    __tablename__ = 'empresas'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(200), nullable=False)
+    # Host de acesso: <subdominio>.<DOMINIO_BASE> ou um domínio próprio completo
+    subdominio = db.Column(db.String(63), unique=True, nullable=True)
+    dominio = db.Column(db.String(253), unique=True, nullable=True)
+    ativa = db.Column(db.Boolean, default=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Empresa {self.nome}>'
+
+class PertenceEmpresa:
+    """
+    Modelos cujas linhas pertencem a uma empresa (tenant). As consultas feitas durante
+    uma requisição são filtradas pela empresa atual e os registros novos recebem o
+    empresa_id automaticamente (ver tenancia.py).
+    """
+    @declared_attr
+    def empresa_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('empresas.id'), nullable=False)
+
+class Usuario(PertenceEmpresa, UserMixin, db.Model):
     __tablename__ = 'usuarios'
     
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
+    username = db.Column(db.String(80), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     tipo_usuario = db.Column(db.String(20), default='restrito')  # master, restrito
     nome = db.Column(db.String(100), nullable=False)
     telefone = db.Column(db.String(20))
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
     ativo = db.Column(db.Boolean, default=True)
+    # Exclusão lógica: o registro some das pesquisas na hora e os dados dependentes
+    # são removidos/anonimizados depois, em lotes (exclusao.py)
+    excluido_em = db.Column(db.DateTime, nullable=True)
+    expurgado_em = db.Column(db.DateTime, nullable=True)
     
     # Permissões específicas para usuários restritos
     pode_cadastrar_cliente = db.Column(db.Boolean, default=False)
@@ -24,6 +65,17 @@ class Usuario(UserMixin, db.Model):
     pode_ver_agendamentos = db.Column(db.Boolean, default=True)
     pode_ver_relatorios = db.Column(db.Boolean, default=False)
     
+    __table_args__ = (
+        db.Index('uq_usuarios_empresa_username', 'empresa_id', 'username', unique=True),
+        db.Index('uq_usuarios_empresa_email', 'empresa_id', 'email', unique=True),
+        # Pesquisas e listagens ordenadas por nome, só de usuários não excluídos
+        db.Index('ix_usuarios_empresa_nome_ativos', 'empresa_id', 'nome',
+                 postgresql_where=db.text('excluido_em IS NULL')),
+        # Fila do expurgo de usuários excluídos
+        db.Index('ix_usuarios_expurgo_pendente', 'excluido_em',
+                 postgresql_where=db.text('excluido_em IS NOT NULL AND expurgado_em IS NULL')),
+    )
+
     # Relationships
     perfil_funcionario = db.relationship('Funcionario', backref='usuario', uselist=False)
     agendamentos_cliente = db.relationship('Agendamento', foreign_keys='Agendamento.cliente_id', backref='cliente')
@@ -40,16 +92,28 @@ class Usuario(UserMixin, db.Model):
     def is_funcionario(self):
         return self.perfil_funcionario is not None
 
+    def mascara_permissoes(self):
+        """Retorna as permissões do usuário compactadas em um inteiro (um bit por permissão)."""
+        mascara = 0
+        for bit, permissao in enumerate(PERMISSOES_USUARIO):
+            if getattr(self, permissao, False):
+                mascara |= 1 << bit
+        return mascara
+
     def __repr__(self):
         return f'<Usuario {self.username}>'
 
-class Cargo(db.Model):
+class Cargo(PertenceEmpresa, db.Model):
     __tablename__ = 'cargos'
     
     id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(100), unique=True, nullable=False)
+    nome = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.Text)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('uq_cargos_empresa_nome', 'empresa_id', 'nome', unique=True),
+    )
     
     # Relationships
     funcionarios = db.relationship('Funcionario', backref='cargo')
@@ -57,19 +121,31 @@ class Cargo(db.Model):
     def __repr__(self):
         return f'<Cargo {self.nome}>'
     
-class Servico(db.Model):
+class Servico(PertenceEmpresa, db.Model):
     __tablename__ = 'servicos'
     id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(100), nullable=False, unique=True)
+    nome = db.Column(db.String(100), nullable=False)
     descricao = db.Column(db.Text, nullable=True)
     preco = db.Column(db.Float, nullable=False)
     duracao_minutos = db.Column(db.Integer, nullable=False)
     ativo = db.Column(db.Boolean, default=True)
 
+    __table_args__ = (
+        db.Index('uq_servicos_empresa_nome', 'empresa_id', 'nome', unique=True),
+    )
+
     def __repr__(self):
         return f'<Servico {self.nome}>'    
 
-class Funcionario(db.Model):
+# Serviços que cada funcionário atende. Funcionário sem nenhum serviço associado atende todos
+funcionario_servicos = db.Table(
+    'funcionario_servicos',
+    db.Column('funcionario_id', db.Integer, db.ForeignKey('funcionarios.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('servico_id', db.Integer, db.ForeignKey('servicos.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_funcionario_servicos_servico', 'servico_id', 'funcionario_id'),
+)
+
+class Funcionario(PertenceEmpresa, db.Model):
     __tablename__ = 'funcionarios'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -78,46 +154,229 @@ class Funcionario(db.Model):
     data_contratacao = db.Column(db.Date, default=datetime.utcnow().date)
     ativo = db.Column(db.Boolean, default=True)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    # Incrementada a cada alteração de jornada ou exceção; faz parte da chave dos mapas
+    # de disponibilidade em cache (disponibilidade.py)
+    jornada_versao = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_funcionarios_empresa_ativo', 'empresa_id', 'ativo'),
+    )
     
     # Relationships
     agendamentos = db.relationship('Agendamento', foreign_keys='Agendamento.funcionario_id', backref='funcionario')
+    servicos = db.relationship('Servico', secondary=funcionario_servicos, order_by='Servico.nome')
 
     def __repr__(self):
         return f'<Funcionario {self.usuario.nome}>'
 
-class Agendamento(db.Model):
+DIAS_SEMANA = ((1, 'Segunda'), (2, 'Terça'), (3, 'Quarta'), (4, 'Quinta'), (5, 'Sexta'), (6, 'Sábado'), (7, 'Domingo'))
+
+class JornadaTrabalho(PertenceEmpresa, db.Model):
+    """Turno semanal do funcionário; vários turnos no mesmo dia deixam intervalos (almoço)."""
+    __tablename__ = 'jornadas_trabalho'
+
+    id = db.Column(db.Integer, primary_key=True)
+    funcionario_id = db.Column(db.Integer, db.ForeignKey('funcionarios.id', ondelete='CASCADE'), nullable=False)
+    dia_semana = db.Column(db.SmallInteger, nullable=False)  # ISO: 1 = segunda ... 7 = domingo
+    hora_inicio = db.Column(db.Time, nullable=False)
+    hora_fim = db.Column(db.Time, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_jornadas_trabalho_funcionario', 'funcionario_id', 'dia_semana'),
+    )
+
+    funcionario = db.relationship('Funcionario', backref=db.backref('jornadas', lazy='dynamic'))
+
+    def __repr__(self):
+        return f'<JornadaTrabalho {self.funcionario_id} {self.dia_semana} {self.hora_inicio}-{self.hora_fim}>'
+
+class ExcecaoJornada(PertenceEmpresa, db.Model):
+    """
+    Exceção à jornada numa data: 'folga' (indisponível; sem horários = o dia todo) ou
+    'extra' (disponível além da jornada).
+    """
+    __tablename__ = 'excecoes_jornada'
+
+    id = db.Column(db.Integer, primary_key=True)
+    funcionario_id = db.Column(db.Integer, db.ForeignKey('funcionarios.id', ondelete='CASCADE'), nullable=False)
+    data = db.Column(db.Date, nullable=False)
+    tipo = db.Column(db.String(10), nullable=False, default='folga')  # folga, extra
+    hora_inicio = db.Column(db.Time)
+    hora_fim = db.Column(db.Time)
+    motivo = db.Column(db.String(200))
+
+    __table_args__ = (
+        db.Index('ix_excecoes_jornada_funcionario_data', 'funcionario_id', 'data'),
+    )
+
+    funcionario = db.relationship('Funcionario', backref=db.backref('excecoes_jornada', lazy='dynamic'))
+
+    def __repr__(self):
+        return f'<ExcecaoJornada {self.funcionario_id} {self.data} {self.tipo}>'
+
+class Agendamento(PertenceEmpresa, db.Model):
     __tablename__ = 'agendamentos'
     
-    id = db.Column(db.Integer, primary_key=True)
+    # Tabela particionada por mês em data_agendamento (ver particoes.py); por isso a
+    # chave primária física inclui a data. Para o ORM a identidade continua sendo o id.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
     funcionario_id = db.Column(db.Integer, db.ForeignKey('funcionarios.id'), nullable=False)
-    data_agendamento = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(20), default='agendado')  # agendado, concluido, cancelado
+    data_agendamento = db.Column(db.DateTime, primary_key=True, nullable=False)
+    status = db.Column(db.String(20), default='agendado')  # agendado, concluido, cancelado, nao_compareceu
     observacoes = db.Column(db.Text)
-    servico = db.Column(db.String(200))
+    servico = db.Column(db.String(200))  # nome do serviço no momento do agendamento
+    servico_id = db.Column(db.Integer, db.ForeignKey('servicos.id'), nullable=True)
     duracao_minutos = db.Column(db.Integer, default=60)
+    data_fim = db.Column(db.DateTime)  # data_agendamento + duracao_minutos
+    preco_total = db.Column(db.Float)
     criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    serie_id = db.Column(db.Integer, db.ForeignKey('series_agendamento.id'), nullable=True)
+
+    # Índices casados com as consultas de dashboard(), agendamentos(), agendar() e relatorios().
+    # Consultas sem funcionário/cliente são sempre da empresa atual, por isso começam por empresa_id.
+    __table_args__ = (
+        # Listagem geral, contagens por período e histograma mensal
+        db.Index('ix_agendamentos_empresa_data', 'empresa_id', 'data_agendamento'),
+        # "Agendamentos recentes" do dashboard master
+        db.Index('ix_agendamentos_empresa_criado_em', 'empresa_id', 'criado_em'),
+        # Contagens por status em relatorios()
+        db.Index('ix_agendamentos_empresa_status', 'empresa_id', 'status'),
+        # Agenda do funcionário (dashboard e listagem)
+        db.Index('ix_agendamentos_funcionario_data', 'funcionario_id', 'data_agendamento'),
+        # Verificação de conflito em agendar() e pendentes do funcionário
+        db.Index('ix_agendamentos_funcionario_agendados', 'funcionario_id', 'data_agendamento',
+                 postgresql_include=['data_fim'],
+                 postgresql_where=db.text("status = 'agendado'")),
+        # Agendamentos do cliente (dashboard e listagem)
+        db.Index('ix_agendamentos_cliente_data', 'cliente_id', 'data_agendamento'),
+        db.Index('ix_agendamentos_servico', 'servico_id'),
+        db.Index('ix_agendamentos_serie', 'serie_id', 'data_agendamento'),
+        # Agendamentos pendentes de todas as empresas (finalização automática)
+        db.Index('ix_agendamentos_pendentes', 'data_agendamento',
+                 postgresql_where=db.text("status = 'agendado'")),
+        # Sincronização incremental do calendário (cursor atualizado_em + id)
+        db.Index('ix_agendamentos_empresa_atualizado_em', 'empresa_id', 'atualizado_em', 'id'),
+        db.Index('ix_agendamentos_funcionario_atualizado', 'funcionario_id', 'atualizado_em', 'id'),
+        {'postgresql_partition_by': 'RANGE (data_agendamento)'},
+    )
+    __mapper_args__ = {'primary_key': [id]}
 
     def __repr__(self):
         return f'<Agendamento {self.id} - {self.cliente.nome}>'
 
-class LogAuditoria(db.Model):
-    __tablename__ = 'logs_auditoria'
-    
+@event.listens_for(Agendamento, 'before_insert')
+@event.listens_for(Agendamento, 'before_update')
+def calcular_data_fim(mapper, connection, agendamento):
+    """Mantém data_fim coerente com o início e a duração do agendamento."""
+    if agendamento.data_agendamento is not None:
+        agendamento.data_fim = agendamento.data_agendamento + timedelta(minutes=agendamento.duracao_minutos or 60)
+
+class SerieAgendamento(PertenceEmpresa, db.Model):
+    __tablename__ = 'series_agendamento'
+
+    id = db.Column(db.Integer, primary_key=True)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    funcionario_id = db.Column(db.Integer, db.ForeignKey('funcionarios.id'), nullable=False)
+    servico_id = db.Column(db.Integer, db.ForeignKey('servicos.id'), nullable=False)
+    # Regra da série: a partir de data_inicio, a cada intervalo_semanas, até data_termino (opcional)
+    data_inicio = db.Column(db.DateTime, nullable=False)
+    intervalo_semanas = db.Column(db.Integer, nullable=False, default=1)
+    data_termino = db.Column(db.Date, nullable=True)
+    observacoes = db.Column(db.Text)
+    ativa = db.Column(db.Boolean, default=True)
+    # Limite (exclusivo) até onde as ocorrências já viraram linhas em agendamentos
+    materializado_ate = db.Column(db.DateTime, nullable=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relationships
+    cliente = db.relationship('Usuario', foreign_keys=[cliente_id])
+    funcionario = db.relationship('Funcionario', foreign_keys=[funcionario_id])
+    servico = db.relationship('Servico', foreign_keys=[servico_id])
+    agendamentos = db.relationship('Agendamento', backref='serie', lazy='dynamic')
+
+    def __repr__(self):
+        return f'<SerieAgendamento {self.id} - {self.cliente.nome}>'
+
+class ListaEspera(PertenceEmpresa, db.Model):
+    __tablename__ = 'lista_espera'
+
     id = db.Column(db.Integer, primary_key=True)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    servico_id = db.Column(db.Integer, db.ForeignKey('servicos.id'), nullable=False)
+    funcionario_id = db.Column(db.Integer, db.ForeignKey('funcionarios.id'), nullable=True)  # None = qualquer um
+    # Janela [inicio_janela, fim_janela) em que o cliente aceita ser atendido
+    inicio_janela = db.Column(db.DateTime, nullable=False)
+    fim_janela = db.Column(db.DateTime, nullable=False)
+    duracao_minutos = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='aguardando')  # aguardando, ofertado, aceito, expirado, cancelado
+    # Oferta atual: horário liberado [vaga_inicio, vaga_fim) do funcionário. Sem chave
+    # estrangeira para agendamentos (tabela particionada); o agendamento criado ao aceitar
+    # fica em agendamento_id
+    vaga_funcionario_id = db.Column(db.Integer, db.ForeignKey('funcionarios.id'), nullable=True)
+    vaga_inicio = db.Column(db.DateTime, nullable=True)
+    vaga_fim = db.Column(db.DateTime, nullable=True)
+    ofertado_em = db.Column(db.DateTime, nullable=True)
+    oferta_expira_em = db.Column(db.DateTime, nullable=True)
+    notificado_em = db.Column(db.DateTime, nullable=True)
+    agendamento_id = db.Column(db.Integer, nullable=True)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+    cliente = db.relationship('Usuario', foreign_keys=[cliente_id])
+    servico = db.relationship('Servico', foreign_keys=[servico_id])
+    funcionario = db.relationship('Funcionario', foreign_keys=[funcionario_id])
+    vaga_funcionario = db.relationship('Funcionario', foreign_keys=[vaga_funcionario_id])
+
+    __table_args__ = (
+        # Índice de intervalos para achar quem espera por um horário liberado (lista_espera.py).
+        # GiST só com tipos nativos: a empresa entra como int4range de um elemento, sem
+        # depender da extensão btree_gist
+        db.Index('ix_lista_espera_janela_aguardando',
+                 db.text("int4range(empresa_id, empresa_id, '[]')"),
+                 db.text('tsrange(inicio_janela, fim_janela)'),
+                 postgresql_using='gist',
+                 postgresql_where=db.text("status = 'aguardando'")),
+        # Ofertas vencidas e esperas com a janela encerrada (tarefa processar-lista-espera)
+        db.Index('ix_lista_espera_ofertas', 'oferta_expira_em',
+                 postgresql_where=db.text("status = 'ofertado'")),
+        db.Index('ix_lista_espera_fim_aguardando', 'fim_janela',
+                 postgresql_where=db.text("status = 'aguardando'")),
+        db.Index('ix_lista_espera_cliente', 'cliente_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<ListaEspera {self.id} - {self.cliente.nome}>'
+
+class LogAuditoria(PertenceEmpresa, db.Model):
+    __tablename__ = 'logs_auditoria'
+
+    # Particionada por mês em timestamp (ver particoes.py): a retenção descarta partições
+    # inteiras em vez de DELETE. Como em agendamentos, a chave física inclui a data.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True)
     acao = db.Column(db.String(100), nullable=False)
     tabela = db.Column(db.String(50), nullable=False)
     registro_id = db.Column(db.Integer)
-    valores_antigos = db.Column(db.Text)
-    valores_novos = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Só os campos alterados: {campo: valor anterior} e {campo: valor novo} (auditoria.py)
+    valores_antigos = db.Column(JSONB)
+    valores_novos = db.Column(JSONB)
+    timestamp = db.Column(db.DateTime, primary_key=True, nullable=False, default=datetime.utcnow)
     ip_address = db.Column(db.String(45))
 
+    __table_args__ = (
+        # Histórico de um registro (auditoria.historico)
+        db.Index('ix_logs_auditoria_registro', 'tabela', 'registro_id', 'timestamp'),
+        # Expurgo de usuários excluídos (exclusao.purgar_usuario)
+        db.Index('ix_logs_auditoria_usuario', 'usuario_id'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
+    )
+    __mapper_args__ = {'primary_key': [id]}
+
     def __repr__(self):
         return f'<LogAuditoria {self.acao} em {self.tabela}>'
 
-class ConfiguracaoEmpresa(db.Model):
+class ConfiguracaoEmpresa(PertenceEmpresa, db.Model):
     __tablename__ = 'configuracao_empresa'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -126,6 +385,9 @@ class ConfiguracaoEmpresa(db.Model):
     whatsapp_token = db.Column(db.String(500))
     whatsapp_phone_id = db.Column(db.String(100))
     whatsapp_webhook_verify_token = db.Column(db.String(200))
+    # Fuso dos períodos de dashboard e relatórios (periodos.py)
+    fuso_horario = db.Column(db.String(64), nullable=False, default='America/Sao_Paulo',
+                             server_default='America/Sao_Paulo')
     atualizado_em = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
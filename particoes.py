@@ -0,0 +1,271 @@
+import logging
+from datetime import date, datetime
+from sqlalchemy import text
+
+# Manutenção de tabelas particionadas por mês (PARTITION BY RANGE sobre uma coluna de data).
+#
+# Convenções:
+#   <tabela>_pAAAAMM  partição do mês AAAA-MM, intervalo [primeiro dia do mês, primeiro dia do mês seguinte)
+#   <tabela>_padrao   partição DEFAULT, rede de segurança para datas sem partição própria
+#
+# Qualquer coluna adicionada a uma tabela particionada também precisa ser adicionada
+# à respectiva tabela de arquivo, senão partições antigas não podem ser anexadas a ela.
+
+# Chave do advisory lock que serializa criação/arquivamento de partições entre workers
+_LOCK_PARTICOES = 7301002
+
+
+def inicio_mes(valor):
+    return date(valor.year, valor.month, 1)
+
+
+def somar_meses(mes, quantidade):
+    total = mes.year * 12 + (mes.month - 1) + quantidade
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def nome_particao(tabela, mes):
+    return f'{tabela}_p{mes:%Y%m}'
+
+
+def _existe(conn, nome):
+    return conn.execute(text("SELECT to_regclass(:nome) IS NOT NULL"), {'nome': nome}).scalar()
+
+
+def tabela_particionada(conn, tabela):
+    return conn.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:tabela)"
+    ), {'tabela': tabela}).scalar() or False
+
+
+def meses_particionados(conn, tabela, tabela_origem=None):
+    """
+    Lista (em ordem) os meses que já têm partição própria na tabela. Numa tabela de
+    arquivo, `tabela_origem` é a tabela que dá nome às partições.
+    """
+    nomes = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:tabela)"
+    ), {'tabela': tabela}).scalars()
+
+    prefixo = f'{tabela_origem or tabela}_p'
+    meses = []
+    for nome in nomes:
+        sufixo = nome[len(prefixo):]
+        if nome.startswith(prefixo) and len(sufixo) == 6 and sufixo.isdigit():
+            meses.append(date(int(sufixo[:4]), int(sufixo[4:]), 1))
+    return sorted(meses)
+
+
+def criar_particao(conn, tabela, coluna, mes):
+    """
+    Cria a partição do mês, se ainda não existir. Linhas desse mês que tenham caído
+    na partição DEFAULT são movidas para a nova partição antes de anexá-la.
+    Retorna True quando a partição foi criada.
+    """
+    nome = nome_particao(tabela, mes)
+    if _existe(conn, nome):
+        return False
+
+    inicio, fim = mes, somar_meses(mes, 1)
+    padrao = f'{tabela}_padrao'
+    conn.execute(text(f"CREATE TABLE {nome} (LIKE {tabela} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if _existe(conn, padrao):
+        conn.execute(text(
+            f"WITH movidas AS (DELETE FROM {padrao} WHERE {coluna} >= :inicio AND {coluna} < :fim RETURNING *) "
+            f"INSERT INTO {nome} SELECT * FROM movidas"
+        ), {'inicio': inicio, 'fim': fim})
+    conn.execute(text(
+        f"ALTER TABLE {tabela} ATTACH PARTITION {nome} FOR VALUES FROM ('{inicio}') TO ('{fim}')"
+    ))
+    logging.info(f"Partição criada: {nome}")
+    return True
+
+
+def garantir_particoes(engine, tabela, coluna, meses_futuros=3):
+    """
+    Garante a partição DEFAULT e as partições do mês corrente até `meses_futuros` à frente.
+    Pode ser chamada a cada inicialização e pela tarefa diária; não faz nada fora do PostgreSQL.
+    """
+    if engine.dialect.name != 'postgresql':
+        return 0
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _LOCK_PARTICOES})
+        if not tabela_particionada(conn, tabela):
+            # Bancos anteriores ao particionamento até rodar `flask particionar-agendamentos`
+            logging.warning(f"{tabela} ainda não é particionada; partições não criadas")
+            return 0
+        return _criar_particoes_futuras(conn, tabela, coluna, meses_futuros)
+
+
+def _criar_particoes_futuras(conn, tabela, coluna, meses_futuros):
+    criadas = 0
+    mes_atual = inicio_mes(datetime.utcnow())
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {tabela}_padrao PARTITION OF {tabela} DEFAULT"))
+    for deslocamento in range(meses_futuros + 1):
+        criadas += criar_particao(conn, tabela, coluna, somar_meses(mes_atual, deslocamento))
+    return criadas
+
+
+def _dependentes(conn, tabela):
+    """
+    Comandos que recriam as visões (comuns e materializadas, com seus índices) e os
+    gatilhos da tabela, e os que apagam essas visões. Lidos do catálogo antes de a
+    tabela ser trocada, para valerem também para a tabela nova de mesmo nome.
+    """
+    visoes = conn.execute(text(
+        "SELECT DISTINCT v.oid, v.relname, v.relkind, pg_get_viewdef(v.oid) "
+        "FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid JOIN pg_class v ON v.oid = r.ev_class "
+        "WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = to_regclass(:tabela) AND v.oid <> d.refobjid"
+    ), {'tabela': tabela}).all()
+    apagar, recriar = [], []
+    for oid, nome, tipo, definicao in visoes:
+        materializada = 'MATERIALIZED ' if tipo == 'm' else ''
+        apagar.append(f"DROP {materializada}VIEW {nome}")
+        recriar.append(f"CREATE {materializada}VIEW {nome} AS {definicao.rstrip().rstrip(';')}")
+        recriar += conn.execute(text(
+            "SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = :oid"
+        ), {'oid': oid}).scalars().all()
+    recriar += conn.execute(text(
+        "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass(:tabela) AND NOT tgisinternal"
+    ), {'tabela': tabela}).scalars().all()
+    return apagar, recriar
+
+
+def particionar_agendamentos(engine, meses_futuros):
+    """
+    Converte agendamentos de tabela comum (bancos anteriores ao particionamento) em
+    tabela particionada por mês em data_agendamento, com o esquema do modelo atual,
+    preservando linhas, ids, visões e gatilhos. A tabela fica bloqueada para leitura e
+    escrita (ACCESS EXCLUSIVE) durante toda a cópia e a criação dos índices, por isso a
+    conversão não é uma migração: roda pelo comando `flask particionar-agendamentos`,
+    numa janela de manutenção. Retorna a quantidade de linhas copiadas, ou None se a
+    tabela já é particionada.
+    """
+    from modelos import Agendamento
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _LOCK_PARTICOES})
+        if tabela_particionada(conn, 'agendamentos'):
+            return None
+        # Na fila do lock, o LOCK já barraria todas as consultas à tabela: desiste logo
+        # se alguma transação longa o segura, em vez de parar a agenda esperando
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        conn.execute(text("LOCK TABLE agendamentos IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text("SET LOCAL lock_timeout = 0"))
+
+        apagar, recriar = _dependentes(conn, 'agendamentos')
+        for comando in apagar:
+            conn.execute(text(comando))
+
+        # Tira a tabela antiga do caminho, liberando nomes de índices, PK e sequência
+        conn.execute(text("ALTER TABLE agendamentos RENAME TO agendamentos_legado"))
+        conn.execute(text("ALTER TABLE agendamentos_legado RENAME CONSTRAINT agendamentos_pkey TO agendamentos_legado_pkey"))
+        conn.execute(text("ALTER SEQUENCE agendamentos_id_seq RENAME TO agendamentos_legado_id_seq"))
+        indices = conn.execute(text(
+            "SELECT indexname FROM pg_indexes "
+            "WHERE tablename = 'agendamentos_legado' AND indexname <> 'agendamentos_legado_pkey'"
+        )).scalars().all()
+        for indice in indices:
+            conn.execute(text(f"DROP INDEX {indice}"))
+
+        # As migrações já rodaram: a tabela antiga tem todas as colunas do modelo
+        Agendamento.__table__.create(conn)
+        meses = conn.execute(text(
+            "SELECT DISTINCT date_trunc('month', data_agendamento)::date FROM agendamentos_legado"
+        )).scalars().all()
+        for mes in meses:
+            criar_particao(conn, 'agendamentos', 'data_agendamento', mes)
+        _criar_particoes_futuras(conn, 'agendamentos', 'data_agendamento', meses_futuros)
+
+        colunas = ', '.join(coluna.name for coluna in Agendamento.__table__.columns)
+        copiadas = conn.execute(text(
+            f"INSERT INTO agendamentos ({colunas}) SELECT {colunas} FROM agendamentos_legado"
+        )).rowcount
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('agendamentos', 'id'), GREATEST("
+            "(SELECT MAX(id) FROM agendamentos), (SELECT last_value FROM agendamentos_legado_id_seq)))"
+        ))
+        # agendamentos_arquivo (LIKE agendamentos) herdou o default do id da sequência antiga
+        colunas_na_sequencia = conn.execute(text(
+            "SELECT ad.adrelid::regclass::text, a.attname FROM pg_depend d "
+            "JOIN pg_attrdef ad ON ad.oid = d.objid "
+            "JOIN pg_attribute a ON a.attrelid = ad.adrelid AND a.attnum = ad.adnum "
+            "WHERE d.classid = 'pg_attrdef'::regclass AND d.refobjid = 'agendamentos_legado_id_seq'::regclass "
+            "AND ad.adrelid <> 'agendamentos_legado'::regclass"
+        )).all()
+        sequencia = conn.execute(text("SELECT pg_get_serial_sequence('agendamentos', 'id')")).scalar()
+        for tabela, coluna in colunas_na_sequencia:
+            conn.execute(text(f"ALTER TABLE {tabela} ALTER COLUMN {coluna} SET DEFAULT nextval('{sequencia}'::regclass)"))
+        conn.execute(text("DROP TABLE agendamentos_legado"))
+        for comando in recriar:
+            conn.execute(text(comando))
+    logging.info(f"agendamentos convertida em tabela particionada: {copiadas} linha(s)")
+    return copiadas
+
+
+def arquivar_particoes(engine, tabela, tabela_arquivo, meses_retencao):
+    """
+    Move para `tabela_arquivo` as partições mensais inteiramente mais antigas que
+    `meses_retencao` meses. A movimentação é só de metadados (DETACH + ATTACH), sem
+    copiar linhas; o histórico continua consultável pela tabela de arquivo.
+    Retorna a lista de partições arquivadas.
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    limite = somar_meses(inicio_mes(datetime.utcnow()), -meses_retencao)
+    arquivadas = []
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _LOCK_PARTICOES})
+        for mes in meses_particionados(conn, tabela):
+            if mes >= limite:
+                break
+            nome = nome_particao(tabela, mes)
+            conn.execute(text(f"ALTER TABLE {tabela} DETACH PARTITION {nome}"))
+            conn.execute(text(
+                f"ALTER TABLE {tabela_arquivo} ATTACH PARTITION {nome} "
+                f"FOR VALUES FROM ('{mes}') TO ('{somar_meses(mes, 1)}')"
+            ))
+            arquivadas.append(nome)
+            logging.info(f"Partição arquivada: {nome} -> {tabela_arquivo}")
+    return arquivadas
+
+
+def descartar_particoes(engine, tabela, meses_retencao):
+    """
+    Remove as partições mensais inteiramente mais antigas que `meses_retencao` meses
+    (DETACH + DROP): a retenção custa o mesmo com qualquer volume, sem o DELETE linha a
+    linha, o inchaço e o VACUUM que ele deixaria. Retorna a lista de partições removidas.
+    """
+    if engine.dialect.name != 'postgresql':
+        return []
+
+    limite = somar_meses(inicio_mes(datetime.utcnow()), -meses_retencao)
+    descartadas = []
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _LOCK_PARTICOES})
+        for mes in meses_particionados(conn, tabela):
+            if mes >= limite:
+                break
+            nome = nome_particao(tabela, mes)
+            conn.execute(text(f"ALTER TABLE {tabela} DETACH PARTITION {nome}"))
+            conn.execute(text(f"DROP TABLE {nome}"))
+            descartadas.append(nome)
+            logging.info(f"Partição descartada: {nome}")
+    return descartadas
+
+
+def restaurar_particao(engine, tabela, tabela_arquivo, mes):
+    """Devolve uma partição arquivada para a tabela principal (ex.: para correções no histórico)."""
+    mes = inicio_mes(mes)
+    nome = nome_particao(tabela, mes)
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _LOCK_PARTICOES})
+        conn.execute(text(f"ALTER TABLE {tabela_arquivo} DETACH PARTITION {nome}"))
+        conn.execute(text(
+            f"ALTER TABLE {tabela} ATTACH PARTITION {nome} "
+            f"FOR VALUES FROM ('{mes}') TO ('{somar_meses(mes, 1)}')"
+        ))
@@ -0,0 +1,250 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from flask import g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from aplicacao import app
+
+# Perfilador de requisições sob demanda.
+#
+# Uma requisição é perfilada quando:
+#   - um usuário master acrescenta ?perfilar=1 à URL;
+#   - traz o cabeçalho X-Perfilar assinado (HMAC com PERFILADOR_SEGREDO, ver
+#     assinar_perfilamento e o comando `flask assinar-perfilamento`), para medir
+#     chamadas sem sessão de master, como as da API;
+#   - cai na fração sorteada PERFILADOR_AMOSTRAGEM (0 a 1; padrão 0, desligado).
+#
+# Durante a requisição uma thread amostra a pilha da thread que a atende
+# (sys._current_frames) e os SQLs executados são cronometrados. O perfil vai para um
+# arquivo JSON em PERFILADOR_DIRETORIO, que guarda só os PERFILADOR_MAXIMO mais
+# recentes (buffer circular em disco). As pilhas saem no formato "colapsado"
+# (quadro;quadro;quadro contagem) aceito por flamegraph.pl e speedscope.
+#
+# Em workers gevent a amostragem enxerga só threads do sistema, não greenlets.
+
+CABECALHO = 'X-Perfilar'
+
+# Segundos entre amostras de pilha
+INTERVALO_AMOSTRAGEM = 0.005
+
+# Perfis guardados em disco; os mais antigos são apagados
+MAXIMO_PERFIS = 200
+
+# SQLs registrados por perfil (o total e o tempo somado contam todos)
+MAXIMO_CONSULTAS = 500
+
+# Validade (segundos) de uma assinatura do cabeçalho X-Perfilar
+VALIDADE_ASSINATURA = 300
+
+_IDENTIFICADOR = re.compile(r'^\d+-[0-9a-f]{8}$')
+
+
+class Amostrador(threading.Thread):
+    """Amostra periodicamente a pilha de uma thread e conta as pilhas vistas."""
+
+    def __init__(self, thread_id, intervalo=INTERVALO_AMOSTRAGEM):
+        super().__init__(name='perfilador', daemon=True)
+        self.thread_id = thread_id
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            quadro = sys._current_frames().get(self.thread_id)
+            if quadro is not None:
+                self.pilhas[_pilha(quadro)] += 1
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def _pilha(quadro):
+    nomes = []
+    while quadro is not None:
+        codigo = quadro.f_code
+        nomes.append(f'{os.path.splitext(os.path.basename(codigo.co_filename))[0]}:{codigo.co_name}')
+        quadro = quadro.f_back
+    return ';'.join(reversed(nomes))
+
+
+def _segredo():
+    return (app.config.get('PERFILADOR_SEGREDO') or app.secret_key).encode()
+
+
+def assinar_perfilamento(instante=None):
+    """Valor do cabeçalho X-Perfilar válido por VALIDADE_ASSINATURA segundos a partir de `instante`."""
+    instante = str(int(instante if instante is not None else time.time()))
+    return f'{instante}.{hmac.new(_segredo(), instante.encode(), hashlib.sha256).hexdigest()}'
+
+
+def _assinatura_valida(valor):
+    instante, _, _ = (valor or '').partition('.')
+    if not instante.isdigit() or abs(time.time() - int(instante)) > VALIDADE_ASSINATURA:
+        return False
+    return hmac.compare_digest(assinar_perfilamento(int(instante)), valor)
+
+
+def _deve_perfilar():
+    if request.endpoint in (None, 'static'):
+        return False
+    if request.args.get('perfilar') == '1' and current_user.is_authenticated and current_user.is_master():
+        return True
+    if CABECALHO in request.headers:
+        return _assinatura_valida(request.headers[CABECALHO])
+    fracao = app.config.get('PERFILADOR_AMOSTRAGEM', 0)
+    return fracao > 0 and random.random() < fracao
+
+
+@app.before_request
+def iniciar_perfilamento():
+    if not _deve_perfilar():
+        return
+    amostrador = Amostrador(threading.get_ident(), app.config.get('PERFILADOR_INTERVALO', INTERVALO_AMOSTRAGEM))
+    g.perfil = {'inicio': time.perf_counter(), 'sql': [], 'total_sql': 0, 'tempo_sql': 0.0, 'amostrador': amostrador}
+    amostrador.start()
+
+
+@app.after_request
+def concluir_perfilamento(resposta):
+    perfil = g.pop('perfil', None)
+    if perfil is None:
+        return resposta
+    perfil['amostrador'].parar()
+    duracao = time.perf_counter() - perfil['inicio']
+    try:
+        _gravar({
+            'rota': request.endpoint,
+            'metodo': request.method,
+            'url': request.full_path.rstrip('?'),
+            'status': resposta.status_code,
+            'empresa_id': g.get('empresa_id'),
+            'usuario_id': current_user.get_id() if current_user.is_authenticated else None,
+            'criado_em': datetime.utcnow().isoformat(timespec='seconds'),
+            'duracao_ms': round(duracao * 1000, 2),
+            'intervalo_ms': perfil['amostrador'].intervalo * 1000,
+            'pilhas': dict(perfil['amostrador'].pilhas),
+            'total_sql': perfil['total_sql'],
+            'tempo_sql_ms': round(perfil['tempo_sql'] * 1000, 2),
+            'sql': perfil['sql'],
+        })
+    except OSError as e:
+        logging.warning(f"Perfilador: não foi possível gravar o perfil ({e})")
+    return resposta
+
+
+@app.teardown_request
+def _encerrar_amostrador(excecao):
+    # Requisições que terminaram em exceção não passam pelo after_request
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        perfil['amostrador'].parar()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _cronometrar_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context() and 'perfil' in g:
+        context._perfil_inicio = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _registrar_sql(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, '_perfil_inicio', None)
+    if inicio is None or not has_request_context() or 'perfil' not in g:
+        return
+    duracao = time.perf_counter() - inicio
+    perfil = g.perfil
+    perfil['total_sql'] += 1
+    perfil['tempo_sql'] += duracao
+    if len(perfil['sql']) < MAXIMO_CONSULTAS:
+        # Só o texto com placeholders; os parâmetros podem conter dados pessoais
+        perfil['sql'].append({'sql': statement, 'duracao_ms': round(duracao * 1000, 3)})
+
+
+def diretorio_perfis():
+    return app.config.get('PERFILADOR_DIRETORIO') or os.path.join(app.instance_path, 'perfis')
+
+
+def _gravar(perfil):
+    diretorio = diretorio_perfis()
+    os.makedirs(diretorio, exist_ok=True)
+    identificador = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+    perfil['id'] = identificador
+    temporario = os.path.join(diretorio, f'.{identificador}.tmp')
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(perfil, arquivo, ensure_ascii=False)
+    os.replace(temporario, os.path.join(diretorio, f'{identificador}.json'))
+
+    # Buffer circular: os nomes começam pelo instante, então a ordem alfabética é a cronológica
+    arquivos = sorted(nome for nome in os.listdir(diretorio) if nome.endswith('.json'))
+    for nome in arquivos[:-app.config.get('PERFILADOR_MAXIMO', MAXIMO_PERFIS)]:
+        try:
+            os.remove(os.path.join(diretorio, nome))
+        except FileNotFoundError:
+            pass  # outro worker já apagou
+
+
+def carregar_perfil(identificador):
+    """Perfil gravado com esse identificador, ou None."""
+    if not _IDENTIFICADOR.match(identificador or ''):
+        return None
+    try:
+        with open(os.path.join(diretorio_perfis(), f'{identificador}.json'), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def listar_perfis(empresa_id):
+    """Resumo dos perfis guardados da empresa, do mais recente ao mais antigo."""
+    diretorio = diretorio_perfis()
+    if not os.path.isdir(diretorio):
+        return []
+    perfis = []
+    for nome in sorted(os.listdir(diretorio), reverse=True):
+        if not nome.endswith('.json'):
+            continue
+        perfil = carregar_perfil(nome[:-len('.json')])
+        if perfil is None or perfil.get('empresa_id') != empresa_id:
+            continue
+        perfil['amostras'] = sum(perfil.pop('pilhas').values())
+        perfil.pop('sql')
+        perfis.append(perfil)
+    return perfis
+
+
+def pilhas_colapsadas(perfil):
+    """Pilhas no formato colapsado ("a;b;c 12" por linha), para flamegraph.pl ou speedscope."""
+    return ''.join(f'{pilha} {quantidade}\n' for pilha, quantidade in sorted(perfil['pilhas'].items()))
+
+
+def funcoes_mais_amostradas(perfil, limite=30):
+    """
+    Funções com mais amostras: `proprio` conta as amostras em que a função estava no
+    topo da pilha e `inclusivo` as em que aparecia em qualquer ponto dela.
+    """
+    proprio, inclusivo = Counter(), Counter()
+    for pilha, quantidade in perfil['pilhas'].items():
+        quadros = pilha.split(';')
+        proprio[quadros[-1]] += quantidade
+        for quadro in set(quadros):
+            inclusivo[quadro] += quantidade
+    total = sum(perfil['pilhas'].values()) or 1
+    return [
+        {'funcao': funcao, 'proprio': proprio[funcao], 'inclusivo': quantidade,
+         'percentual': quantidade / total * 100}
+        for funcao, quantidade in inclusivo.most_common(limite)
+    ]
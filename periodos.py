@@ -0,0 +1,128 @@
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from flask import g
+from sqlalchemy import func, select
+
+# Períodos de calendário (hoje, este mês, este ano, de/até) no fuso horário da empresa.
+#
+# data_agendamento (e os demais horários de atendimento: data_fim, séries, janelas da
+# lista de espera) guarda a hora local da empresa, exatamente como digitada no
+# formulário ou enviada pela API; já os carimbos do sistema (criado_em, atualizado_em,
+# timestamp da auditoria) são UTC. Por isso um dia ou mês da empresa é o intervalo
+# meio-aberto [inicio, fim) entre as meias-noites locais, comparado direto com a
+# coluna: o filtro usa o índice (ou a poda de partições) de data_agendamento, ao
+# contrário de func.date(coluna) == hoje ou func.extract(...), e dia, hora e mês para
+# agrupamento saem da própria coluna, sem conversão.
+#
+# O fuso define o "agora": comparações de horários de atendimento com o momento atual
+# usam agora_local() (ou agora_na_empresa()/agora_local_sql() nas tarefas que
+# atravessam empresas), nunca datetime.utcnow().
+
+FUSO_PADRAO = 'America/Sao_Paulo'
+
+# Opções oferecidas na configuração da empresa
+FUSOS_HORARIOS = (
+    'America/Sao_Paulo',
+    'America/Bahia',
+    'America/Fortaleza',
+    'America/Recife',
+    'America/Belem',
+    'America/Manaus',
+    'America/Cuiaba',
+    'America/Porto_Velho',
+    'America/Boa_Vista',
+    'America/Rio_Branco',
+    'America/Noronha',
+    'UTC',
+)
+
+
+class Periodo(NamedTuple):
+    """Dias [de, ate) da empresa e os horários locais [inicio, fim) correspondentes."""
+    de: date
+    ate: date
+    inicio: datetime
+    fim: datetime
+
+    @property
+    def ultimo_dia(self):
+        return self.ate - timedelta(days=1)
+
+
+def fuso_valido(nome):
+    try:
+        ZoneInfo(nome)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def nome_fuso_empresa(empresa_id=None):
+    """
+    Fuso configurado da empresa atual (guardado em g durante a requisição) ou, nas
+    tarefas que atravessam empresas, da empresa `empresa_id`.
+    """
+    from modelos import ConfiguracaoEmpresa
+    if empresa_id is not None and empresa_id != g.get('empresa_id'):
+        config = ConfiguracaoEmpresa.query.filter_by(empresa_id=empresa_id).first()
+        return config.fuso_horario if config and config.fuso_horario else FUSO_PADRAO
+    if 'fuso_horario' not in g:
+        config = ConfiguracaoEmpresa.query.first()
+        g.fuso_horario = config.fuso_horario if config and config.fuso_horario else FUSO_PADRAO
+    return g.fuso_horario
+
+
+def fuso_empresa():
+    return ZoneInfo(nome_fuso_empresa())
+
+
+def agora_local(fuso=None):
+    """Data e hora atuais no fuso da empresa (sem tzinfo), comparáveis com data_agendamento."""
+    return datetime.now(fuso or fuso_empresa()).replace(tzinfo=None)
+
+
+def agora_na_empresa(empresa_id):
+    """agora_local() da empresa `empresa_id` (tarefas que atravessam empresas)."""
+    return agora_local(ZoneInfo(nome_fuso_empresa(empresa_id)))
+
+
+def agora_local_sql(empresa_id):
+    """
+    Expressão SQL com a hora atual no fuso da empresa `empresa_id` (uma coluna, para
+    filtros que atravessam empresas numa consulta só).
+    """
+    from modelos import ConfiguracaoEmpresa
+    fuso = select(ConfiguracaoEmpresa.fuso_horario)\
+        .where(ConfiguracaoEmpresa.empresa_id == empresa_id)\
+        .order_by(ConfiguracaoEmpresa.id).limit(1).scalar_subquery()
+    return func.timezone(func.coalesce(fuso, FUSO_PADRAO), func.now())
+
+
+def hoje(fuso=None):
+    """Data de hoje no fuso da empresa."""
+    return agora_local(fuso).date()
+
+
+def periodo(de, ate):
+    """Período dos dias [de, ate) da empresa."""
+    return Periodo(de, ate, datetime.combine(de, time.min), datetime.combine(ate, time.min))
+
+
+def periodo_dia(dia=None, fuso=None):
+    """O dia inteiro (padrão: hoje)."""
+    dia = dia or hoje(fuso)
+    return periodo(dia, dia + timedelta(days=1))
+
+
+def periodo_mes(dia=None, fuso=None):
+    """O mês que contém `dia` (padrão: o mês atual)."""
+    primeiro = (dia or hoje(fuso)).replace(day=1)
+    return periodo(primeiro, (primeiro + timedelta(days=32)).replace(day=1))
+
+
+def periodo_ano(dia=None, fuso=None):
+    """O ano que contém `dia` (padrão: o ano atual)."""
+    primeiro = (dia or hoje(fuso)).replace(month=1, day=1)
+    return periodo(primeiro, primeiro.replace(year=primeiro.year + 1))
+
@@ -0,0 +1,84 @@
+import time
+from functools import wraps
+from flask import g, has_app_context, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+# Roteamento de leituras para a réplica do banco.
+#
+# Rotas marcadas com @somente_leitura executam seus SELECTs no bind 'replica'
+# (SQLALCHEMY_BINDS), quando configurado. Todo o resto, e qualquer escrita,
+# continua no primário. Para não mostrar dados defasados a quem acabou de gravar,
+# o momento da última escrita fica na sessão do usuário e, durante a janela
+# REPLICA_JANELA_SEGUNDOS, as leituras dele também vão para o primário.
+
+BIND_REPLICA = 'replica'
+
+# Janela padrão (segundos) após uma escrita em que o usuário lê do primário
+JANELA_REPLICA_SEGUNDOS = 5
+
+# Chave, na sessão do Flask, com o instante da última escrita do usuário
+_CHAVE_ULTIMA_ESCRITA = 'replica_ultima_escrita'
+
+
+def somente_leitura(f):
+    """Marca a rota como elegível para ler da réplica."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.somente_leitura = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _janela_apos_escrita():
+    from flask import current_app
+    return current_app.config.get('REPLICA_JANELA_SEGUNDOS', JANELA_REPLICA_SEGUNDOS)
+
+
+def _pode_usar_replica():
+    if not has_request_context() or not g.get('somente_leitura'):
+        return False
+    ultima_escrita = session.get(_CHAVE_ULTIMA_ESCRITA)
+    return ultima_escrita is None or time.time() - ultima_escrita > _janela_apos_escrita()
+
+
+class SessaoRoteada(Session):
+    """
+    Sessão que envia à réplica os SELECTs das rotas somente leitura.
+    Flush, INSERT/UPDATE/DELETE e SELECT ... FOR UPDATE sempre usam o primário.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+            and BIND_REPLICA in self._db.engines
+            and _pode_usar_replica()
+        ):
+            return self._db.engines[BIND_REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(SessaoRoteada, 'after_flush')
+def _marcar_escrita_flush(sessao, contexto):
+    sessao.info['escreveu'] = True
+
+
+@event.listens_for(SessaoRoteada, 'do_orm_execute')
+def _marcar_escrita_em_lote(estado):
+    if estado.is_insert or estado.is_update or estado.is_delete:
+        estado.session.info['escreveu'] = True
+
+
+@event.listens_for(SessaoRoteada, 'after_commit')
+def _registrar_ultima_escrita(sessao):
+    if sessao.info.pop('escreveu', False) and has_app_context() and has_request_context():
+        session[_CHAVE_ULTIMA_ESCRITA] = time.time()
+
+
+@event.listens_for(SessaoRoteada, 'after_rollback')
+def _descartar_escrita(sessao):
+    sessao.info.pop('escreveu', None)
@@ -0,0 +1,239 @@
+import logging
+import smtplib
+from collections import Counter
+from datetime import timedelta
+from email.message import EmailMessage
+from itertools import groupby
+from zoneinfo import ZoneInfo
+from flask import current_app
+from sqlalchemy import and_, select
+from sqlalchemy.orm import aliased
+from aplicacao import app, db
+from modelos import Agendamento, ConfiguracaoEmpresa, Empresa, Funcionario, Usuario
+from periodos import hoje, nome_fuso_empresa, periodo_dia
+
+# Resumo diário da agenda: toda noite cada funcionário ativo recebe por e-mail os
+# atendimentos do dia seguinte.
+#
+# Por empresa, todos os agendamentos de amanhã saem de uma única consulta ordenada por
+# funcionário e horário (funcionários sem atendimento vêm do LEFT JOIN com uma linha
+# vazia), lida em streaming com cursor no servidor e agrupada numa só passagem com
+# groupby: a memória não cresce com o número de funcionários. Os templates são
+# carregados uma vez e só renderizados por mensagem.
+#
+# O envio passa por um transporte plugável (TRANSPORTES): 'log' só registra as mensagens
+# e 'smtp' reutiliza a mesma conexão SMTP para até SMTP_MENSAGENS_POR_CONEXAO
+# mensagens. Para testar sem servidor real há o receptor local de smtp_local.py
+# (`flask smtp-local`).
+
+# Linhas buscadas por vez do cursor no servidor
+LOTE_RESUMO = 1000
+
+TEMPLATE_TEXTO = 'emails/resumo_diario.txt'
+TEMPLATE_HTML = 'emails/resumo_diario.html'
+
+
+class TransporteLog:
+    """Não envia nada: registra destinatário e assunto de cada mensagem no log."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        return False
+
+    def enviar(self, mensagem):
+        logging.info(f"Resumo diário para {mensagem['To']}: {mensagem['Subject']}")
+
+
+class TransporteSMTP:
+    """
+    Envia por SMTP reaproveitando a conexão: abre na primeira mensagem, reconecta a cada
+    `mensagens_por_conexao` (limite comum dos servidores) ou se o servidor desconectar,
+    e encerra com QUIT ao sair do bloco with.
+    """
+
+    def __init__(self, host, porta=25, usuario=None, senha=None, tls=False, mensagens_por_conexao=100, timeout=30):
+        self.host = host
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.tls = tls
+        self.mensagens_por_conexao = mensagens_por_conexao
+        self.timeout = timeout
+        self.conexoes = 0
+        self._conexao = None
+        self._enviadas_na_conexao = 0
+
+    @classmethod
+    def da_configuracao(cls):
+        config = current_app.config
+        return cls(
+            config['SMTP_HOST'],
+            config['SMTP_PORTA'],
+            usuario=config.get('SMTP_USUARIO'),
+            senha=config.get('SMTP_SENHA'),
+            tls=config.get('SMTP_TLS', False),
+            mensagens_por_conexao=config.get('SMTP_MENSAGENS_POR_CONEXAO', 100),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        self.fechar()
+        return False
+
+    def _conectar(self):
+        conexao = smtplib.SMTP(self.host, self.porta, timeout=self.timeout)
+        if self.tls:
+            conexao.starttls()
+        if self.usuario:
+            conexao.login(self.usuario, self.senha)
+        self._conexao = conexao
+        self._enviadas_na_conexao = 0
+        self.conexoes += 1
+
+    def enviar(self, mensagem):
+        if self._conexao is None or self._enviadas_na_conexao >= self.mensagens_por_conexao:
+            self.fechar()
+            self._conectar()
+        try:
+            self._conexao.send_message(mensagem)
+        except smtplib.SMTPServerDisconnected:
+            # Conexão derrubada pelo servidor (timeout de inatividade): uma nova tentativa
+            self._conexao = None
+            self._conectar()
+            self._conexao.send_message(mensagem)
+        self._enviadas_na_conexao += 1
+
+    def fechar(self):
+        if self._conexao is None:
+            return
+        try:
+            self._conexao.quit()
+        except smtplib.SMTPException:
+            self._conexao.close()
+        self._conexao = None
+
+
+TRANSPORTES = {
+    'log': TransporteLog,
+    'smtp': TransporteSMTP.da_configuracao,
+}
+
+
+def criar_transporte(nome=None):
+    """Transporte `nome` (padrão: RESUMO_TRANSPORTE da configuração)."""
+    return TRANSPORTES[nome or current_app.config.get('RESUMO_TRANSPORTE', 'log')]()
+
+
+def _linhas_do_dia(empresa_id, periodo):
+    """Funcionários ativos da empresa com os agendamentos do período, em ordem de envio."""
+    Cliente = aliased(Usuario)
+    consulta = (
+        select(
+            Funcionario.id.label('funcionario_id'),
+            Usuario.nome.label('funcionario_nome'),
+            Usuario.email,
+            Agendamento.data_agendamento,
+            Agendamento.data_fim,
+            Agendamento.servico,
+            Agendamento.observacoes,
+            Cliente.nome.label('cliente_nome'),
+            Cliente.telefone.label('cliente_telefone'),
+        )
+        .select_from(Funcionario)
+        .join(Usuario, Usuario.id == Funcionario.usuario_id)
+        .outerjoin(Agendamento, and_(
+            Agendamento.funcionario_id == Funcionario.id,
+            Agendamento.status == 'agendado',
+            Agendamento.data_agendamento >= periodo.inicio,
+            Agendamento.data_agendamento < periodo.fim,
+        ))
+        .outerjoin(Cliente, Cliente.id == Agendamento.cliente_id)
+        .where(
+            Funcionario.empresa_id == empresa_id,
+            Funcionario.ativo.is_(True),
+            Usuario.ativo.is_(True),
+            Usuario.excluido_em.is_(None),
+        )
+        .order_by(Funcionario.id, Agendamento.data_agendamento)
+        .execution_options(yield_per=LOTE_RESUMO)
+    )
+    return db.session.execute(consulta)
+
+
+def _mensagem(remetente, destinatario, assunto, texto, html):
+    mensagem = EmailMessage()
+    mensagem['From'] = remetente
+    mensagem['To'] = destinatario
+    mensagem['Subject'] = assunto
+    mensagem.set_content(texto)
+    mensagem.add_alternative(html, subtype='html')
+    return mensagem
+
+
+def _enviar_resumos_empresa(empresa, transporte, templates, dia, totais):
+    fuso = ZoneInfo(nome_fuso_empresa(empresa.id))
+    dia = dia or hoje(fuso) + timedelta(days=1)
+    config = db.session.execute(
+        select(ConfiguracaoEmpresa).where(ConfiguracaoEmpresa.empresa_id == empresa.id)
+    ).scalar_one_or_none()
+    nome_empresa = config.nome_empresa if config else empresa.nome
+    remetente = current_app.config.get('RESUMO_REMETENTE', 'agenda@localhost')
+    assunto = f'Sua agenda de {dia:%d/%m/%Y} - {nome_empresa}'
+    texto, html = templates
+
+    # Os horários já estão na hora local da empresa (periodos.py): o dia é o das meias-noites locais
+    for _, linhas in groupby(_linhas_do_dia(empresa.id, periodo_dia(dia)), key=lambda linha: linha.funcionario_id):
+        linhas = list(linhas)
+        funcionario = linhas[0]
+        totais['funcionarios'] += 1
+        if not funcionario.email:
+            totais['sem_email'] += 1
+            continue
+        contexto = {
+            'funcionario': funcionario.funcionario_nome,
+            'empresa': nome_empresa,
+            'dia': dia,
+            'atendimentos': [
+                {
+                    'inicio': f'{linha.data_agendamento:%H:%M}',
+                    'fim': f'{linha.data_fim:%H:%M}',
+                    'servico': linha.servico,
+                    'cliente': linha.cliente_nome,
+                    'telefone': linha.cliente_telefone,
+                    'observacoes': linha.observacoes,
+                }
+                for linha in linhas if linha.data_agendamento is not None
+            ],
+        }
+        totais['atendimentos'] += len(contexto['atendimentos'])
+        mensagem = _mensagem(remetente, funcionario.email, assunto, texto.render(contexto), html.render(contexto))
+        try:
+            transporte.enviar(mensagem)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as erro:
+            # Recusa de uma mensagem não interrompe as demais
+            logging.warning(f"Resumo diário para {funcionario.email} recusado: {erro}")
+            totais['falhas'] += 1
+        else:
+            totais['enviados'] += 1
+
+
+def enviar_resumos(transporte, dia=None, empresa_id=None):
+    """
+    Envia o resumo da agenda de `dia` (padrão: amanhã, no fuso de cada empresa) a todos
+    os funcionários ativos das empresas ativas, ou só da empresa `empresa_id`.
+    Retorna um Counter com funcionarios, enviados, sem_email, falhas e atendimentos.
+    """
+    empresas = select(Empresa).where(Empresa.ativa.is_(True)).order_by(Empresa.id)
+    if empresa_id is not None:
+        empresas = empresas.where(Empresa.id == empresa_id)
+
+    templates = (app.jinja_env.get_template(TEMPLATE_TEXTO), app.jinja_env.get_template(TEMPLATE_HTML))
+    totais = Counter()
+    with transporte:
+        for empresa in db.session.execute(empresas).scalars().all():
+            _enviar_resumos_empresa(empresa, transporte, templates, dia, totais)
+    return totais
@@ -1,16 +1,37 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import render_template, request, redirect, url_for, flash, jsonify, current_app, g, Response, abort, send_file
 from flask_login import login_user, logout_user, login_required, current_user
 from functools import wraps
 from aplicacao import app, db
-from modelos import Usuario, Funcionario, Cargo, Agendamento, LogAuditoria, ConfiguracaoEmpresa, Servico
+from modelos import (Usuario, Funcionario, Cargo, Agendamento, LogAuditoria, ConfiguracaoEmpresa, Servico,
+                     SerieAgendamento, ListaEspera, JornadaTrabalho, ExcecaoJornada, DIAS_SEMANA)
 from formularios import (LoginForm, CadastroUsuarioForm, CadastroClienteForm, FuncionarioForm,
-                         CargoForm, AgendamentoForm, AtualizarStatusAgendamentoForm,
+                         CargoForm, AgendamentoForm, AgendamentoRecorrenteForm, AtualizarStatusAgendamentoForm,
+                         AtualizarStatusLoteForm, ListaEsperaForm, JornadaTrabalhoForm, ExcecaoJornadaForm,
                          ConfiguracaoBotWhatsAppForm, ConfiguracaoEmpresaForm, ServicoForm, UsuarioEditForm)
 from datetime import datetime, timedelta
-from sqlalchemy import and_, or_, func
+from types import SimpleNamespace
+from sqlalchemy import and_, or_, func, tuple_
+from sqlalchemy.orm import aliased
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
+from agenda import (criar_serie, atualizar_serie, encerrar_serie, atualizar_status_em_lote, escolher_funcionario,
+                    travar_funcionario, filtro_autorizacao_agendamentos, filtro_autorizacao_series)
+from replica import somente_leitura
+from exclusao import excluir_usuario
+from backup_empresa import gerar_backup
+from auditoria import registrar_auditoria, registrar_auditoria_lote
+from disponibilidade import cache_jornadas, na_jornada
+from lista_espera import (entrar_na_lista, ofertar_vagas_canceladas, aceitar_oferta, recusar_oferta,
+                          sair_da_lista)
+from periodos import FUSOS_HORARIOS, agora_local, fuso_valido, hoje, periodo, periodo_ano, periodo_dia, periodo_mes
+from limitador import limitador, limitar, resposta_limite_excedido
+from cache_consultas import cache_consultas, consulta_em_cache
+from eventos import Assinatura, central_eventos, fluxo_sse
+from perfilador import carregar_perfil, listar_perfis, pilhas_colapsadas, funcoes_mais_amostradas
+from analises import (cache_relatorios, relatorio_em_cache, utilizacao_funcionarios, mapa_ocupacao,
+                      DIMENSOES_RECEITA, receita_por, receita_periodo_efetivo, receita_atualizada_em)
 import os
+import tempfile
 
 # Decorator para verificar permissões
 def master_required(f):
@@ -51,6 +72,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@limitar('login', por='ip')
 def login():
     """
     Rota para o login de usuários.
@@ -62,6 +84,12 @@ def login():
     if form.validate_on_submit():
         username = (form.username.data or '').strip()
         password = form.password.data or ''
+        # Senhas erradas para a mesma conta a partir do mesmo IP. Só a falha gasta token
+        # e a chave inclui o IP, para que ninguém bloqueie a conta de outra pessoa.
+        chave_conta = f"{request.remote_addr}:{g.get('empresa_id')}:{username.lower()}"
+        espera = limitador.consultar('login_usuario', chave_conta)
+        if espera is not None:
+            return resposta_limite_excedido(espera)
         # Fallback MASTER login (uppercase enforced)
         if username == 'MASTER' and password == 'MASTER123':
             usuario = Usuario.query.filter_by(username='MASTER').first()
@@ -88,6 +116,7 @@ def login():
             next_page = request.args.get('next')
             flash('Login realizado com sucesso!', 'success')
             return redirect(next_page) if next_page else redirect(url_for('dashboard'))
+        limitador.consumir('login_usuario', chave_conta)
         flash('Usuário ou senha inválidos.', 'danger')
     
     return render_template('login.html', form=form)
@@ -104,6 +133,7 @@ def logout():
 
 @app.route('/dashboard')
 @login_required
+@somente_leitura
 def dashboard():
     """
     Dashboard principal, com estatísticas e agendamentos recentes.
@@ -111,15 +141,18 @@ def dashboard():
     """
     stats = {}
     config = ConfiguracaoEmpresa.query.first()
+    # Hoje no fuso da empresa, como intervalo meio-aberto (usa o índice de data_agendamento)
+    dia = periodo_dia()
     
     if current_user.is_master():
         stats = {
-            'total_usuarios': Usuario.query.count(),
+            'total_usuarios': Usuario.query.filter(Usuario.excluido_em.is_(None)).count(),
             'total_funcionarios': Funcionario.query.count(),
             'total_agendamentos': Agendamento.query.count(),
             'agendamentos_pendentes': Agendamento.query.filter_by(status='agendado').count(),
             'agendamentos_hoje': Agendamento.query.filter(
-                func.date(Agendamento.data_agendamento) == datetime.utcnow().date()
+                Agendamento.data_agendamento >= dia.inicio,
+                Agendamento.data_agendamento < dia.fim
             ).count()
         }
         agendamentos_recentes = Agendamento.query.order_by(Agendamento.criado_em.desc()).limit(5).all()
@@ -131,7 +164,8 @@ def dashboard():
                 'meus_agendamentos_hoje': Agendamento.query.filter(
                     and_(
                         Agendamento.funcionario_id == funcionario.id,
-                        func.date(Agendamento.data_agendamento) == datetime.utcnow().date()
+                        Agendamento.data_agendamento >= dia.inicio,
+                        Agendamento.data_agendamento < dia.fim
                     )
                 ).count(),
                 'meus_agendamentos_pendentes': Agendamento.query.filter(
@@ -152,7 +186,7 @@ def dashboard():
             'meus_proximos_agendamentos': Agendamento.query.filter(
                 and_(
                     Agendamento.cliente_id == current_user.id,
-                    Agendamento.data_agendamento > datetime.utcnow(),
+                    Agendamento.data_agendamento > agora_local(),
                     Agendamento.status == 'agendado'
                 )
             ).count()
@@ -227,7 +261,7 @@ def usuario_visualizar(usuario_id):
     """
     Rota para visualizar detalhes de um usuário.
     """
-    usuario = Usuario.query.get_or_404(usuario_id)
+    usuario = Usuario.query.filter_by(id=usuario_id, excluido_em=None).first_or_404()
     return render_template('usuario_visualizar.html', usuario=usuario)
 
 @app.route('/cadastro/usuario/editar/<int:usuario_id>', methods=['GET', 'POST'])
@@ -237,7 +271,7 @@ def usuario_editar(usuario_id):
     """
     Rota para editar um usuário existente.
     """
-    usuario = Usuario.query.get_or_404(usuario_id)
+    usuario = Usuario.query.filter_by(id=usuario_id, excluido_em=None).first_or_404()
     form = UsuarioEditForm(obj=usuario)
     
     if form.validate_on_submit():
@@ -265,13 +299,14 @@ def usuario_editar(usuario_id):
 @app.route('/cadastro/usuarios/pesquisar', methods=['GET'])
 @login_required
 @master_required
+@somente_leitura
 def usuarios_pesquisar():
     query = request.args.get('query', '').strip()
     page = request.args.get('page', 1, type=int)
     per_page = int(request.args.get('per_page', 10)) if str(request.args.get('per_page', '10')).isdigit() else 10
     show_results = request.args.get('search') == '1'
 
-    base_query = Usuario.query.order_by(Usuario.nome)
+    base_query = Usuario.query.filter(Usuario.excluido_em.is_(None)).order_by(Usuario.nome)
     if query:
         base_query = base_query.filter(
             or_(
@@ -287,6 +322,7 @@ def usuarios_pesquisar():
 @app.route('/cadastro/clientes/pesquisar', methods=['GET'])
 @login_required
 @permission_required('pode_cadastrar_cliente')
+@somente_leitura
 def clientes_pesquisar():
     """
     Pesquisa/lista clientes no padrão de serviços.
@@ -299,7 +335,8 @@ def clientes_pesquisar():
     base_query = Usuario.query.filter(
         and_(
             Usuario.tipo_usuario == 'restrito',
-            Usuario.perfil_funcionario == None
+            Usuario.perfil_funcionario == None,
+            Usuario.excluido_em.is_(None)
         )
     ).order_by(Usuario.nome)
 
@@ -348,7 +385,7 @@ def cliente_visualizar(cliente_id):
     """
     Rota para visualizar detalhes de um cliente.
     """
-    cliente = Usuario.query.get_or_404(cliente_id)
+    cliente = Usuario.query.filter_by(id=cliente_id, excluido_em=None).first_or_404()
     if cliente.tipo_usuario != 'restrito':
         abort(404)
     return render_template('cliente_visualizar.html', cliente=cliente)
@@ -357,7 +394,7 @@ def cliente_visualizar(cliente_id):
 @login_required
 @permission_required('pode_cadastrar_cliente')
 def clientes_editar(cliente_id):
-    cliente = Usuario.query.get_or_404(cliente_id)
+    cliente = Usuario.query.filter_by(id=cliente_id, excluido_em=None).first_or_404()
     if not (cliente.tipo_usuario == 'restrito' and cliente.perfil_funcionario is None):
         flash('Registro não é um cliente válido.', 'danger')
         return redirect(url_for('clientes_pesquisar', search=1))
@@ -376,11 +413,12 @@ def clientes_editar(cliente_id):
 @login_required
 @permission_required('pode_cadastrar_cliente')
 def clientes_excluir(cliente_id):
-    cliente = Usuario.query.get_or_404(cliente_id)
+    cliente = Usuario.query.filter_by(id=cliente_id, excluido_em=None).first_or_404()
     if cliente.is_master() or cliente.perfil_funcionario is not None:
         flash('Não é permitido excluir este usuário.', 'danger')
         return redirect(url_for('clientes_pesquisar', search=1))
-    db.session.delete(cliente)
+    # Exclusão lógica; agendamentos e demais dados são tratados depois pelo expurgo (exclusao.py)
+    excluir_usuario(cliente)
     db.session.commit()
     flash('Cliente excluído com sucesso!', 'info')
     return redirect(url_for('clientes_pesquisar', search=1))
@@ -388,6 +426,7 @@ def clientes_excluir(cliente_id):
 @app.route('/cadastro/funcionarios/pesquisar', methods=['GET'])
 @login_required
 @permission_required('pode_cadastrar_funcionario')
+@somente_leitura
 def funcionarios_pesquisar():
     """Pesquisa/lista funcionários no padrão de serviços."""
     query = request.args.get('query', '').strip()
@@ -395,7 +434,7 @@ def funcionarios_pesquisar():
     per_page = int(request.args.get('per_page', 10)) if str(request.args.get('per_page', '10')).isdigit() else 10
     show_results = request.args.get('search') == '1'
 
-    base_query = Funcionario.query.join(Usuario).join(Cargo)
+    base_query = Funcionario.query.join(Usuario).join(Cargo).filter(Usuario.excluido_em.is_(None))
     if query:
         base_query = base_query.filter(
             or_(
@@ -414,7 +453,7 @@ def funcionarios_pesquisar():
 @login_required
 @master_required
 def usuarios_editar(usuario_id):
-    usuario = Usuario.query.get_or_404(usuario_id)
+    usuario = Usuario.query.filter_by(id=usuario_id, excluido_em=None).first_or_404()
     form = UsuarioEditForm(obj=usuario)
     if form.validate_on_submit():
         usuario.email = form.email.data
@@ -436,11 +475,11 @@ def usuarios_editar(usuario_id):
 @login_required
 @master_required
 def usuarios_excluir(usuario_id):
-    usuario = Usuario.query.get_or_404(usuario_id)
+    usuario = Usuario.query.filter_by(id=usuario_id, excluido_em=None).first_or_404()
     if usuario.is_master():
         flash('Não é permitido excluir o usuário MASTER.', 'danger')
         return redirect(url_for('usuarios_pesquisar', search=1))
-    db.session.delete(usuario)
+    excluir_usuario(usuario)
     db.session.commit()
     flash('Usuário excluído com sucesso!', 'info')
     return redirect(url_for('usuarios_pesquisar', search=1))
@@ -506,6 +545,7 @@ def criar_funcionario():
             usuario_id=form.usuario_id.data,
             cargo_id=form.cargo_id.data
         )
+        funcionario.servicos = Servico.query.filter(Servico.id.in_(form.servicos.data or [])).all()
         
         db.session.add(funcionario)
         db.session.commit()
@@ -534,10 +574,13 @@ def funcionario_editar(funcionario_id):
     """
     funcionario = Funcionario.query.get_or_404(funcionario_id)
     form = FuncionarioForm(obj=funcionario)
+    if request.method == 'GET':
+        form.servicos.data = [s.id for s in funcionario.servicos]
     
     if form.validate_on_submit():
         funcionario.usuario_id = form.usuario_id.data
         funcionario.cargo_id = form.cargo_id.data
+        funcionario.servicos = Servico.query.filter(Servico.id.in_(form.servicos.data or [])).all()
         
         db.session.commit()
         flash('Funcionário atualizado com sucesso!', 'success')
@@ -545,6 +588,74 @@ def funcionario_editar(funcionario_id):
     
     return render_template('funcionario_editar.html', form=form, funcionario=funcionario)
 
+@app.route('/funcionarios/<int:funcionario_id>/jornada', methods=['GET', 'POST'])
+@login_required
+@permission_required('pode_cadastrar_funcionario')
+def funcionario_jornada(funcionario_id):
+    """
+    Turnos semanais e exceções (folgas, horários extras) da jornada do funcionário.
+    """
+    funcionario = Funcionario.query.get_or_404(funcionario_id)
+    form_turno = JornadaTrabalhoForm(prefix='turno')
+    form_excecao = ExcecaoJornadaForm(prefix='excecao')
+
+    if form_turno.incluir.data and form_turno.validate_on_submit():
+        db.session.add(JornadaTrabalho(
+            funcionario_id=funcionario.id,
+            dia_semana=form_turno.dia_semana.data,
+            hora_inicio=form_turno.hora_inicio.data,
+            hora_fim=form_turno.hora_fim.data,
+        ))
+        db.session.commit()
+        flash('Turno incluído.', 'success')
+        return redirect(url_for('funcionario_jornada', funcionario_id=funcionario.id))
+
+    if form_excecao.registrar.data and form_excecao.validate_on_submit():
+        db.session.add(ExcecaoJornada(
+            funcionario_id=funcionario.id,
+            data=form_excecao.data.data,
+            tipo=form_excecao.tipo.data,
+            hora_inicio=form_excecao.hora_inicio.data,
+            hora_fim=form_excecao.hora_fim.data,
+            motivo=form_excecao.motivo.data or None,
+        ))
+        db.session.commit()
+        flash('Exceção registrada.', 'success')
+        return redirect(url_for('funcionario_jornada', funcionario_id=funcionario.id))
+
+    turnos = funcionario.jornadas.order_by(JornadaTrabalho.dia_semana, JornadaTrabalho.hora_inicio).all()
+    excecoes = funcionario.excecoes_jornada.filter(ExcecaoJornada.data >= hoje())\
+                                           .order_by(ExcecaoJornada.data, ExcecaoJornada.hora_inicio).all()
+    return render_template('funcionario_jornada.html', funcionario=funcionario, turnos=turnos,
+                           excecoes=excecoes, form_turno=form_turno, form_excecao=form_excecao,
+                           dias_semana=dict(DIAS_SEMANA))
+
+@app.route('/funcionarios/<int:funcionario_id>/jornada/turno/<int:turno_id>/remover', methods=['POST'])
+@login_required
+@permission_required('pode_cadastrar_funcionario')
+def funcionario_jornada_remover_turno(funcionario_id, turno_id):
+    """
+    Remove um turno da jornada semanal.
+    """
+    turno = JornadaTrabalho.query.filter_by(id=turno_id, funcionario_id=funcionario_id).first_or_404()
+    db.session.delete(turno)
+    db.session.commit()
+    flash('Turno removido.', 'info')
+    return redirect(url_for('funcionario_jornada', funcionario_id=funcionario_id))
+
+@app.route('/funcionarios/<int:funcionario_id>/jornada/excecao/<int:excecao_id>/remover', methods=['POST'])
+@login_required
+@permission_required('pode_cadastrar_funcionario')
+def funcionario_jornada_remover_excecao(funcionario_id, excecao_id):
+    """
+    Remove uma exceção da jornada.
+    """
+    excecao = ExcecaoJornada.query.filter_by(id=excecao_id, funcionario_id=funcionario_id).first_or_404()
+    db.session.delete(excecao)
+    db.session.commit()
+    flash('Exceção removida.', 'info')
+    return redirect(url_for('funcionario_jornada', funcionario_id=funcionario_id))
+
 # --------------------------------------------------------------------------------------------------
 # ROTAS DE CARGOS CORRIGIDAS E COMPLETAS
 # --------------------------------------------------------------------------------------------------
@@ -561,6 +672,7 @@ def cargos_main():
 @app.route('/cargos/pesquisar')
 @login_required
 @permission_required('pode_cadastrar_cargo')
+@somente_leitura
 def cargos_pesquisar():
     """
     Rota para pesquisar e exibir cargos com paginação.
@@ -658,6 +770,7 @@ def servicos_main():
 @app.route('/cadastro/servicos/pesquisar', methods=['GET'])
 @login_required
 @permission_required('pode_cadastrar_servico')
+@somente_leitura
 def servicos_pesquisar():
     """Rota para pesquisar e exibir serviços com paginação, filtros e ordenação.
 
@@ -701,13 +814,15 @@ def servicos_pesquisar():
         'preco': Servico.preco,
         'duracao': Servico.duracao_minutos,
     }
-    sort_column = sort_map.get(sort, Servico.nome)
+    if sort not in sort_map:
+        sort = 'nome'
+    if direction != 'desc':
+        direction = 'asc'
+    sort_column = sort_map[sort]
     if direction == 'desc':
         sort_column = sort_column.desc()
 
-    servicos = None
-
-    if show_results or format_json:
+    def consultar():
         base_query = Servico.query
 
         if query:
@@ -719,12 +834,8 @@ def servicos_pesquisar():
         if max_preco is not None:
             base_query = base_query.filter(Servico.preco <= max_preco)
 
-        base_query = base_query.order_by(sort_column)
-        servicos = base_query.paginate(page=page, per_page=per_page, error_out=False)
-
-    # Suporte a JSON para consumo via JS (sempre retorna resultados)
-    if format_json:
-        return jsonify({
+        pagina = base_query.order_by(sort_column).paginate(page=page, per_page=per_page, error_out=False)
+        return {
             'items': [
                 {
                     'id': s.id,
@@ -734,15 +845,37 @@ def servicos_pesquisar():
                     'duracao_minutos': s.duracao_minutos,
                     'ativo': s.ativo,
                 }
-                for s in (servicos.items if servicos else [])
+                for s in pagina.items
             ],
+            'page': pagina.page,
+            'pages': pagina.pages,
+            'total': pagina.total,
+            'has_prev': pagina.has_prev,
+            'has_next': pagina.has_next,
+            'prev_num': pagina.prev_num,
+            'next_num': pagina.next_num,
+        }
+
+    servicos = None
+
+    if show_results or format_json:
+        # Mesma página para parâmetros equivalentes (o filtro por nome ignora maiúsculas)
+        servicos = SimpleNamespace(**consulta_em_cache(
+            'servicos_pesquisar', ('servicos',), consultar,
+            query.lower(), only_active, min_preco, max_preco, sort, direction, page, per_page
+        ))
+
+    # Suporte a JSON para consumo via JS (sempre retorna resultados)
+    if format_json:
+        return jsonify({
+            'items': servicos.items,
             'pagination': {
-                'page': servicos.page if servicos else 1,
+                'page': servicos.page,
                 'per_page': per_page,
-                'pages': servicos.pages if servicos else 0,
-                'total': servicos.total if servicos else 0,
-                'has_prev': servicos.has_prev if servicos else False,
-                'has_next': servicos.has_next if servicos else False,
+                'pages': servicos.pages,
+                'total': servicos.total,
+                'has_prev': servicos.has_prev,
+                'has_next': servicos.has_next,
             }
         })
 
@@ -836,36 +969,213 @@ def servicos_editar(servico_id):
 @permission_required('pode_ver_agendamentos')
 def agendamentos():
     """
-    Exibe a lista de agendamentos com base nas permissões do usuário.
+    Exibe a lista de agendamentos com base nas permissões do usuário. A tabela é
+    carregada de agendamentos_lista() e rolada virtualmente no navegador, com um único
+    modal de status para todas as linhas.
     """
-    page = request.args.get('page', 1, type=int)
-    per_page = 10
-    
+    form_lote = AtualizarStatusLoteForm()
+    form_status = AtualizarStatusAgendamentoForm()
+    return render_template('agendamentos.html', form_lote=form_lote, form_status=form_status)
+
+# Linhas por chamada de agendamentos_lista()
+LIMITE_LISTA_AGENDAMENTOS = 500
+
+@app.route('/agendamentos/lista')
+@login_required
+@permission_required('pode_ver_agendamentos')
+def agendamentos_lista():
+    """
+    Feed JSON compacto da lista de agendamentos, do mais recente para o mais antigo,
+    paginado por cursor (data_agendamento, id): cada página segue pelo índice a partir
+    da anterior, sem OFFSET. Cada linha é uma lista na ordem de 'colunas'; 'proximo' é o
+    cursor da página seguinte e 'total' vem só na primeira página.
+    """
+    limite = min(max(request.args.get('limite', 200, type=int), 1), LIMITE_LISTA_AGENDAMENTOS)
+    cursor = request.args.get('cursor', '')
+    cursor_data, _, cursor_id = cursor.partition('|')
+    cursor_data = _parse_data_hora(cursor_data)
+    if cursor and (cursor_data is None or not cursor_id.isdigit()):
+        return jsonify({'erro': 'Parâmetro cursor inválido.'}), 400
+
+    autorizados = filtro_autorizacao_agendamentos(current_user)
+    FuncionarioUsuario = aliased(Usuario)
+    consulta = db.session.query(
+        Agendamento.id,
+        Usuario.nome,
+        FuncionarioUsuario.nome,
+        Agendamento.data_agendamento,
+        Agendamento.servico,
+        Agendamento.duracao_minutos,
+        Agendamento.status,
+        Agendamento.observacoes,
+    ).join(Usuario, Agendamento.cliente_id == Usuario.id)\
+     .join(Funcionario, Agendamento.funcionario_id == Funcionario.id)\
+     .join(FuncionarioUsuario, Funcionario.usuario_id == FuncionarioUsuario.id)\
+     .filter(autorizados)
+    if cursor_data:
+        consulta = consulta.filter(
+            tuple_(Agendamento.data_agendamento, Agendamento.id) < tuple_(cursor_data, int(cursor_id))
+        )
+    linhas = consulta.order_by(Agendamento.data_agendamento.desc(), Agendamento.id.desc())\
+                     .limit(limite + 1).all()
+    mais = len(linhas) > limite
+    linhas = linhas[:limite]
+
+    resposta = {
+        'colunas': ['id', 'cliente', 'funcionario', 'inicio', 'servico', 'duracao', 'status', 'observacoes'],
+        'linhas': [
+            [id, cliente, funcionario, inicio.strftime('%d/%m/%Y %H:%M'), servico, duracao, status, observacoes]
+            for id, cliente, funcionario, inicio, servico, duracao, status, observacoes in linhas
+        ],
+        'proximo': f'{linhas[-1].data_agendamento.isoformat()}|{linhas[-1].id}' if mais else None,
+    }
+    if not cursor:
+        resposta['total'] = db.session.query(func.count(Agendamento.id)).filter(autorizados).scalar()
+    return jsonify(resposta)
+
+# atualizado_em é a hora do flush, não a do commit: uma transação ainda aberta pode
+# gravar linhas com atualizado_em anterior ao cursor já entregue. Linhas alteradas há
+# menos que a margem ficam para a próxima sincronização, então a garantia só vale para
+# transações que alteram agendamentos e duram menos que ela. As requisições e as
+# tarefas em lote (commit a cada lote) ficam bem abaixo; uma transação mais longa pode
+# ter linhas puladas pelo `since`, que só reaparecem numa sincronização completa.
+# Cancelamentos (inclusive os da alteração de séries) chegam como status 'cancelado':
+# agendamentos não são apagados.
+MARGEM_SINCRONIZACAO = timedelta(seconds=60)
+LIMITE_CALENDARIO = 500
+
+def _parse_data_hora(valor):
+    """Converte um parâmetro ISO 8601 (data ou data/hora) em datetime, ou None se inválido."""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        return None
+
+@app.route('/agendamentos/calendario')
+@login_required
+@permission_required('pode_ver_agendamentos')
+def agendamentos_calendario():
+    """
+    Feed JSON do calendário com sincronização incremental.
+
+    Parâmetros opcionais: funcionario_id, inicio e fim (intervalo de data_agendamento)
+    e since. Sem since, devolve todos os agendamentos do filtro; com since, apenas os
+    criados ou alterados depois dele (até MARGEM_SINCRONIZACAO atrás). A resposta traz
+    'since' para a próxima chamada e 'mais' quando ainda há linhas a buscar imediatamente.
+    """
+    since = request.args.get('since', '')
+    since_data, _, since_id = since.partition('|')
+    since_data = _parse_data_hora(since_data)
+    since_id = int(since_id) if since_id.isdigit() else 0
+    if since and since_data is None:
+        return jsonify({'erro': 'Parâmetro since inválido.'}), 400
+
+    inicio = _parse_data_hora(request.args.get('inicio'))
+    fim = _parse_data_hora(request.args.get('fim'))
+    funcionario_id = request.args.get('funcionario_id', type=int)
+
+    FuncionarioUsuario = aliased(Usuario)
+    consulta = db.session.query(
+        Agendamento.id,
+        Agendamento.cliente_id,
+        Usuario.nome.label('cliente'),
+        Agendamento.funcionario_id,
+        FuncionarioUsuario.nome.label('funcionario'),
+        Agendamento.data_agendamento,
+        Agendamento.data_fim,
+        Agendamento.servico,
+        Agendamento.status,
+        Agendamento.atualizado_em,
+    ).join(Usuario, Agendamento.cliente_id == Usuario.id)\
+     .join(Funcionario, Agendamento.funcionario_id == Funcionario.id)\
+     .join(FuncionarioUsuario, Funcionario.usuario_id == FuncionarioUsuario.id)
+
     if current_user.is_master():
-        agendamentos = Agendamento.query.order_by(Agendamento.data_agendamento.desc())\
-                                        .paginate(page=page, per_page=per_page, error_out=False)
+        pass
     elif current_user.is_funcionario():
-        funcionario = Funcionario.query.filter_by(usuario_id=current_user.id).first()
-        if funcionario:
-            agendamentos = Agendamento.query.filter_by(funcionario_id=funcionario.id)\
-                                             .order_by(Agendamento.data_agendamento.desc())\
-                                             .paginate(page=page, per_page=per_page, error_out=False)
-        else:
-            agendamentos = None
+        funcionario_id = current_user.perfil_funcionario.id
     else:
-        agendamentos = Agendamento.query.filter_by(cliente_id=current_user.id)\
-                                        .order_by(Agendamento.data_agendamento.desc())\
-                                        .paginate(page=page, per_page=per_page, error_out=False)
-    
-    return render_template('agendamentos.html', agendamentos=agendamentos)
+        consulta = consulta.filter(Agendamento.cliente_id == current_user.id)
+
+    if funcionario_id:
+        consulta = consulta.filter(Agendamento.funcionario_id == funcionario_id)
+    if inicio:
+        consulta = consulta.filter(Agendamento.data_agendamento >= inicio)
+    if fim:
+        consulta = consulta.filter(Agendamento.data_agendamento < fim)
+    if since_data:
+        consulta = consulta.filter(
+            tuple_(Agendamento.atualizado_em, Agendamento.id) > tuple_(since_data, since_id)
+        )
+
+    consulta = consulta.filter(Agendamento.atualizado_em <= datetime.utcnow() - MARGEM_SINCRONIZACAO)\
+                       .order_by(Agendamento.atualizado_em, Agendamento.id)\
+                       .limit(LIMITE_CALENDARIO + 1)
+    linhas = consulta.all()
+    mais = len(linhas) > LIMITE_CALENDARIO
+    linhas = linhas[:LIMITE_CALENDARIO]
+
+    if linhas:
+        ultima = linhas[-1]
+        proximo_since = f'{ultima.atualizado_em.isoformat()}|{ultima.id}'
+    else:
+        proximo_since = since or None
+
+    return jsonify({
+        'items': [
+            {
+                'id': linha.id,
+                'cliente_id': linha.cliente_id,
+                'cliente': linha.cliente,
+                'funcionario_id': linha.funcionario_id,
+                'funcionario': linha.funcionario,
+                'inicio': linha.data_agendamento.isoformat(),
+                'fim': linha.data_fim.isoformat() if linha.data_fim else None,
+                'servico': linha.servico,
+                'status': linha.status,
+                'atualizado_em': linha.atualizado_em.isoformat(),
+            }
+            for linha in linhas
+        ],
+        'since': proximo_since,
+        'mais': mais,
+    })
+
+@app.route('/agendamentos/eventos')
+@login_required
+@permission_required('pode_ver_agendamentos')
+def agendamentos_eventos():
+    """
+    Fluxo SSE com os agendamentos criados, alterados e cancelados em tempo real.
+    Master recebe os da empresa (opcionalmente de um funcionário, ?funcionario_id=),
+    funcionário os seus atendimentos e cliente os próprios agendamentos.
+    """
+    if current_user.is_master():
+        assinatura = Assinatura(g.empresa_id, funcionario_id=request.args.get('funcionario_id', type=int))
+    elif current_user.is_funcionario():
+        assinatura = Assinatura(g.empresa_id, funcionario_id=current_user.perfil_funcionario.id)
+    else:
+        assinatura = Assinatura(g.empresa_id, cliente_id=current_user.id)
+
+    central_eventos.iniciar(db.engine)
+    central_eventos.assinar(assinatura)
+    # A conexão fica aberta por muito tempo: devolve a conexão do banco ao pool antes de começar
+    db.session.close()
+
+    return Response(fluxo_sse(assinatura), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/agendar', methods=['GET', 'POST'])
 @login_required
 @permission_required('pode_agendar')
+@limitar('agendar', por='usuario')
 def agendar():
     """
     Rota para criar um novo agendamento.
     A duração do agendamento é obtida dinamicamente do serviço selecionado.
+    Com "qualquer funcionário" o sistema escolhe o funcionário livre menos ocupado no dia.
     """
     form = AgendamentoForm()
     
@@ -875,9 +1185,24 @@ def agendar():
         data_inicio = form.data_agendamento.data
         data_fim = data_inicio + timedelta(minutes=servico_selecionado.duracao_minutos)
 
+        if form.funcionario_id.data == 0:
+            funcionario = escolher_funcionario(servico_selecionado.id, data_inicio,
+                                               servico_selecionado.duracao_minutos)
+            if funcionario is None:
+                flash('Nenhum funcionário que atende este serviço está livre neste horário.', 'danger')
+                return render_template('agendar.html', form=form)
+            funcionario_id = funcionario.id
+        else:
+            funcionario_id = form.funcionario_id.data
+            # Reservas simultâneas para o mesmo funcionário passam uma de cada vez pela verificação
+            funcionario = travar_funcionario(funcionario_id)
+            if not na_jornada([funcionario], data_inicio, servico_selecionado.duracao_minutos):
+                flash('O horário está fora da jornada de trabalho do funcionário.', 'danger')
+                return render_template('agendar.html', form=form)
+
         conflito = Agendamento.query.filter(
             and_(
-                Agendamento.funcionario_id == form.funcionario_id.data,
+                Agendamento.funcionario_id == funcionario_id,
                 Agendamento.status == 'agendado',
                 or_(
                     and_(Agendamento.data_agendamento < data_fim, Agendamento.data_fim > data_inicio),
@@ -892,8 +1217,10 @@ def agendar():
         
         agendamento = Agendamento(
             cliente_id=form.cliente_id.data,
-            funcionario_id=form.funcionario_id.data,
+            funcionario_id=funcionario_id,
             data_agendamento=form.data_agendamento.data,
+            data_fim=data_fim,
+            servico=servico_selecionado.nome,
             servico_id=form.servico_id.data,
             duracao_minutos=servico_selecionado.duracao_minutos,
             preco_total=servico_selecionado.preco,
@@ -903,11 +1230,116 @@ def agendar():
         db.session.add(agendamento)
         db.session.commit()
         
-        flash('Agendamento criado com sucesso!', 'success')
+        if form.funcionario_id.data == 0:
+            flash(f'Agendamento criado com sucesso para {agendamento.funcionario.usuario.nome}!', 'success')
+        else:
+            flash('Agendamento criado com sucesso!', 'success')
         return redirect(url_for('agendamentos'))
     
     return render_template('agendar.html', form=form)
 
+def _flash_conflitos_serie(conflitos):
+    datas = ', '.join(c.strftime('%d/%m/%Y %H:%M') for c in conflitos[:5])
+    if len(conflitos) > 5:
+        datas += f' e mais {len(conflitos) - 5}'
+    flash(f'A série conflita com agendamentos existentes ou sai da jornada do funcionário em: {datas}.', 'danger')
+
+@app.route('/agendar/recorrente', methods=['GET', 'POST'])
+@login_required
+@permission_required('pode_agendar')
+@limitar('agendar', por='usuario')
+def agendar_recorrente():
+    """
+    Rota para criar uma série de agendamentos recorrentes (ex.: clientes semanais).
+    A série é gravada como regra e as ocorrências até o horizonte são criadas de uma vez.
+    """
+    form = AgendamentoRecorrenteForm()
+
+    if form.validate_on_submit():
+        serie, criadas, conflitos = criar_serie(
+            cliente_id=form.cliente_id.data,
+            funcionario_id=form.funcionario_id.data,
+            servico_id=form.servico_id.data,
+            data_inicio=form.data_agendamento.data,
+            intervalo_semanas=form.intervalo_semanas.data,
+            data_termino=form.data_termino.data,
+            observacoes=form.observacoes.data
+        )
+        if conflitos:
+            _flash_conflitos_serie(conflitos)
+            return render_template('agendar_recorrente.html', form=form)
+
+        flash(f'Série recorrente criada com {criadas} agendamento(s).', 'success')
+        return redirect(url_for('series_agendamento'))
+
+    return render_template('agendar_recorrente.html', form=form)
+
+@app.route('/agendamentos/series')
+@login_required
+@permission_required('pode_ver_agendamentos')
+def series_agendamento():
+    """
+    Lista as séries de agendamentos recorrentes visíveis para o usuário.
+    """
+    page = request.args.get('page', 1, type=int)
+    consulta = SerieAgendamento.query.filter(filtro_autorizacao_series(current_user))\
+        .order_by(SerieAgendamento.ativa.desc(), SerieAgendamento.data_inicio.desc())
+
+    series = consulta.paginate(page=page, per_page=10, error_out=False)
+    return render_template('series_agendamento.html', series=series)
+
+@app.route('/agendamentos/series/<int:serie_id>/editar', methods=['GET', 'POST'])
+@login_required
+@permission_required('pode_agendar')
+def series_agendamento_editar(serie_id):
+    """
+    Edita uma série; as ocorrências futuras ainda agendadas são atualizadas em lote.
+    Só master, o funcionário da série ou o próprio cliente; para os demais a série não existe.
+    """
+    serie = SerieAgendamento.query.filter(
+        SerieAgendamento.id == serie_id, filtro_autorizacao_series(current_user)
+    ).first_or_404()
+    form = AgendamentoRecorrenteForm(obj=serie)
+    if _e_cliente():
+        # Clientes só mantêm séries em nome próprio
+        form.cliente_id.choices = [(current_user.id, current_user.nome)]
+    if request.method == 'GET':
+        form.data_agendamento.data = serie.data_inicio
+
+    if form.validate_on_submit():
+        afetadas, conflitos = atualizar_serie(
+            serie,
+            cliente_id=form.cliente_id.data,
+            funcionario_id=form.funcionario_id.data,
+            servico_id=form.servico_id.data,
+            data_inicio=form.data_agendamento.data,
+            intervalo_semanas=form.intervalo_semanas.data,
+            data_termino=form.data_termino.data,
+            observacoes=form.observacoes.data
+        )
+        if conflitos:
+            _flash_conflitos_serie(conflitos)
+            return render_template('agendar_recorrente.html', form=form, serie=serie)
+
+        flash(f'Série atualizada ({afetadas} agendamento(s) futuros afetados).', 'success')
+        return redirect(url_for('series_agendamento'))
+
+    return render_template('agendar_recorrente.html', form=form, serie=serie)
+
+@app.route('/agendamentos/series/<int:serie_id>/encerrar', methods=['POST'])
+@login_required
+@permission_required('pode_agendar')
+def series_agendamento_encerrar(serie_id):
+    """
+    Encerra a série e cancela os agendamentos futuros dela (mesma autorização da edição).
+    """
+    serie = SerieAgendamento.query.filter(
+        SerieAgendamento.id == serie_id, filtro_autorizacao_series(current_user)
+    ).first_or_404()
+    canceladas = encerrar_serie(serie)
+    flash(f'Série encerrada. {canceladas} agendamento(s) futuro(s) cancelado(s).', 'info')
+    return redirect(url_for('series_agendamento'))
+
 @app.route('/agendamento/<int:agendamento_id>/atualizar', methods=['POST'])
 @login_required
 def atualizar_status_agendamento(agendamento_id):
@@ -925,9 +1357,15 @@ def atualizar_status_agendamento(agendamento_id):
     
     if form.validate_on_submit():
         status_antigo = agendamento.status
+        antigos = {'status': agendamento.status, 'observacoes': agendamento.observacoes}
         agendamento.status = form.status.data
         if form.observacoes.data:
             agendamento.observacoes = form.observacoes.data
+        registrar_auditoria('atualizar_status', agendamento, antigos,
+                            {'status': agendamento.status, 'observacoes': agendamento.observacoes})
+        if agendamento.status == 'cancelado' and status_antigo == 'agendado':
+            # O horário liberado vai para a lista de espera na mesma transação
+            ofertar_vagas_canceladas([agendamento.id])
         
         db.session.commit()
         
@@ -935,22 +1373,162 @@ def atualizar_status_agendamento(agendamento_id):
     
     return redirect(url_for('agendamentos'))
 
+# Quantidade máxima de agendamentos alterados por requisição em lote
+LIMITE_STATUS_LOTE = 1000
+
+@app.route('/agendamentos/status', methods=['POST'])
+@login_required
+def atualizar_status_agendamentos_lote():
+    """
+    Atualiza o status de vários agendamentos de uma vez (ids enviados em 'ids').
+    Cada linha só é alterada se o usuário tiver permissão sobre ela.
+    Responde em JSON quando a requisição for JSON; caso contrário redireciona.
+    """
+    form = AtualizarStatusLoteForm()
+    if request.is_json:
+        ids = (request.get_json(silent=True) or {}).get('ids') or []
+    else:
+        ids = request.form.getlist('ids')
+    try:
+        ids = sorted({int(i) for i in ids})
+    except (TypeError, ValueError):
+        ids = []
+
+    if not form.validate_on_submit() or not ids or len(ids) > LIMITE_STATUS_LOTE:
+        if request.is_json:
+            return jsonify({'erro': 'Informe um status válido e de 1 a %d agendamentos.' % LIMITE_STATUS_LOTE}), 400
+        flash('Selecione ao menos um agendamento e um status válido.', 'danger')
+        return redirect(url_for('agendamentos'))
+
+    anteriores = dict(db.session.query(Agendamento.id, Agendamento.status).filter(Agendamento.id.in_(ids)))
+    atualizados = atualizar_status_em_lote(ids, form.status.data, current_user)
+    registrar_auditoria_lote('atualizar_status', Agendamento.__tablename__, g.empresa_id, [
+        (id, {'status': anteriores.get(id)}, {'status': form.status.data}) for id in atualizados
+    ])
+    if form.status.data == 'cancelado':
+        ofertar_vagas_canceladas([id for id in atualizados if anteriores.get(id) == 'agendado'])
+    db.session.commit()
+    negados = sorted(set(ids) - set(atualizados))
+
+    if request.is_json:
+        return jsonify({'atualizados': atualizados, 'negados': negados})
+
+    flash(f'{len(atualizados)} agendamento(s) atualizado(s) para "{form.status.data}".', 'success')
+    if negados:
+        flash(f'{len(negados)} agendamento(s) não foram alterados (sem permissão ou inexistentes).', 'warning')
+    return redirect(url_for('agendamentos'))
+
+def _e_cliente():
+    return not current_user.is_master() and not current_user.is_funcionario()
+
+@app.route('/lista-espera', methods=['GET', 'POST'])
+@login_required
+@permission_required('pode_agendar')
+@limitar('agendar', por='usuario')
+def lista_espera():
+    """
+    Lista de espera: clientes aguardando um horário que vague num intervalo de datas.
+    Quando um agendamento é cancelado, o horário é ofertado ao primeiro cliente elegível.
+    """
+    form = ListaEsperaForm()
+    if _e_cliente():
+        # Clientes só entram na lista em nome próprio
+        form.cliente_id.choices = [(current_user.id, current_user.nome)]
+
+    if form.validate_on_submit():
+        servico = Servico.query.get_or_404(form.servico_id.data)
+        entrar_na_lista(form.cliente_id.data, servico, form.inicio_janela.data, form.fim_janela.data,
+                        funcionario_id=form.funcionario_id.data or None)
+        db.session.commit()
+        flash('Cliente incluído na lista de espera.', 'success')
+        return redirect(url_for('lista_espera'))
+
+    page = request.args.get('page', 1, type=int)
+    consulta = ListaEspera.query.filter(ListaEspera.status.in_(('aguardando', 'ofertado')))
+    if _e_cliente():
+        consulta = consulta.filter(ListaEspera.cliente_id == current_user.id)
+    entradas = consulta.order_by(
+        (ListaEspera.status == 'ofertado').desc(), ListaEspera.criado_em
+    ).paginate(page=page, per_page=20, error_out=False)
+    return render_template('lista_espera.html', form=form, entradas=entradas)
+
+def _entrada_lista_espera_or_404(entrada_id):
+    entrada = ListaEspera.query.get_or_404(entrada_id)
+    if _e_cliente() and entrada.cliente_id != current_user.id:
+        abort(404)
+    return entrada
+
+@app.route('/lista-espera/<int:entrada_id>/aceitar', methods=['POST'])
+@login_required
+@permission_required('pode_agendar')
+def lista_espera_aceitar(entrada_id):
+    """
+    Aceita a oferta de horário e cria o agendamento.
+    """
+    entrada = _entrada_lista_espera_or_404(entrada_id)
+    if entrada.status != 'ofertado':
+        flash('Esta oferta não está mais disponível.', 'warning')
+        return redirect(url_for('lista_espera'))
+
+    agendamento = aceitar_oferta(entrada)
+    db.session.commit()
+    if agendamento is not None:
+        flash(f'Agendamento criado para {agendamento.data_agendamento.strftime("%d/%m/%Y %H:%M")}.', 'success')
+        return redirect(url_for('agendamentos'))
+    if entrada.status == 'expirado':
+        flash('O prazo da oferta terminou e o horário foi passado ao próximo da fila.', 'warning')
+    else:
+        flash('O horário já foi ocupado. O cliente continua na lista de espera.', 'warning')
+    return redirect(url_for('lista_espera'))
+
+@app.route('/lista-espera/<int:entrada_id>/recusar', methods=['POST'])
+@login_required
+@permission_required('pode_agendar')
+def lista_espera_recusar(entrada_id):
+    """
+    Recusa a oferta; o cliente continua aguardando e o horário vai para o próximo.
+    """
+    entrada = _entrada_lista_espera_or_404(entrada_id)
+    if entrada.status == 'ofertado':
+        recusar_oferta(entrada)
+        db.session.commit()
+        flash('Oferta recusada. O cliente continua na lista de espera.', 'info')
+    return redirect(url_for('lista_espera'))
+
+@app.route('/lista-espera/<int:entrada_id>/sair', methods=['POST'])
+@login_required
+@permission_required('pode_agendar')
+def lista_espera_sair(entrada_id):
+    """
+    Retira o cliente da lista de espera.
+    """
+    entrada = _entrada_lista_espera_or_404(entrada_id)
+    if entrada.status in ('aguardando', 'ofertado'):
+        sair_da_lista(entrada)
+        db.session.commit()
+        flash('Cliente retirado da lista de espera.', 'info')
+    return redirect(url_for('lista_espera'))
+
 @app.route('/relatorios')
 @login_required
 @permission_required('pode_ver_relatorios')
+@somente_leitura
 def relatorios():
     """
     Exibe relatórios estatísticos.
     """
-    hoje = datetime.utcnow().date()
-    inicio_mes = hoje.replace(day=1)
+    # Hoje, este mês e este ano no fuso da empresa, como intervalos meio-abertos
+    # sobre data_agendamento para aproveitar o índice
+    dia, mes, ano = periodo_dia(), periodo_mes(), periodo_ano()
     
     dados_relatorio = {
         'agendamentos_hoje': Agendamento.query.filter(
-            func.date(Agendamento.data_agendamento) == hoje
+            Agendamento.data_agendamento >= dia.inicio,
+            Agendamento.data_agendamento < dia.fim
         ).count(),
         'agendamentos_mes': Agendamento.query.filter(
-            func.date(Agendamento.data_agendamento) >= inicio_mes
+            Agendamento.data_agendamento >= mes.inicio,
+            Agendamento.data_agendamento < mes.fim
         ).count(),
         'agendamentos_concluidos': Agendamento.query.filter_by(status='concluido').count(),
         'agendamentos_cancelados': Agendamento.query.filter_by(status='cancelado').count(),
@@ -962,17 +1540,131 @@ def relatorios():
         ).count()
     }
     
+    mes_local = func.extract('month', Agendamento.data_agendamento)
     stats_mensais = db.session.query(
-        func.extract('month', Agendamento.data_agendamento).label('mes'),
+        mes_local.label('mes'),
         func.count(Agendamento.id).label('count')
     ).filter(
-        func.extract('year', Agendamento.data_agendamento) == datetime.utcnow().year
+        Agendamento.data_agendamento >= ano.inicio,
+        Agendamento.data_agendamento < ano.fim
     ).group_by(
-        func.extract('month', Agendamento.data_agendamento)
+        mes_local
     ).all()
     
     return render_template('relatorios.html', dados_relatorio=dados_relatorio, stats_mensais=stats_mensais)
 
+def _periodo_relatorio():
+    """Período dos relatórios a partir de ?de=&ate= (datas inclusivas, no fuso da empresa); padrão: mês atual."""
+    try:
+        de = datetime.strptime(request.args['de'], '%Y-%m-%d').date() if request.args.get('de') else None
+        ate = datetime.strptime(request.args['ate'], '%Y-%m-%d').date() if request.args.get('ate') else None
+    except ValueError:
+        flash('Período inválido; usando o mês atual.', 'warning')
+        de = ate = None
+    de = de or hoje().replace(day=1)
+    if ate is None or ate < de:
+        return periodo(de, periodo_mes(de).ate)
+    return periodo(de, ate + timedelta(days=1))
+
+@app.route('/relatorios/utilizacao')
+@login_required
+@permission_required('pode_ver_relatorios')
+@somente_leitura
+def relatorios_utilizacao():
+    """
+    Utilização dos funcionários (minutos reservados x disponíveis, cancelamentos) e
+    mapa de ocupação por dia da semana e hora, no período escolhido.
+    """
+    periodo_relatorio = _periodo_relatorio()
+    funcionario_id = request.args.get('funcionario_id', type=int)
+
+    utilizacao = relatorio_em_cache('utilizacao', lambda: utilizacao_funcionarios(periodo_relatorio),
+                                    periodo_relatorio)
+    mapa = relatorio_em_cache('mapa_ocupacao', lambda: mapa_ocupacao(periodo_relatorio, funcionario_id),
+                              periodo_relatorio, funcionario_id)
+    funcionarios = Funcionario.query.join(Usuario).filter(Funcionario.ativo.is_(True)).order_by(Usuario.nome).all()
+
+    return render_template('relatorios_utilizacao.html', utilizacao=utilizacao, mapa=mapa,
+                           funcionarios=funcionarios, funcionario_id=funcionario_id,
+                           de=periodo_relatorio.de, ate=periodo_relatorio.ultimo_dia)
+
+@app.route('/relatorios/receita')
+@login_required
+@permission_required('pode_ver_relatorios')
+@somente_leitura
+def relatorios_receita():
+    """
+    Receita por serviço, funcionário, cliente, dia ou mês no período escolhido, com
+    detalhamento (serviço -> funcionários, funcionário -> serviços, mês -> dias).
+    Lida das visões materializadas de receita, atualizadas pelo comando atualizar-receita.
+    """
+    periodo_relatorio = _periodo_relatorio()
+    dimensao = request.args.get('dimensao', 'servico')
+    if dimensao not in DIMENSOES_RECEITA:
+        dimensao = 'servico'
+    servico_id = request.args.get('servico_id', type=int)
+    funcionario_id = request.args.get('funcionario_id', type=int)
+
+    linhas = receita_por(dimensao, periodo_relatorio, servico_id, funcionario_id)
+    efetivo = receita_periodo_efetivo(dimensao, periodo_relatorio)
+    servico = Servico.query.get(servico_id) if servico_id else None
+    funcionario = Funcionario.query.get(funcionario_id) if funcionario_id else None
+
+    return render_template('relatorios_receita.html', linhas=linhas, dimensao=dimensao,
+                           servico=servico, funcionario=funcionario,
+                           de=periodo_relatorio.de, ate=periodo_relatorio.ultimo_dia,
+                           de_efetivo=efetivo.de, ate_efetivo=efetivo.ultimo_dia,
+                           atualizada_em=receita_atualizada_em())
+
+@app.route('/admin/metricas')
+@login_required
+@master_required
+def admin_metricas():
+    """
+    Métricas internas do worker que atendeu a requisição: limitador de requisições,
+    caches em memória e conexões de eventos em tempo real.
+    """
+    caches = {
+        'Consultas de referência': cache_consultas.estatisticas(),
+        'Relatórios': cache_relatorios.estatisticas(),
+        'Mapas de jornada': cache_jornadas.estatisticas(),
+        'Fragmentos de template': app.jinja_env.cache_fragmentos.estatisticas(),
+    }
+    return render_template('admin_metricas.html', limitador=limitador.metricas(), caches=caches,
+                           assinaturas_eventos=central_eventos.quantidade_assinaturas())
+
+@app.route('/admin/perfis')
+@login_required
+@master_required
+def admin_perfis():
+    """Perfis de requisição guardados (perfilador.py) da empresa atual, do mais recente ao mais antigo."""
+    return render_template('admin_perfis.html', perfis=listar_perfis(g.empresa_id))
+
+def _perfil_da_empresa_or_404(perfil_id):
+    perfil = carregar_perfil(perfil_id)
+    if perfil is None or perfil.get('empresa_id') != g.empresa_id:
+        abort(404)
+    return perfil
+
+@app.route('/admin/perfis/<perfil_id>')
+@login_required
+@master_required
+def admin_perfil(perfil_id):
+    """Detalhe de um perfil: funções mais amostradas e SQLs executados, com tempos."""
+    perfil = _perfil_da_empresa_or_404(perfil_id)
+    sql_mais_lentos = sorted(perfil['sql'], key=lambda consulta: consulta['duracao_ms'], reverse=True)[:20]
+    return render_template('admin_perfil.html', perfil=perfil, funcoes=funcoes_mais_amostradas(perfil),
+                           amostras=sum(perfil['pilhas'].values()), sql_mais_lentos=sql_mais_lentos)
+
+@app.route('/admin/perfis/<perfil_id>/pilhas.txt')
+@login_required
+@master_required
+def admin_perfil_pilhas(perfil_id):
+    """Pilhas no formato colapsado, para gerar o flamegraph (flamegraph.pl, speedscope)."""
+    perfil = _perfil_da_empresa_or_404(perfil_id)
+    return Response(pilhas_colapsadas(perfil), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=perfil-{perfil_id}.txt'})
+
 @app.route('/bot-whatsapp', methods=['GET'])
 @login_required
 @master_required
@@ -1066,11 +1758,16 @@ def bot_whatsapp_geral():
             'msg_fora_horario': msg_fora
         }
         config.whatsapp_webhook_verify_token = json.dumps(blob)
+        # O fuso também define os dias e meses do dashboard e dos relatórios (periodos.py)
+        if timezone in FUSOS_HORARIOS and fuso_valido(timezone):
+            config.fuso_horario = timezone
         db.session.commit()
 
         flash('Configurações gerais do Bot salvas com sucesso!', 'success')
         return redirect(url_for('bot_whatsapp_geral'))
-    return render_template('bot_geral.html')
+    config = ConfiguracaoEmpresa.query.first()
+    return render_template('bot_geral.html', fusos_horarios=FUSOS_HORARIOS,
+                           fuso_atual=config.fuso_horario if config else FUSOS_HORARIOS[0])
 
 @app.route('/configuracoes', methods=['GET', 'POST'])
 @login_required
@@ -1094,7 +1791,7 @@ def configuracoes():
             filename = secure_filename(form.logo.data.filename)
             if filename:
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                filename = timestamp + filename
+                filename = f'{config.empresa_id}_' + timestamp + filename
                 filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
                 form.logo.data.save(filepath)
                 config.logo_path = filename
@@ -1105,10 +1802,25 @@ def configuracoes():
     
     return render_template('configuracoes.html', form=form, config=config)
 
+@app.route('/configuracoes/backup', methods=['POST'])
+@login_required
+@master_required
+@limitar('backup', por='empresa')
+def configuracoes_backup():
+    """
+    Baixa o backup completo da empresa (backup_empresa.py). O arquivo é gerado num
+    temporário em disco e enviado em fluxo, sem ficar inteiro em memória.
+    """
+    arquivo = tempfile.TemporaryFile()
+    gerar_backup(g.empresa_id, arquivo)
+    arquivo.seek(0)
+    return send_file(arquivo, mimetype='application/gzip', as_attachment=True,
+                     download_name=f"backup_empresa_{g.empresa_id}_{datetime.utcnow():%Y%m%d_%H%M%S}.tar.gz")
+
 @app.context_processor
 def inject_config():
     """
     Injeta a configuração da empresa em todos os templates.
     """
     config = ConfiguracaoEmpresa.query.first()
-    return dict(empresa_config=config)
\ No newline at end of file
+    return dict(empresa_config=config, agenda_ao_vivo=current_app.config['AGENDA_AO_VIVO'])
\ No newline at end of file
@@ -0,0 +1,81 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+# Serialização JSON compartilhada pela API (api.py).
+#
+# Usa orjson (dependência do projeto: bem mais rápido e com suporte nativo a datetime);
+# num ambiente sem ele, cai para o json da biblioteca padrão com o mesmo formato de saída.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _padrao(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    raise TypeError(f'Tipo não serializável em JSON: {type(valor).__name__}')
+
+
+def para_json(valor):
+    """Serializa `valor` em bytes JSON (UTF-8, sem espaços)."""
+    if orjson is not None:
+        return orjson.dumps(valor, default=_padrao, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(valor, default=_padrao, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class Recurso:
+    """
+    Descreve como um recurso da API vira SELECT e JSON.
+
+    `campos` mapeia o nome público de cada campo para a expressão de coluna
+    correspondente; `?fields=` escolhe um subconjunto, e só essas colunas são
+    consultadas, sem instanciar objetos do ORM. `juncoes` lista, por campo, as
+    junções necessárias para alcançá-lo e `filtro(usuario)`, opcional, restringe
+    as linhas que o usuário pode ver. Os campos em `privados` só existem para quem
+    `ver_privados(usuario)` aceita. Todo recurso tem um campo 'id'.
+    """
+
+    def __init__(self, nome, modelo, campos, padrao=None, juncoes=None, filtro=None,
+                 privados=(), ver_privados=None):
+        self.nome = nome
+        self.modelo = modelo
+        self.campos = campos
+        self.padrao = padrao or list(campos)
+        self.juncoes = juncoes or {}
+        self.filtro = filtro
+        self.privados = set(privados)
+        self.ver_privados = ver_privados
+
+    def campos_visiveis(self, usuario):
+        """Nomes dos campos que `usuario` pode pedir."""
+        if not self.privados or (self.ver_privados is not None and self.ver_privados(usuario)):
+            return self.campos.keys()
+        return self.campos.keys() - self.privados
+
+    def selecionar_campos(self, parametro, usuario):
+        """
+        Converte o parâmetro `fields` ("id,nome,...") na lista de nomes de campos.
+        Lança ValueError com os nomes desconhecidos ou não visíveis para `usuario`.
+        """
+        visiveis = self.campos_visiveis(usuario)
+        if not parametro:
+            return [nome for nome in self.padrao if nome in visiveis]
+        nomes = [nome.strip() for nome in parametro.split(',') if nome.strip()]
+        desconhecidos = [nome for nome in nomes if nome not in visiveis]
+        if desconhecidos:
+            raise ValueError(f"Campo(s) inválido(s) para {self.nome}: {', '.join(desconhecidos)}")
+        return list(dict.fromkeys(nomes))
+
+    def aplicar_juncoes(self, consulta, nomes):
+        """Acrescenta à consulta as junções exigidas pelos campos escolhidos (cada uma uma vez)."""
+        aplicadas = []
+        for nome in nomes:
+            for alvo, condicao in self.juncoes.get(nome, []):
+                if alvo not in aplicadas:
+                    consulta = consulta.outerjoin(alvo, condicao)
+                    aplicadas.append(alvo)
+        return consulta
@@ -0,0 +1,111 @@
+import logging
+import os
+import socketserver
+import threading
+from email import message_from_bytes, policy
+
+# Receptor SMTP local para desenvolvimento e testes do resumo diário: aceita qualquer
+# mensagem, sem autenticação nem TLS, e guarda o que recebeu em memória (e, opcional,
+# como arquivos .eml num diretório). Implementa só o necessário para o smtplib:
+# HELO/EHLO, MAIL, RCPT, DATA, RSET, NOOP e QUIT, com várias mensagens por conexão.
+#
+#   flask --app main smtp-local --porta 1025 --diretorio /tmp/emails
+#   SMTP_HOST=localhost SMTP_PORTA=1025 RESUMO_TRANSPORTE=smtp flask --app main enviar-resumo-diario
+
+
+class _SessaoSMTP(socketserver.StreamRequestHandler):
+
+    def _responder(self, *linhas):
+        # Respostas de várias linhas usam "250-" em todas menos a última
+        for i, linha in enumerate(linhas):
+            separador = ' ' if i == len(linhas) - 1 else '-'
+            self.wfile.write(f'{linha[:3]}{separador}{linha[4:]}\r\n'.encode())
+
+    def _ler_dados(self):
+        linhas = []
+        while True:
+            linha = self.rfile.readline()
+            if not linha or linha.rstrip(b'\r\n') == b'.':
+                return b''.join(linhas)
+            # Desfaz o "dot-stuffing" das linhas que começam com ponto
+            linhas.append(linha[1:] if linha.startswith(b'..') else linha)
+
+    def handle(self):
+        servidor = self.server
+        servidor.registrar_conexao()
+        self._responder('220 smtp-local ready')
+        remetente, destinatarios = None, []
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            comando = linha.decode('utf-8', 'replace').strip()
+            verbo = comando[:4].upper()
+            if verbo == 'EHLO':
+                self._responder('250 smtp-local', '250 8BITMIME', '250 SMTPUTF8')
+            elif verbo == 'HELO':
+                self._responder('250 smtp-local')
+            elif verbo == 'MAIL':
+                remetente, destinatarios = comando.partition(':')[2].strip(), []
+                self._responder('250 OK')
+            elif verbo == 'RCPT':
+                destinatarios.append(comando.partition(':')[2].strip())
+                self._responder('250 OK')
+            elif verbo == 'DATA':
+                if not destinatarios:
+                    self._responder('503 Need RCPT before DATA')
+                    continue
+                self._responder('354 End data with <CR><LF>.<CR><LF>')
+                servidor.guardar(remetente, destinatarios, self._ler_dados())
+                remetente, destinatarios = None, []
+                self._responder('250 OK')
+            elif verbo == 'RSET':
+                remetente, destinatarios = None, []
+                self._responder('250 OK')
+            elif verbo == 'NOOP':
+                self._responder('250 OK')
+            elif verbo == 'QUIT':
+                self._responder('221 Bye')
+                return
+            else:
+                self._responder('502 Command not implemented')
+
+
+class ServidorSMTPLocal(socketserver.ThreadingTCPServer):
+    """Receptor SMTP em (host, porta); `mensagens` guarda (remetente, destinatários, EmailMessage)."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='localhost', porta=1025, diretorio=None):
+        super().__init__((host, porta), _SessaoSMTP)
+        self.diretorio = diretorio
+        self.mensagens = []
+        self.conexoes = 0
+        self._trava = threading.Lock()
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+
+    @property
+    def porta(self):
+        return self.server_address[1]
+
+    def registrar_conexao(self):
+        with self._trava:
+            self.conexoes += 1
+
+    def guardar(self, remetente, destinatarios, dados):
+        mensagem = message_from_bytes(dados, policy=policy.default)
+        with self._trava:
+            self.mensagens.append((remetente, destinatarios, mensagem))
+            numero = len(self.mensagens)
+        if self.diretorio:
+            with open(os.path.join(self.diretorio, f'{numero:06d}.eml'), 'wb') as arquivo:
+                arquivo.write(dados)
+        logging.info(f"smtp-local: mensagem {numero} de {remetente} para {', '.join(destinatarios)}: {mensagem['Subject']}")
+
+    def iniciar_em_segundo_plano(self):
+        """Atende numa thread daemon (para testes); pare com shutdown()."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,64 @@
+// Atualização da agenda em tempo real (SSE em /agendamentos/eventos)
+// Uso: um elemento com data-agenda-ao-vivo="<url>" na página; as linhas da tabela
+// marcadas com data-agendamento-id e o badge .status-agendamento são atualizados no lugar.
+// Cada evento também é repassado como 'agenda:evento' no document, para listas que
+// guardam os dados fora do DOM (agendamentos_virtual.js).
+(function () {
+	var CORES_STATUS = {
+		agendado: 'warning',
+		concluido: 'success',
+		cancelado: 'danger',
+		nao_compareceu: 'secondary'
+	};
+	var ROTULOS_STATUS = {
+		agendado: 'Agendado',
+		concluido: 'Concluido',
+		cancelado: 'Cancelado',
+		nao_compareceu: 'Nao_Compareceu'
+	};
+
+	function mostrarAviso(container) {
+		if (document.getElementById('aviso-agenda-atualizada')) return;
+		var aviso = document.createElement('div');
+		aviso.id = 'aviso-agenda-atualizada';
+		aviso.className = 'alert alert-info d-flex justify-content-between align-items-center';
+		aviso.innerHTML = '<span><i class="fas fa-bell me-2"></i>Há agendamentos novos.</span>' +
+			'<button type="button" class="btn btn-sm btn-primary">Atualizar</button>';
+		aviso.querySelector('button').addEventListener('click', function () {
+			window.location.reload();
+		});
+		container.insertBefore(aviso, container.firstChild);
+	}
+
+	function atualizarLinha(linha, evento) {
+		if (evento.evento === 'removido') {
+			linha.classList.add('text-decoration-line-through', 'text-muted');
+			return;
+		}
+		var badge = linha.querySelector('.status-agendamento');
+		if (!badge) return;
+		badge.className = 'badge status-agendamento bg-' + (CORES_STATUS[evento.status] || 'secondary');
+		badge.textContent = ROTULOS_STATUS[evento.status] || evento.status;
+		linha.classList.add('table-info');
+		setTimeout(function () { linha.classList.remove('table-info'); }, 2000);
+	}
+
+	function iniciar() {
+		var container = document.querySelector('[data-agenda-ao-vivo]');
+		if (!container || !window.EventSource) return;
+
+		var fonte = new EventSource(container.getAttribute('data-agenda-ao-vivo'));
+		fonte.addEventListener('agendamento', function (mensagem) {
+			var evento = JSON.parse(mensagem.data);
+			document.dispatchEvent(new CustomEvent('agenda:evento', { detail: evento }));
+			var linha = document.querySelector('tr[data-agendamento-id="' + evento.id + '"]');
+			if (linha) {
+				atualizarLinha(linha, evento);
+			} else if (evento.evento === 'criado') {
+				mostrarAviso(container);
+			}
+		});
+	}
+
+	document.addEventListener('DOMContentLoaded', iniciar);
+})();
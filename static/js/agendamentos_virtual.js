@@ -0,0 +1,236 @@
+// Lista de agendamentos com rolagem virtual.
+// As linhas vêm em páginas de /agendamentos/lista (JSON compacto, cursor por data e id)
+// e ficam só em memória; o tbody mostra apenas as linhas visíveis mais uma folga, entre
+// duas linhas espaçadoras com a altura das demais, então o DOM tem o mesmo tamanho com
+// dezenas ou milhares de agendamentos. A seleção para o lote é guardada por id e um único
+// modal de status é preenchido com a linha escolhida.
+(function () {
+	var ALTURA_LINHA = 49;  // px; as linhas têm altura fixa para o cálculo da janela
+	var FOLGA = 15;         // linhas renderizadas além das visíveis, acima e abaixo
+	var LOTE = 200;         // linhas por chamada
+	var COLUNAS = 8;
+	var CORES_STATUS = {
+		agendado: 'warning',
+		concluido: 'success',
+		cancelado: 'danger',
+		nao_compareceu: 'secondary'
+	};
+	var ROTULOS_STATUS = {
+		agendado: 'Agendado',
+		concluido: 'Concluido',
+		cancelado: 'Cancelado',
+		nao_compareceu: 'Nao_Compareceu'
+	};
+
+	var raiz, rolagem, corpo, urlLista, urlStatus;
+	var linhas = [];
+	var porId = {};
+	var selecionados = new Set();
+	var total = 0;
+	var proximo = null;
+	var carregando = false;
+	var completo = false;
+	var janela = '';
+	var quadroPendente = false;
+
+	function carregar() {
+		if (carregando || completo) return;
+		carregando = true;
+		var url = urlLista + '?limite=' + LOTE + (proximo ? '&cursor=' + encodeURIComponent(proximo) : '');
+		fetch(url, { headers: { 'Accept': 'application/json' }, credentials: 'same-origin' })
+			.then(function (resposta) {
+				if (!resposta.ok) throw new Error(resposta.status);
+				return resposta.json();
+			})
+			.then(function (dados) {
+				dados.linhas.forEach(function (valores) {
+					var item = {};
+					dados.colunas.forEach(function (coluna, i) { item[coluna] = valores[i]; });
+					linhas.push(item);
+					porId[item.id] = item;
+				});
+				if (dados.total !== undefined) total = dados.total;
+				proximo = dados.proximo;
+				completo = !proximo;
+				// O total é da primeira página; inclusões e exclusões depois dela não contam
+				total = completo ? linhas.length : Math.max(total, linhas.length + 1);
+				carregando = false;
+				mostrarVazio(linhas.length === 0);
+				janela = '';
+				renderizar();
+			})
+			.catch(function () {
+				carregando = false;
+			});
+	}
+
+	function mostrarVazio(vazio) {
+		raiz.querySelector('#agendamentos-vazio').classList.toggle('d-none', !vazio);
+		rolagem.classList.toggle('d-none', vazio);
+		raiz.querySelector('#form-status-lote').classList.toggle('d-none', vazio);
+	}
+
+	function espacador(altura) {
+		var tr = document.createElement('tr');
+		var td = document.createElement('td');
+		td.colSpan = COLUNAS;
+		td.style.cssText = 'height:' + altura + 'px;padding:0;border:0';
+		tr.appendChild(td);
+		return tr;
+	}
+
+	function celula(tr, texto) {
+		var td = document.createElement('td');
+		td.className = 'text-nowrap';
+		td.textContent = texto;
+		tr.appendChild(td);
+		return td;
+	}
+
+	function criarLinha(item) {
+		var tr = document.createElement('tr');
+		tr.setAttribute('data-agendamento-id', item.id);
+		tr.style.height = ALTURA_LINHA + 'px';
+		if (item.removido) tr.classList.add('text-decoration-line-through', 'text-muted');
+
+		var caixa = document.createElement('input');
+		caixa.type = 'checkbox';
+		caixa.className = 'form-check-input selecionar-agendamento';
+		caixa.value = item.id;
+		caixa.checked = selecionados.has(item.id);
+		celula(tr, '').appendChild(caixa);
+
+		celula(tr, item.cliente);
+		celula(tr, item.funcionario);
+		celula(tr, item.inicio);
+		celula(tr, item.servico || '-');
+		celula(tr, item.duracao + ' min');
+
+		var badge = document.createElement('span');
+		badge.className = 'badge status-agendamento bg-' + (CORES_STATUS[item.status] || 'secondary');
+		badge.textContent = ROTULOS_STATUS[item.status] || item.status;
+		celula(tr, '').appendChild(badge);
+
+		var botao = document.createElement('button');
+		botao.type = 'button';
+		botao.className = 'btn btn-sm btn-outline-primary';
+		botao.setAttribute('data-acao', 'editar');
+		botao.innerHTML = '<i class="fas fa-edit"></i>';
+		celula(tr, '').appendChild(botao);
+		return tr;
+	}
+
+	function renderizar() {
+		var primeiro = Math.max(0, Math.floor(rolagem.scrollTop / ALTURA_LINHA) - FOLGA);
+		var ultimo = Math.min(total, Math.ceil((rolagem.scrollTop + rolagem.clientHeight) / ALTURA_LINHA) + FOLGA);
+		if (ultimo > linhas.length) carregar();
+		ultimo = Math.min(ultimo, linhas.length);
+		primeiro = Math.min(primeiro, ultimo);
+
+		var chave = primeiro + ':' + ultimo + ':' + total;
+		if (chave === janela) return;
+		janela = chave;
+
+		var fragmento = document.createDocumentFragment();
+		fragmento.appendChild(espacador(primeiro * ALTURA_LINHA));
+		for (var i = primeiro; i < ultimo; i++) {
+			fragmento.appendChild(criarLinha(linhas[i]));
+		}
+		fragmento.appendChild(espacador((total - ultimo) * ALTURA_LINHA));
+		corpo.replaceChildren(fragmento);
+		atualizarContagem();
+	}
+
+	function redesenhar() {
+		janela = '';
+		renderizar();
+	}
+
+	function atualizarContagem() {
+		raiz.querySelector('#total-selecionados').textContent = selecionados.size;
+		raiz.querySelector('#contagem-agendamentos').textContent = completo
+			? linhas.length + ' agendamento(s)'
+			: linhas.length + ' de ' + total + ' carregado(s)';
+	}
+
+	function abrirModal(id) {
+		var item = porId[id];
+		var modal = document.getElementById('modal-status');
+		if (!item || !modal) return;
+		modal.querySelector('form').action = urlStatus.replace('/0/', '/' + id + '/');
+		modal.querySelector('#modal-status-status').value = item.status;
+		modal.querySelector('#modal-status-observacoes').value = item.observacoes || '';
+		modal.querySelector('#modal-status-resumo').textContent = item.cliente + ' · ' + item.inicio + ' · ' + (item.servico || '-');
+		bootstrap.Modal.getOrCreateInstance(modal).show();
+	}
+
+	function iniciar() {
+		raiz = document.getElementById('agendamentos-virtual');
+		if (!raiz) return;
+		rolagem = raiz.querySelector('.agendamentos-rolagem');
+		corpo = rolagem.querySelector('tbody');
+		urlLista = raiz.getAttribute('data-url-lista');
+		urlStatus = raiz.getAttribute('data-url-status');
+
+		rolagem.addEventListener('scroll', function () {
+			if (quadroPendente) return;
+			quadroPendente = true;
+			window.requestAnimationFrame(function () {
+				quadroPendente = false;
+				renderizar();
+			});
+		});
+		window.addEventListener('resize', redesenhar);
+
+		corpo.addEventListener('change', function (evento) {
+			var caixa = evento.target.closest('.selecionar-agendamento');
+			if (!caixa) return;
+			var id = parseInt(caixa.value, 10);
+			if (caixa.checked) selecionados.add(id); else selecionados.delete(id);
+			atualizarContagem();
+		});
+		corpo.addEventListener('click', function (evento) {
+			var botao = evento.target.closest('[data-acao="editar"]');
+			if (botao) abrirModal(parseInt(botao.closest('tr').getAttribute('data-agendamento-id'), 10));
+		});
+
+		// "Selecionar todos" vale para as linhas já carregadas
+		var todos = document.getElementById('selecionar-todos');
+		todos.addEventListener('change', function () {
+			if (todos.checked) {
+				linhas.forEach(function (item) { selecionados.add(item.id); });
+			} else {
+				selecionados.clear();
+			}
+			redesenhar();
+		});
+
+		// As linhas selecionadas fora da tela não estão no DOM: vão como campos ocultos
+		var formLote = document.getElementById('form-status-lote');
+		formLote.addEventListener('submit', function () {
+			formLote.querySelectorAll('input[name="ids"]').forEach(function (campo) { campo.remove(); });
+			selecionados.forEach(function (id) {
+				var campo = document.createElement('input');
+				campo.type = 'hidden';
+				campo.name = 'ids';
+				campo.value = id;
+				formLote.appendChild(campo);
+			});
+		});
+
+		// Eventos da agenda ao vivo mantêm os dados em memória atualizados
+		document.addEventListener('agenda:evento', function (evento) {
+			var item = porId[evento.detail.id];
+			if (!item) return;
+			if (evento.detail.evento === 'removido') {
+				item.removido = true;
+			} else if (evento.detail.status) {
+				item.status = evento.detail.status;
+			}
+		});
+
+		carregar();
+	}
+
+	document.addEventListener('DOMContentLoaded', iniciar);
+})();
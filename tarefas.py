@@ -0,0 +1,453 @@
+import click
+from datetime import timedelta
+from aplicacao import app
+
+# Tarefas periódicas executadas pelo agendador do sistema (cron), por exemplo:
+#   flask --app main expandir-series
+
+
+@app.cli.command('expandir-series')
+def expandir_series_comando():
+    """Materializa as ocorrências das séries recorrentes até o horizonte configurado."""
+    from agenda import expandir_series
+    criadas = expandir_series()
+    click.echo(f'{criadas} agendamento(s) criado(s) a partir de séries recorrentes.')
+    if criadas:
+        _atualizar_receita()
+
+
+@app.cli.command('finalizar-agendamentos-vencidos')
+@click.option('--status', 'status_final', type=click.Choice(['concluido', 'nao_compareceu']),
+              default='concluido', show_default=True, help='Status aplicado aos agendamentos vencidos.')
+@click.option('--tolerancia-horas', type=float, default=1, show_default=True,
+              help='Horas após o término antes de considerar o agendamento vencido.')
+def finalizar_agendamentos_vencidos_comando(status_final, tolerancia_horas):
+    """Fecha os agendamentos que já passaram e continuam com status 'agendado'."""
+    from agenda import finalizar_agendamentos_vencidos
+    total = finalizar_agendamentos_vencidos(status_final, timedelta(hours=tolerancia_horas))
+    click.echo(f'{total} agendamento(s) marcado(s) como {status_final}.')
+    if total:
+        _atualizar_receita()
+
+
+@app.cli.command('purgar-excluidos')
+@click.option('--lote', type=int, default=None, help='Linhas alteradas por transação.')
+def purgar_excluidos_comando(lote):
+    """Remove ou anonimiza, em lotes, os dados de clientes e usuários excluídos."""
+    from exclusao import LOTE_EXPURGO, purgar_usuarios_excluidos
+    usuarios, cancelados = purgar_usuarios_excluidos(lote or LOTE_EXPURGO)
+    click.echo(f'{usuarios} usuário(s) expurgado(s), {cancelados} agendamento(s) futuro(s) cancelado(s).')
+    if cancelados:
+        _atualizar_receita()
+
+
+@app.cli.command('processar-lista-espera')
+@click.option('--lote', type=int, default=None, help='Linhas tratadas por transação.')
+def processar_lista_espera_comando(lote):
+    """Avisa as ofertas novas da lista de espera, vence as sem resposta e encerra as esperas passadas."""
+    from lista_espera import LOTE_LISTA_ESPERA, processar_lista_espera
+    vencidas, encerradas, avisos = processar_lista_espera(lote or LOTE_LISTA_ESPERA)
+    click.echo(f'{avisos} oferta(s) avisada(s), {vencidas} vencida(s), {encerradas} espera(s) encerrada(s).')
+
+
+@app.cli.command('enviar-resumo-diario')
+@click.option('--data', 'dia', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Dia da agenda (padrão: amanhã no fuso de cada empresa).')
+@click.option('--transporte', type=click.Choice(['log', 'smtp']), default=None,
+              help='Como enviar (padrão: RESUMO_TRANSPORTE da configuração).')
+@click.option('--empresa-id', type=int, default=None, help='Só os funcionários desta empresa.')
+def enviar_resumo_diario_comando(dia, transporte, empresa_id):
+    """Envia a cada funcionário ativo o resumo da sua agenda do dia seguinte."""
+    from time import perf_counter
+    from resumo_diario import criar_transporte, enviar_resumos
+    inicio = perf_counter()
+    totais = enviar_resumos(criar_transporte(transporte), dia.date() if dia else None, empresa_id)
+    click.echo(
+        f"{totais['enviados']} resumo(s) enviado(s) para {totais['funcionarios']} funcionário(s) "
+        f"({totais['atendimentos']} atendimento(s)), {totais['sem_email']} sem e-mail, "
+        f"{totais['falhas']} falha(s) em {perf_counter() - inicio:.1f}s."
+    )
+
+
+@app.cli.command('smtp-local')
+@click.option('--host', default='localhost', show_default=True)
+@click.option('--porta', type=int, default=1025, show_default=True)
+@click.option('--diretorio', default=None, help='Grava cada mensagem recebida como .eml neste diretório.')
+def smtp_local_comando(host, porta, diretorio):
+    """Receptor SMTP local que aceita e guarda as mensagens, para testar os envios."""
+    from smtp_local import ServidorSMTPLocal
+    with ServidorSMTPLocal(host, porta, diretorio) as servidor:
+        click.echo(f'Recebendo mensagens em {host}:{porta} (Ctrl+C para sair).')
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            click.echo(f'{len(servidor.mensagens)} mensagem(ns) recebida(s) em {servidor.conexoes} conexão(ões).')
+
+
+@app.cli.command('backup-empresa')
+@click.option('--empresa-id', type=int, required=True)
+@click.option('--arquivo', type=click.Path(dir_okay=False, allow_dash=True), default=None,
+              help='Destino do .tar.gz (padrão: backup_empresa_<id>_<data>.tar.gz; "-" para a saída padrão).')
+def backup_empresa_comando(empresa_id, arquivo):
+    """Gera o backup completo de uma empresa (COPY numa transação REPEATABLE READ)."""
+    import os
+    from time import perf_counter
+    from datetime import datetime
+    from backup_empresa import ErroBackup, gerar_backup
+
+    arquivo = arquivo or f'backup_empresa_{empresa_id}_{datetime.utcnow():%Y%m%d_%H%M%S}.tar.gz'
+    inicio = perf_counter()
+    try:
+        with click.open_file(arquivo, 'wb') as saida:
+            tamanhos = gerar_backup(empresa_id, saida)
+    except ErroBackup as erro:
+        if arquivo != '-':
+            os.remove(arquivo)
+        raise click.ClickException(str(erro))
+    click.echo(f'Backup de {len(tamanhos)} tabela(s) ({sum(tamanhos.values())} bytes sem compressão) '
+               f'em {perf_counter() - inicio:.1f}s: {arquivo}', err=arquivo == '-')
+
+
+@app.cli.command('restaurar-empresa')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--substituir', is_flag=True, help='Apaga os dados atuais da empresa antes de restaurar.')
+def restaurar_empresa_comando(arquivo, substituir):
+    """Restaura o backup de uma empresa (COPY FROM, na ordem das chaves estrangeiras)."""
+    from time import perf_counter
+    from backup_empresa import ErroBackup, restaurar_backup
+
+    inicio = perf_counter()
+    try:
+        with click.open_file(arquivo, 'rb') as entrada:
+            empresa_id, linhas = restaurar_backup(entrada, substituir)
+    except ErroBackup as erro:
+        raise click.ClickException(str(erro))
+    click.echo(f'Empresa {empresa_id} restaurada: {sum(linhas.values())} linha(s) em {len(linhas)} tabela(s) '
+               f'em {perf_counter() - inicio:.1f}s.')
+    _atualizar_receita()
+
+
+@app.cli.command('manter-particoes')
+@click.option('--meses-futuros', type=int, default=None, help='Meses à frente com partição criada.')
+@click.option('--retencao-meses', type=int, default=None, help='Meses mantidos na tabela principal.')
+@click.option('--retencao-auditoria-meses', type=int, default=None, help='Meses de logs de auditoria mantidos.')
+def manter_particoes_comando(meses_futuros, retencao_meses, retencao_auditoria_meses):
+    """Cria as partições mensais futuras, arquiva agendamentos antigos e descarta a auditoria vencida."""
+    from aplicacao import db
+    from particoes import garantir_particoes, arquivar_particoes, descartar_particoes
+
+    meses_futuros = meses_futuros if meses_futuros is not None else app.config.get('PARTICOES_MESES_FUTUROS', 6)
+    retencao_meses = retencao_meses if retencao_meses is not None else app.config.get('RETENCAO_AGENDAMENTOS_MESES', 24)
+    if retencao_auditoria_meses is None:
+        retencao_auditoria_meses = app.config.get('RETENCAO_AUDITORIA_MESES', 12)
+
+    criadas = garantir_particoes(db.engine, 'agendamentos', 'data_agendamento', meses_futuros)
+    criadas += garantir_particoes(db.engine, 'logs_auditoria', 'timestamp', meses_futuros)
+    arquivadas = arquivar_particoes(db.engine, 'agendamentos', 'agendamentos_arquivo', retencao_meses)
+    descartadas = descartar_particoes(db.engine, 'logs_auditoria', retencao_auditoria_meses)
+    click.echo(f'{criadas} partição(ões) criada(s), {len(arquivadas)} arquivada(s), '
+               f'{len(descartadas)} de auditoria descartada(s).')
+
+
+@app.cli.command('particionar-agendamentos')
+@click.confirmation_option(prompt='A tabela agendamentos fica bloqueada para leitura e escrita durante toda a '
+                                  'conversão (cópia das linhas e criação dos índices). Continuar?')
+def particionar_agendamentos_comando():
+    """Converte agendamentos em particionada (bancos antigos; janela de manutenção, bloqueia a tabela)."""
+    from time import perf_counter
+    from sqlalchemy.exc import OperationalError
+    from aplicacao import db
+    from particoes import particionar_agendamentos
+
+    inicio = perf_counter()
+    try:
+        copiadas = particionar_agendamentos(db.engine, app.config.get('PARTICOES_MESES_FUTUROS', 6))
+    except OperationalError as erro:
+        raise click.ClickException(f'Conversão não feita, nada foi alterado: {erro.orig}')
+    if copiadas is None:
+        click.echo('agendamentos já é particionada; nada a fazer.')
+        return
+    click.echo(f'agendamentos particionada: {copiadas} linha(s) copiada(s) em {perf_counter() - inicio:.1f}s.')
+
+
+def _atualizar_receita():
+    from time import perf_counter
+    from aplicacao import db
+    from analises import atualizar_visoes_receita
+
+    inicio = perf_counter()
+    with db.engine.begin() as conn:
+        atualizar_visoes_receita(conn)
+    click.echo(f'Visões de receita atualizadas em {perf_counter() - inicio:.2f}s.')
+
+
+@app.cli.command('atualizar-receita')
+def atualizar_receita_comando():
+    """Atualiza (REFRESH CONCURRENTLY) as visões materializadas dos relatórios de receita."""
+    _atualizar_receita()
+
+
+@app.cli.command('comparar-receita')
+@click.option('--dias', type=int, default=365, show_default=True, help='Tamanho do período, até hoje.')
+@click.option('--repeticoes', type=int, default=5, show_default=True, help='Execuções de cada consulta.')
+@click.option('--empresa-id', type=int, default=None, help='Empresa consultada (padrão: todas).')
+def comparar_receita_comando(dias, repeticoes, empresa_id):
+    """Compara o tempo dos relatórios de receita pelas visões e pela agregação direta em agendamentos."""
+    from time import perf_counter
+    from flask import g
+    from analises import DIMENSOES_RECEITA, receita_por
+    from periodos import hoje, periodo
+
+    if empresa_id is not None:
+        g.empresa_id = empresa_id
+    ate = hoje() + timedelta(days=1)
+    periodo_comparado = periodo(ate - timedelta(days=dias), ate)
+
+    def medir(direto):
+        tempos = []
+        for _ in range(repeticoes):
+            comeco = perf_counter()
+            linhas = receita_por(dimensao, periodo_comparado, direto=direto)
+            tempos.append(perf_counter() - comeco)
+        return min(tempos), linhas
+
+    divergencias = 0
+    for dimensao in DIMENSOES_RECEITA:
+        tempo_visao, pela_visao = medir(direto=False)
+        tempo_direto, direto = medir(direto=True)
+        confere = _resumo_receita(pela_visao) == _resumo_receita(direto)
+        divergencias += not confere
+        click.echo(f"{dimensao:<12} visões {tempo_visao * 1000:8.1f} ms   direto {tempo_direto * 1000:8.1f} ms   "
+                   f"{tempo_direto / max(tempo_visao, 1e-9):6.1f}x   "
+                   f"{len(pela_visao)} linha(s) {'ok' if confere else 'DIVERGENTE (visões desatualizadas?)'}")
+
+    if divergencias:
+        raise SystemExit(1)
+
+
+def _resumo_receita(linhas):
+    return sorted((linha['chave'], round(linha['receita'], 2), round(linha['receita_prevista'], 2),
+                   linha['atendimentos'], linha['cancelados']) for linha in linhas)
+
+
+@app.cli.command('comparar-servidores')
+@click.option('--perfil', 'perfis', multiple=True, type=click.Choice(['gthread', 'gevent']),
+              default=('gthread', 'gevent'), show_default=True, help='Perfis do gunicorn.conf.py comparados.')
+@click.option('--caminho', 'caminhos', multiple=True, default=('/login',), show_default=True,
+              help='Páginas requisitadas (alternadas).')
+@click.option('--requisicoes', type=int, default=2000, show_default=True, help='Requisições por perfil.')
+@click.option('--concorrencia', type=int, default=32, show_default=True, help='Clientes simultâneos.')
+@click.option('--usuario', default=None, help='Usuário para entrar antes de medir (páginas que exigem login).')
+@click.option('--senha', default=None)
+@click.option('--porta', type=int, default=5055, show_default=True)
+def comparar_servidores_comando(perfis, caminhos, requisicoes, concorrencia, usuario, senha, porta):
+    """
+    Sobe o gunicorn com cada perfil (GUNICORN_PERFIL) e mede vazão, latência e o pico de
+    conexões abertas no banco sob a mesma carga. As demais variáveis (WEB_CONCURRENCY,
+    GUNICORN_THREADS, DB_CONEXOES_MAXIMAS...) valem para todos os perfis.
+    """
+    import os
+    import subprocess
+    import sys
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from time import perf_counter
+    from sqlalchemy import text
+    from aplicacao import db
+
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    base = f'http://127.0.0.1:{porta}'
+    contar_conexoes = text(
+        "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()"
+    )
+
+    for perfil in perfis:
+        ambiente = dict(os.environ, GUNICORN_PERFIL=perfil)
+        servidor = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(raiz, 'gunicorn.conf.py'),
+             '--bind', f'127.0.0.1:{porta}', 'main:app'],
+            cwd=raiz, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            if not _esperar_servidor(base, servidor):
+                click.echo(f'{perfil:<8} não subiu (gunicorn ou o worker {perfil} estão instalados?)')
+                continue
+            abrir = _cliente_http(base, usuario, senha)
+            with db.engine.connect() as conn:
+                conexoes_antes = conn.execute(contar_conexoes).scalar()
+                pico = [conexoes_antes]
+                parar = threading.Event()
+
+                def amostrar_conexoes():
+                    while not parar.wait(0.2):
+                        pico[0] = max(pico[0], conn.execute(contar_conexoes).scalar())
+
+                amostrador = threading.Thread(target=amostrar_conexoes, daemon=True)
+                amostrador.start()
+                comeco = perf_counter()
+                with ThreadPoolExecutor(concorrencia) as executor:
+                    resultados = list(executor.map(
+                        lambda i: _requisitar(abrir, base + caminhos[i % len(caminhos)]), range(requisicoes)
+                    ))
+                duracao = perf_counter() - comeco
+                parar.set()
+                amostrador.join()
+        finally:
+            servidor.terminate()
+            servidor.wait()
+
+        tempos = sorted(tempo for tempo, ok in resultados)
+        erros = sum(not ok for tempo, ok in resultados)
+        percentil = lambda p: tempos[min(len(tempos) - 1, int(len(tempos) * p))] * 1000
+        click.echo(f"{perfil:<8} {requisicoes / duracao:8.1f} req/s   p50 {percentil(0.5):7.1f} ms   "
+                   f"p95 {percentil(0.95):7.1f} ms   p99 {percentil(0.99):7.1f} ms   "
+                   f"{erros} erro(s)   pico de {pico[0]} conexão(ões) no banco (antes: {conexoes_antes})")
+
+
+def _esperar_servidor(base, servidor, limite=60):
+    import urllib.request
+    from time import perf_counter, sleep
+    fim = perf_counter() + limite
+    while perf_counter() < fim and servidor.poll() is None:
+        try:
+            urllib.request.urlopen(base + '/login', timeout=2).close()
+            return True
+        except OSError:
+            sleep(0.5)
+    return False
+
+
+def _cliente_http(base, usuario, senha):
+    """Função que abre uma URL; com usuário, mantém os cookies da sessão autenticada."""
+    import re
+    import urllib.parse
+    import urllib.request
+    from http.cookiejar import CookieJar
+    abridor = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    if usuario:
+        pagina = abridor.open(base + '/login').read().decode()
+        token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', pagina)
+        dados = {'username': usuario, 'password': senha or '', 'csrf_token': token.group(1) if token else ''}
+        abridor.open(base + '/login', urllib.parse.urlencode(dados).encode()).close()
+    return abridor.open
+
+
+def _requisitar(abrir, url):
+    from time import perf_counter
+    comeco = perf_counter()
+    try:
+        with abrir(url, timeout=30) as resposta:
+            resposta.read()
+        ok = True
+    except OSError:
+        ok = False
+    return perf_counter() - comeco, ok
+
+
+@app.cli.command('limpar-limites')
+def limpar_limites_comando():
+    """Remove da tabela do limitador compartilhado os baldes sem uso."""
+    from aplicacao import db
+    from limitador import limpar_baldes_expirados
+    with db.engine.begin() as conn:
+        apagados = limpar_baldes_expirados(conn)
+    click.echo(f'{apagados} balde(s) removido(s).')
+
+
+@app.cli.command('assinar-perfilamento')
+def assinar_perfilamento_comando():
+    """Imprime um valor para o cabeçalho X-Perfilar, válido por 5 minutos."""
+    from perfilador import CABECALHO, assinar_perfilamento
+    click.echo(f'{CABECALHO}: {assinar_perfilamento()}')
+
+
+@app.cli.command('criar-empresa')
+@click.option('--nome', required=True, help='Nome da empresa.')
+@click.option('--subdominio', default=None, help='Atende em <subdominio>.<DOMINIO_BASE>.')
+@click.option('--dominio', default=None, help='Domínio próprio da empresa.')
+@click.option('--senha-master', prompt=True, hide_input=True, confirmation_prompt=True,
+              help='Senha do usuário master da empresa.')
+def criar_empresa_comando(nome, subdominio, dominio, senha_master):
+    """Cadastra uma nova empresa (tenant) com usuário master, configuração e cargos padrão."""
+    from aplicacao import db
+    from modelos import Empresa
+    from tenancia import provisionar_empresa
+
+    empresa = Empresa(nome=nome, subdominio=subdominio, dominio=dominio, ativa=True)
+    db.session.add(empresa)
+    db.session.flush()
+    provisionar_empresa(empresa, senha_master)
+    db.session.commit()
+    click.echo(f'Empresa {empresa.nome} criada (id {empresa.id}).')
+
+
+def _consultas_agendamentos_criticas():
+    """
+    Versões das consultas de dashboard(), agendamentos(), agendar() e relatorios()
+    usadas para conferir o plano de execução. Os ids são fictícios; o que importa
+    é o formato dos filtros e das ordenações.
+    """
+    from sqlalchemy import select, func, and_
+    from modelos import Agendamento
+    from periodos import agora_local, periodo_ano, periodo_dia, periodo_mes
+
+    dia, mes, ano = periodo_dia(), periodo_mes(), periodo_ano()
+    mes_local = func.extract('month', Agendamento.data_agendamento)
+    # Durante as requisições toda consulta carrega o filtro da empresa atual (tenancia.py)
+    contar = select(func.count()).select_from(Agendamento).where(Agendamento.empresa_id == 1)
+    listar = select(Agendamento.id).where(Agendamento.empresa_id == 1)
+
+    return {
+        'dashboard: pendentes': contar.where(Agendamento.status == 'agendado'),
+        'dashboard: hoje': contar.where(Agendamento.data_agendamento >= dia.inicio,
+                                        Agendamento.data_agendamento < dia.fim),
+        'dashboard: recentes': listar.order_by(Agendamento.criado_em.desc()).limit(5),
+        'dashboard: funcionário hoje': contar.where(Agendamento.funcionario_id == 1,
+                                                    Agendamento.data_agendamento >= dia.inicio,
+                                                    Agendamento.data_agendamento < dia.fim),
+        'dashboard: funcionário pendentes': contar.where(Agendamento.funcionario_id == 1,
+                                                         Agendamento.status == 'agendado'),
+        'dashboard: cliente próximos': contar.where(Agendamento.cliente_id == 1,
+                                                    Agendamento.data_agendamento > agora_local(),
+                                                    Agendamento.status == 'agendado'),
+        'agendamentos: master': listar.order_by(Agendamento.data_agendamento.desc()).limit(10),
+        'agendamentos: funcionário': listar.where(Agendamento.funcionario_id == 1)
+                                           .order_by(Agendamento.data_agendamento.desc()).limit(10),
+        'agendamentos: cliente': listar.where(Agendamento.cliente_id == 1)
+                                       .order_by(Agendamento.data_agendamento.desc()).limit(10),
+        'agendar: conflito': listar.where(and_(Agendamento.funcionario_id == 1,
+                                               Agendamento.status == 'agendado',
+                                               Agendamento.data_agendamento < dia.fim,
+                                               Agendamento.data_fim > dia.inicio)).limit(1),
+        'relatorios: mês': contar.where(Agendamento.data_agendamento >= mes.inicio,
+                                        Agendamento.data_agendamento < mes.fim),
+        'relatorios: concluídos': contar.where(Agendamento.status == 'concluido'),
+        'relatorios: por mês': select(mes_local, func.count())
+                               .where(Agendamento.empresa_id == 1,
+                                      Agendamento.data_agendamento >= ano.inicio,
+                                      Agendamento.data_agendamento < ano.fim)
+                               .group_by(mes_local),
+    }
+
+
+@app.cli.command('verificar-indices')
+def verificar_indices_comando():
+    """Confere via EXPLAIN que as consultas frequentes de agendamentos usam índice."""
+    from aplicacao import db
+
+    falhas = 0
+    with db.engine.connect() as conn:
+        # Em bases pequenas o planejador prefere seq scan; desligá-lo mostra se há índice utilizável
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        for nome, consulta in _consultas_agendamentos_criticas().items():
+            compilada = consulta.compile(dialect=conn.dialect)
+            plano = '\n'.join(linha[0] for linha in conn.exec_driver_sql('EXPLAIN ' + compilada.string, compilada.params))
+            usa_indice = 'Index' in plano
+            falhas += not usa_indice
+            click.echo(f"[{'ok' if usa_indice else 'SEM ÍNDICE'}] {nome}")
+            if not usa_indice:
+                click.echo(plano)
+        conn.rollback()
+
+    if falhas:
+        raise SystemExit(1)
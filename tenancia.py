@@ -0,0 +1,134 @@
+import logging
+from flask import abort, g, request
+from sqlalchemy import event
+from sqlalchemy.orm import with_loader_criteria
+from aplicacao import app, db
+from cache import CacheLRU
+from modelos import Empresa, PertenceEmpresa, Usuario, Cargo, ConfiguracaoEmpresa
+from replica import SessaoRoteada
+
+# Modo multiempresa: cada requisição pertence à empresa (tenant) resolvida pelo host.
+#
+#   <subdominio>.<DOMINIO_BASE>  -> Empresa.subdominio
+#   qualquer outro host          -> Empresa.dominio
+#
+# Hosts desconhecidos caem na primeira empresa (instalações de uma empresa só continuam
+# funcionando sem configuração) ou, com EXIGIR_EMPRESA_POR_HOST, recebem 404.
+# Durante a requisição todas as consultas ORM dos modelos PertenceEmpresa são filtradas
+# pela empresa atual; tarefas de linha de comando, sem requisição, enxergam todas.
+
+# host -> empresa_id; só hosts encontrados são guardados, para que empresas novas valham na hora.
+# A chave None guarda a empresa padrão.
+_empresas_por_host = CacheLRU(1024)
+
+CARGOS_PADRAO = [
+    {'nome': 'Gerente', 'descricao': 'Gerente geral'},
+    {'nome': 'Atendente', 'descricao': 'Atendimento ao cliente'},
+    {'nome': 'Especialista', 'descricao': 'Especialista técnico'},
+]
+
+
+def empresa_atual_id():
+    """Id da empresa da requisição atual, ou None fora de uma requisição."""
+    return g.get('empresa_id')
+
+
+def _buscar_empresa_por_host(host):
+    dominio_base = app.config.get('DOMINIO_BASE')
+    consulta = Empresa.query.filter(Empresa.ativa.is_(True))
+    if dominio_base and host.endswith('.' + dominio_base):
+        subdominio = host[:-len(dominio_base) - 1]
+        empresa = consulta.filter(Empresa.subdominio == subdominio).first()
+        if empresa:
+            return empresa.id
+    empresa = consulta.filter(Empresa.dominio == host).first()
+    return empresa.id if empresa else None
+
+
+def _empresa_padrao_id():
+    empresa_id = _empresas_por_host.obter(None)
+    if empresa_id is None:
+        empresa_id = db.session.query(db.func.min(Empresa.id)).scalar()
+        if empresa_id is not None:
+            _empresas_por_host.definir(None, empresa_id)
+    return empresa_id
+
+
+def resolver_empresa(host):
+    """Retorna o id da empresa dona do host (sem porta), ou None se não houver."""
+    host = host.split(':', 1)[0].lower()
+    empresa_id = _empresas_por_host.obter(host)
+    if empresa_id is None:
+        empresa_id = _buscar_empresa_por_host(host)
+        if empresa_id is not None:
+            _empresas_por_host.definir(host, empresa_id)
+    return empresa_id
+
+
+@app.before_request
+def definir_empresa_da_requisicao():
+    if request.endpoint == 'static':
+        return
+    empresa_id = resolver_empresa(request.host)
+    if empresa_id is None:
+        if app.config.get('EXIGIR_EMPRESA_POR_HOST'):
+            abort(404)
+        empresa_id = _empresa_padrao_id()
+    g.empresa_id = empresa_id
+
+
+@event.listens_for(SessaoRoteada, 'do_orm_execute')
+def _filtrar_por_empresa(estado):
+    empresa_id = empresa_atual_id()
+    if empresa_id is None or estado.is_column_load or estado.is_relationship_load \
+            or estado.execution_options.get('todas_empresas'):
+        return
+    if estado.is_select or estado.is_update or estado.is_delete:
+        estado.statement = estado.statement.options(
+            with_loader_criteria(PertenceEmpresa, lambda cls: cls.empresa_id == empresa_id, include_aliases=True)
+        )
+
+
+@event.listens_for(SessaoRoteada, 'before_flush')
+def _atribuir_empresa(sessao, contexto, instancias):
+    empresa_id = empresa_atual_id()
+    if empresa_id is None:
+        return
+    for objeto in sessao.new:
+        if isinstance(objeto, PertenceEmpresa) and objeto.empresa_id is None:
+            objeto.empresa_id = empresa_id
+
+
+def provisionar_empresa(empresa, senha_master='master123'):
+    """
+    Cria o usuário master, a configuração e os cargos padrão de uma empresa, quando
+    ainda não existirem. Não depende da empresa da requisição; não faz commit.
+    """
+    from werkzeug.security import generate_password_hash
+
+    master = Usuario.query.filter_by(empresa_id=empresa.id, username='master').first()
+    if not master:
+        db.session.add(Usuario(
+            empresa_id=empresa.id,
+            username='master',
+            email='master@jtsistemas.com',
+            password_hash=generate_password_hash(senha_master),
+            tipo_usuario='master',
+            nome='Administrador Master',
+            ativo=True
+        ))
+        logging.info(f"Usuário master criado para a empresa {empresa.nome}")
+
+    if not ConfiguracaoEmpresa.query.filter_by(empresa_id=empresa.id).first():
+        db.session.add(ConfiguracaoEmpresa(
+            empresa_id=empresa.id,
+            nome_empresa=empresa.nome,
+            logo_path=None,
+            whatsapp_token='',
+            whatsapp_phone_id='',
+            whatsapp_webhook_verify_token=''
+        ))
+
+    for pos_data in CARGOS_PADRAO:
+        if not Cargo.query.filter_by(empresa_id=empresa.id, nome=pos_data['nome']).first():
+            db.session.add(Cargo(empresa_id=empresa.id, **pos_data))